@@ -1,7 +1,6 @@
 #!/usr/bin python
 # -*- coding: utf-8 -*-
 import gc
-import copy
 import pyqtgraph.parametertree.parameterTypes as pTypes
 from pyqtgraph.Qt import QtCore
 from pyqtgraph import BusyCursor
@@ -9,12 +8,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from lib.flowchart.nodes.generalNode import NodeWithCtrlWidget, NodeCtrlWidget
-from lib.functions.interpolate import applyInterpolationBasedOnRanges, createInterpolationRanges
+from lib.functions.interpolate import interpolateColumns
 
 
 class interpolateDfNode(NodeWithCtrlWidget):
     """Interpolate missing data in given DataFrame"""
     nodeName = "Interpolate"
+    uiTemplate = [
+        {'title': 'Processes', 'name': 'processes', 'type': 'int', 'value': 1, 'default': 1, 'limits': (0, 256), 'tip': 'Number of worker processes. 0 - use all CPUs.\nA pool is started only if more than one column is interpolated'},
+    ]
 
     def __init__(self, name, parent=None, **kwargs):
         super(interpolateDfNode, self).__init__(name, parent=parent, terminals={'In': {'io': 'in'}, 'Out': {'io': 'out'}}, color=(250, 250, 150, 150), **kwargs)
@@ -26,11 +28,11 @@ class interpolateDfNode(NodeWithCtrlWidget):
     def process(self, In):
         df = In
         if df is None:
-            self._ctrlWidget.p.clearChildren()
+            self.deleteAllColumns()
             return {'Out': None}
 
         receivedColumns = df.columns
-        currentColumns  = [item.name() for item in self._ctrlWidget.p.children()]
+        currentColumns  = self._ctrlWidget.columnNames()
         
         # First take care of ParameterTree Widget.Remove missing and add new ParameterGroups
         for colName in receivedColumns:
@@ -53,8 +55,9 @@ class interpolateDfNode(NodeWithCtrlWidget):
         
         nN = len(df.index)
         with BusyCursor():
-            df_out = copy.deepcopy(df)
-            # evaluation we will do column by column
+            # only the new `_interpolated` columns are added, the input columns are not copied
+            df_out = df.copy(deep=False)
+            COLUMNS = dict()  # columns with NaNs, they are interpolated in parallel
             for colName in self._columnsToUpdate:
                 validN = df_out[colName].count()
                 nanN   = nN - validN
@@ -62,7 +65,6 @@ class interpolateDfNode(NodeWithCtrlWidget):
                 self._ctrlWidget.param(colName).nNansBefore.setValue(nanN)
                 
                 if nanN > 0:
-                    #print( 'Updating ...', colName)
                     params = self._ctrlWidget.prepareInputArguments(columnName=colName)
                     realKwargs = {
                                     'method': params['method'],
@@ -72,19 +74,21 @@ class interpolateDfNode(NodeWithCtrlWidget):
                     if isinstance(params['**kwargs'], dict):
                         for key, val in params['**kwargs'].iteritems():
                             realKwargs[key] = val
-                    #print( '>>>', colName, 'Real KWARGS >>>', realKwargs)
-                    ranges2treat = createInterpolationRanges(df_out, colName, interpolateMargin=params['interpolateMargin'])
-                    
-                    #print( '>>>', colName, 'ranges >>>', ranges2treat)
-                    applyInterpolationBasedOnRanges(df_out, colName, ranges2treat, **realKwargs)
-                    nNansAfter = nN-df_out[colName+'_interpolated'].count()
-
-                    self._ctrlWidget.p.child(colName).child('Plot').show()  #show plotButton for parameter with NaNs
+                    COLUMNS[colName] = (params['interpolateMargin'], realKwargs)
                 else:
-                    #print( 'Skipping ...', colName, '(no NaNs)')
                     self._ctrlWidget.p.child(colName).child('Plot').hide()  #hide plotButton for parameter without NaNs
-                    nNansAfter = 0
+                    self._ctrlWidget.p.child(colName).nNansAfter.setValue(0)
+                    self._ctrlWidget.p.child(colName).time.setValue('-')
+
+            interpolated, timing = interpolateColumns(df, COLUMNS, processes=self._ctrlWidget.param('processes').value() or None)
+            for colName in self._columnsToUpdate:  # keep the order of the columns
+                if colName not in interpolated:
+                    continue
+                df_out[colName+'_interpolated'] = interpolated[colName]
+                nNansAfter = nN-df_out[colName+'_interpolated'].count()
+                self._ctrlWidget.p.child(colName).child('Plot').show()  #show plotButton for parameter with NaNs
                 self._ctrlWidget.p.child(colName).nNansAfter.setValue(nNansAfter)
+                self._ctrlWidget.p.child(colName).time.setValue('{0:.3f} s'.format(timing[colName]))
 
         self._columnsToUpdate = list()
         gc.collect()
@@ -105,9 +109,7 @@ class interpolateDfNode(NodeWithCtrlWidget):
         self.update()
 
     def deleteAllColumns(self):
-        currentColumns = [item.name() for item in self._ctrlWidget.p.children()]
-        currentColumns.remove('Help')  # we have this Extra button
-        for colName in currentColumns:
+        for colName in self._ctrlWidget.columnNames():
             self._ctrlWidget.removeDfColumn(colName)
 
     @QtCore.pyqtSlot(object)
@@ -146,6 +148,14 @@ class interpolateDfNodeCtrlWidget(NodeCtrlWidget):
     def __init__(self, **kwargs):
         super(interpolateDfNodeCtrlWidget, self).__init__(**kwargs)
 
+    def columnNames(self):
+        """ names of the column parameter groups (node-level params, e.g. `processes`, are skipped)"""
+        return [item.name() for item in self.p.children() if isinstance(item, columnInterpolateGroupParameter)]
+
+    def restoreState(self, state):
+        """ keep node-level params missing in the states saved by older versions"""
+        self.p.restoreState(state, removeChildren=False)
+
     def addDfColumn(self, columnName):
         columnParam = columnInterpolateGroupParameter(name=columnName)
         self.p.addChild(columnParam)
@@ -195,6 +205,7 @@ class columnInterpolateGroupParameter(pTypes.GroupParameter):
         self.addChild({'name': 'Entries', 'type': 'int', 'value': -1, 'readonly': True, 'tip': 'number of entries in current column'})
         self.addChild({'name': 'NaNs before', 'type': 'int', 'value': -1, 'readonly': True, 'tip': 'number of NaNs in current column before interpolation'})
         self.addChild({'name': 'NaNs after', 'type': 'int', 'value': -1, 'readonly': True, 'tip': 'number of NaNs in current column after interpolation'})
+        self.addChild({'name': 'Time', 'type': 'str', 'value': '-', 'readonly': True, 'tip': 'time spent on the interpolation of current column'})
         
         self.addChild({'name': 'interpolateMargin', 'type': 'int', 'value': 100, 'step': 1, 'limits': (1, int(1000)), 'default': 100, 'tip': 'number of data-points to consider left and\nright from NaN value during interpolation'})
         self.addChild({'name': 'method', 'type': 'list', 'value': 'linear', 'values': ['linear', 'time', 'index', 'values', 'nearest', 'zero', 'slinear', 'quadratic', 'cubic', 'barycentric', 'krogh', 'polynomial', 'spline', 'piecewise_polynomial', 'pchip'], 'default': 'polynomial', 'tip': 'Method of interpolation. See docs'})
@@ -205,3 +216,4 @@ class columnInterpolateGroupParameter(pTypes.GroupParameter):
         self.nEntries = self.param('Entries')
         self.nNansBefore = self.param('NaNs before')
         self.nNansAfter = self.param('NaNs after')
+        self.time = self.param('Time')
@@ -6,7 +6,10 @@ import numpy as np
 
 from lib.flowchart.nodes.generalNode import NodeWithCtrlWidget, NodeCtrlWidget
 from lib.functions.general import isNumpyDatetime, isNumpyNumeric
-from lib.functions.detectpeaks import full_peak_detection_routine, prepare_order, prepare_datetime
+from lib.functions.detectpeaks import full_peak_detection_routine, multicolumn_peak_detection_routine, prepare_order, prepare_datetime, determine_n_values_in_t
+
+import logging
+logger = logging.getLogger(__name__)
 
 
 class detectPeaksTSNode_v2(NodeWithCtrlWidget):
@@ -15,12 +18,19 @@ class detectPeaksTSNode_v2(NodeWithCtrlWidget):
     uiTemplate = [
         {'title': 'data', 'name': 'column', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Column name with hydrograph data'},
         {'name': 'datetime', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Location of the datetime objects.'},
+        {'title': 'All numeric columns', 'name': 'all_columns', 'type': 'bool', 'value': False, 'default': False, 'tip': 'Detect peaks in all numeric columns at once (in parallel).\nParameter `column` is ignored, terminals `raw` and `peaks`\nreceive long-format tables with column `name`.\nPeaks are not ignored and not plotted in this mode', 'children': [
+            {'title': 'Processes', 'name': 'processes', 'type': 'int', 'value': 0, 'default': 0, 'limits': (0, 256), 'tip': 'Number of worker processes. 0 - use all CPUs'},
+        ]},
         {'name': 'Peak Detection Params', 'type': 'group', 'children': [
             {'name': 'T', 'type': 'float', 'value': 12.42, 'default': 12.42, 'suffix': ' hours', 'tip': 'Awaited period of the signal in hours.'},
             {'title': 'dt', 'name': 'hMargin', 'type': 'float', 'value': 1.5, 'default': 1.5, 'limits': (0., 100.), 'suffix': ' hours', 'tip': 'Number of hours, safety margin when comparing period length.\nSee formula below:\nT/2 - dt < T_i/2 < T/2 + dt'},
             {'name': 'order', 'type': 'str', 'value': '?', 'readonly': True, 'tip': 'How many points on each side to use for the comparison'},
             {'name': 'mode', 'type': 'list', 'values': ['clip', 'wrap'], 'value': 'clip', 'default': 'clip', 'tip': 'How the edges of the vector are treated. ‘wrap’ (wrap around)\nor ‘clip’ (treat overflow as the same as the last (or first) element)'},
-            {'name': 'removeRegions', 'type': 'bool', 'value': True, 'readonly': True, 'default': True, 'visible': False, 'tip': "remove possible multiple peaks that go one-by-one"}
+            {'name': 'removeRegions', 'type': 'bool', 'value': True, 'readonly': True, 'default': True, 'visible': False, 'tip': "remove possible multiple peaks that go one-by-one"},
+            {'name': 'engine', 'type': 'list', 'values': ['argrelextrema', 'find_peaks'], 'value': 'argrelextrema', 'default': 'argrelextrema', 'tip': 'Peak detection engine:\n"argrelextrema" - peak is the extreme value within [-order:+order] values\n"find_peaks" - peaks with sufficient prominence and width, that are\nat least `order` values apart. Robust against sensor spikes'},
+            {'name': 'prominence', 'type': 'float', 'value': 0., 'default': 0., 'limits': (0., 1.e6), 'tip': 'Only for engine "find_peaks".\nMinimal prominence of the peaks (units of the data).\n0 - no limit'},
+            {'name': 'width', 'type': 'float', 'value': 1., 'default': 1., 'limits': (0., 1.e6), 'suffix': ' hours', 'tip': 'Only for engine "find_peaks".\nMinimal width of the peaks at half prominence.\nSensor spikes are narrower than tidal peaks.\n0 - no limit'},
+            {'title': 'Sub-sample refinement', 'name': 'refine', 'type': 'list', 'values': ['none', 'parabolic', 'cubic'], 'value': 'none', 'default': 'none', 'tip': 'Refine time and value of the peaks between the sampling points.\n"parabolic" - parabola through the peak and its 2 neighbours\n"cubic" - least-squares cubic through the peak and its 4 neighbours\nAdds columns `Datetime refined`, `value refined` to `raw` and\n`time_min_refined`, `time_max_refined`, ... to `peaks`'}
         ]},
         {'title': 'Ignore peaks', 'name': 'ignore', 'type': 'bool', 'value': False, 'default': False, 'tip': 'Checkbox to ignore peaks that are mentioned in parameter `Peak IDs', 'children': [
             {'title': 'Peak IDs', 'name': 'peaks2ignore', 'type': 'str', 'value': '', 'default': '', 'tip': 'IDs of the peaks that will be ignored. IDs can be found in table in terminal `raw`. \nInteger or a comma-separated integer list.\n Example:\n12\n0, 12, 1153'},
@@ -82,15 +92,35 @@ class detectPeaksTSNode_v2(NodeWithCtrlWidget):
         kwargs['split'] = True
 
         with BusyCursor():
-            kwargs['order'] = prepare_order(kwargs['T'], kwargs['hMargin'], prepare_datetime(df, datetime=kwargs['datetime']))
+            date = prepare_datetime(df, datetime=kwargs['datetime'])
+            kwargs['order'] = prepare_order(kwargs['T'], kwargs['hMargin'], date)
             self.CW().param('Peak Detection Params', 'order').setValue(str(kwargs['order']))
+            if kwargs.get('width') is not None:
+                # hours => number of values
+                kwargs['width'] = determine_n_values_in_t(date, np.timedelta64(int(kwargs['width']*3600), 's'))[1]
 
 
             #peaks = detectPeaks_ts(df, kwargs.pop('column'), plot=self._plotRequired, **kwargs)
-            extra, raw, peaks = full_peak_detection_routine(df, col=kwargs.pop('column'), date_col=kwargs.pop('datetime'),
-                    IDs2mask=kwargs.pop('IDs2mask'), valid_range=kwargs.pop('valid_range'),
-                    plot=self._plotRequired,
-                    **kwargs)
+            if kwargs.pop('all_columns'):
+                kwargs.pop('column')
+                if kwargs.pop('IDs2mask'):
+                    # peak IDs are numbered per column, a single list cannot be applied to all of them
+                    logger.warning('Node [{0}]: peaks to ignore are not applied in the `All numeric columns` mode'.format(self.name()))
+                EXTRA, raw, peaks = multicolumn_peak_detection_routine(df, date_col=kwargs.pop('datetime'),
+                        valid_range=kwargs.pop('valid_range'), processes=kwargs.pop('processes') or None,
+                        **kwargs)
+                extra = {'warnings': {'MIN': [], 'MAX': [], 'ALL': []}, 'raw_nmin': 0, 'raw_nmax': 0}
+                for e in EXTRA.values():
+                    for which in ('MIN', 'MAX', 'ALL'):
+                        extra['warnings'][which] += e['warnings'][which]
+                    extra['raw_nmin'] += e['raw_nmin']
+                    extra['raw_nmax'] += e['raw_nmax']
+            else:
+                kwargs.pop('processes')
+                extra, raw, peaks = full_peak_detection_routine(df, col=kwargs.pop('column'), date_col=kwargs.pop('datetime'),
+                        IDs2mask=kwargs.pop('IDs2mask'), valid_range=kwargs.pop('valid_range'),
+                        plot=self._plotRequired,
+                        **kwargs)
 
             n_warn_min = len(extra['warnings']['MIN'])
             n_warn_max = len(extra['warnings']['MAX'])
@@ -146,17 +176,36 @@ class detectPeaksTSNode_v2CtrlWidget(NodeCtrlWidget):
         self.disconnect_valueChanged2upd(self.param('out_grp', 'raw_n_all'))
         
         self.param('Plot').sigActivated.connect(self._parent.plot)
+        self.param('Peak Detection Params', 'engine').sigValueChanged.connect(self.on_engine_changed)
+        self.on_engine_changed()
+
+    def on_engine_changed(self, *args):
+        """ `prominence` and `width` are used only by the engine "find_peaks" """
+        find_peaks = self.param('Peak Detection Params', 'engine').value() == 'find_peaks'
+        self.param('Peak Detection Params', 'prominence').setWritable(find_peaks)
+        self.param('Peak Detection Params', 'width').setWritable(find_peaks)
+
+    def restoreState(self, state):
+        super(detectPeaksTSNode_v2CtrlWidget, self).restoreState(state)
+        self.on_engine_changed()
 
 
     def prepareInputArguments(self):
         kwargs = dict()
         kwargs['column']    = self.param('column').value()
         kwargs['datetime']  = self.param('datetime').value()
+        kwargs['all_columns'] = self.param('all_columns').value()
+        kwargs['processes'] = self.param('all_columns', 'processes').value()
         kwargs['T']         = self.param('Peak Detection Params', 'T').value()
         kwargs['hMargin']   = self.param('Peak Detection Params', 'hMargin').value()
         kwargs['mode']      = self.param('Peak Detection Params', 'mode').value()
         kwargs['IDs2mask']  = [int(val) for val in self.param('ignore', 'peaks2ignore').value().split(',')] if (self.param('ignore').value() is True and self.param('ignore', 'peaks2ignore').value() != '') else []
         kwargs['removeRegions'] = self.param('Peak Detection Params', 'removeRegions').value()
+        kwargs['engine']    = self.param('Peak Detection Params', 'engine').value()
+        if kwargs['engine'] == 'find_peaks':  # other engines ignore them, keep them out of the cache key
+            kwargs['prominence'] = self.param('Peak Detection Params', 'prominence').value() or None
+            kwargs['width']      = self.param('Peak Detection Params', 'width').value() or None
+        kwargs['refine']    = None if self.param('Peak Detection Params', 'refine').value() == 'none' else self.param('Peak Detection Params', 'refine').value()
         kwargs['valid_range']   = {
                                 'MIN': [np.timedelta64(int(self.param('check_grp', 'MIN_grp', 'range1').value()*3600), 's'),
                                         np.timedelta64(int(self.param('check_grp', 'MIN_grp', 'range2').value()*3600), 's')],
@@ -3,7 +3,7 @@
 from pyqtgraph import BusyCursor
 from numpy import nan
 from lib.flowchart.nodes.generalNode import NodeWithCtrlWidget, NodeCtrlWidget
-from lib.functions.TimeLag import timelag_erskine1991_method
+from lib.functions.TimeLag import timelag_erskine1991_method, timelag_crosscorrelation_method, timelag_erskine1991_adaptive
 from lib.functions.general import isNumpyDatetime
 
 
@@ -15,7 +15,7 @@ class timeLagNode(NodeWithCtrlWidget):
             {'name': 'river_dtime', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Location of the datetime objects\nin `df_w` dataframe'},
             {'name': 'gw', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Column name with GROUNDWATER hydrograph data\nin `df_gw` dataframe'},
             {'name': 'gw_dtime', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Location of the datetime objects\nin `df_gw` dataframe'},
-            {'name': 'method', 'type': 'list', 'value': '1) Erskine 1991', 'default': '1) Erskine 1991', 'values': ['1) Erskine 1991'], 'tip': 'Method to calculate TimeLag. Read docs'},
+            {'name': 'method', 'type': 'list', 'value': '1) Erskine 1991', 'default': '1) Erskine 1991', 'values': ['1) Erskine 1991', '2) Cross-correlation (FFT)', '3) Erskine 1991 (adaptive)'], 'tip': 'Method to calculate TimeLag. Read docs\n"1) Erskine 1991" - minimal sum of squared errors, brute-force over timelags [t1:t2] with step t_step\n"2) Cross-correlation (FFT)" - maximum of the cross-correlation within [t1:t2],\nrefined between the time steps (t_step is ignored)\n"3) Erskine 1991 (adaptive)" - coarse scan of [t1:t2], then golden-section search\ndown to `resolution` (t_step is ignored). Reports a confidence interval'},
             
             {'title': 'Tidal Efficiency Parameters', 'name': 'E_grp', 'type': 'group', 'tip': '', 'expanded': True, 'children': [
                 {'title': 'Tidal Efficiency', 'name': 'E', 'type': 'float', 'value': None, 'limits': (0, 1), 'step': 0.1, 'tip': 'Tidal Efficiency (dimensionless)'},
@@ -25,7 +25,12 @@ class timeLagNode(NodeWithCtrlWidget):
                 {'name': 't1', 'type': 'int', 'value': 0, 'default': 0, 'limits': (0, int(10e3)), 'tip': 'First value for timelag-iteration tuple. In minutes. Read docs'},
                 {'name': 't2', 'type': 'int', 'value': 60, 'default': 60, 'limits': (0, int(10e3)), 'tip': 'Last value for timelag-iteration tuple. In minutes. Read docs'},
                 {'name': 't_step', 'type': 'int', 'value': 1, 'default': 1, 'limits': (1, int(10e3)), 'tip': 'Step value for timelag-iteration tuple. In minutes. Read docs'},
-                {'name': 'tlag = ', 'type': 'str', 'readonly': True, 'value': None}
+                {'name': 'resolution', 'type': 'float', 'value': 1., 'default': 1., 'limits': (1.e-3, 1.e6), 'suffix': ' sec', 'tip': 'Only for method "3) Erskine 1991 (adaptive)".\nTarget resolution of the timelag. In seconds'},
+                {'name': 'tlag = ', 'type': 'str', 'readonly': True, 'value': None},
+                {'title': '95% interval', 'name': 'ci', 'type': 'str', 'readonly': True, 'value': None, 'tip': 'Only for method "3) Erskine 1991 (adaptive)".\nConfidence interval of the timelag'},
+                {'title': 'Compare methods', 'name': 'compare', 'type': 'bool', 'value': False, 'default': False, 'tip': 'Additionally calculate timelag with the other methods', 'children': [
+                    {'name': 'tlag (other methods) = ', 'type': 'str', 'readonly': True, 'value': None},
+                ]},
                 ]}
         ]
 
@@ -34,6 +39,7 @@ class timeLagNode(NodeWithCtrlWidget):
                  'df_w': {'io': 'in'},
                  'E': {'io': 'in'},
                  'tlag': {'io': 'out'},
+                 'sse': {'io': 'out'},
                  }
         super(timeLagNode, self).__init__(name, parent=parent, terminals=terms, color=(250, 250, 150, 150))
 
@@ -43,11 +49,13 @@ class timeLagNode(NodeWithCtrlWidget):
     def process(self, df_gw, df_w, E):
         if df_gw is None or df_w is None:
             raise Exception('Hydrograph data not found in terminals `df_gw` or `df_w`')
-            return {'tlag': None}
+            return {'tlag': None, 'sse': None}
         if E in [None, nan]:
             raise Exception('Tidal efficiency is invalid: E={0}'.format(E))
-            return {'tlag': None}
+            return {'tlag': None, 'sse': None}
         self.CW().param('tlag_grp', 'tlag = ').setValue('?')
+        self.CW().param('tlag_grp', 'ci').setValue('?')
+        self.CW().param('tlag_grp', 'compare', 'tlag (other methods) = ').setValue('?')
 
         colname = [col for col in df_gw.columns if not isNumpyDatetime(df_gw[col].dtype)]
         self.CW().param('gw').setLimits(colname)
@@ -67,16 +75,33 @@ class timeLagNode(NodeWithCtrlWidget):
         kwargs = self.CW().prepareInputArguments()
         E = kwargs['E']
         # and i would have to block the signals here...
-        with BusyCursor():
-            if kwargs['method'] == '1) Erskine 1991':
-                tlag = timelag_erskine1991_method(df_gw, kwargs['gw'], kwargs['gw_dtime'],
+        def adaptive():
+            tlag, extra = timelag_erskine1991_adaptive(df_gw, kwargs['gw'], kwargs['gw_dtime'],
+                                    df_w, kwargs['river'], kwargs['river_dtime'],
+                                    E, tlag_range=(kwargs['t1'], kwargs['t2']), resolution=kwargs['resolution'], log=True)
+            ci = extra['ci']
+            self.CW().param('tlag_grp', 'ci').setValue('?' if ci is None else '{0} ... {1}'.format(ci[0], ci[1]))
+            return tlag, extra['curve']
+
+        methods = {
+            '1) Erskine 1991': lambda: timelag_erskine1991_method(df_gw, kwargs['gw'], kwargs['gw_dtime'],
                                     df_w, kwargs['river'], kwargs['river_dtime'],
-                                    E, tlag_tuple=(kwargs['t1'], kwargs['t2'], kwargs['t_step']), log=True)
-            else:
+                                    E, tlag_tuple=(kwargs['t1'], kwargs['t2'], kwargs['t_step']), log=True, return_curve=True),
+            '2) Cross-correlation (FFT)': lambda: timelag_crosscorrelation_method(df_gw, kwargs['gw'], kwargs['gw_dtime'],
+                                    df_w, kwargs['river'], kwargs['river_dtime'],
+                                    E, tlag_range=(kwargs['t1'], kwargs['t2']), log=True, return_curve=True),
+            '3) Erskine 1991 (adaptive)': adaptive,
+        }
+        with BusyCursor():
+            if kwargs['method'] not in methods:
                 raise Exception('Method <%s> not yet implemented' % kwargs['method'])
-        
+            tlag, sse = methods[kwargs['method']]()
             self.CW().param('tlag_grp', 'tlag = ').setValue(str(tlag))
-        return {'tlag': tlag}
+
+            if kwargs['compare']:
+                others = ['{0}: {1}'.format(method, methods[method]()[0]) for method in sorted(methods) if method != kwargs['method']]
+                self.CW().param('tlag_grp', 'compare', 'tlag (other methods) = ').setValue('\n'.join(others))
+        return {'tlag': tlag, 'sse': sse}
 
 
 class timeLagNodeCtrlWidget(NodeCtrlWidget):
@@ -84,6 +109,8 @@ class timeLagNodeCtrlWidget(NodeCtrlWidget):
     def __init__(self, **kwargs):
         super(timeLagNodeCtrlWidget, self).__init__(update_on_statechange=True, **kwargs)
         self.disconnect_valueChanged2upd(self.param('tlag_grp', 'tlag = '))
+        self.disconnect_valueChanged2upd(self.param('tlag_grp', 'ci'))
+        self.disconnect_valueChanged2upd(self.param('tlag_grp', 'compare', 'tlag (other methods) = '))
         #self.disconnect_valueChanged2upd(self.param('E_grp', 'manual_E'))
         #self.param('E_grp', 'manual_E').sigValueChanged.connect(self.toggle_manualE)
 
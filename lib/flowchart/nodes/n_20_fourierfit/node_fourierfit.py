@@ -1,13 +1,14 @@
 #!/usr/bin python
 # -*- coding: utf-8 -*-
 from __future__ import division
+import time
 import numpy as np
 import pandas as pd
 from pyqtgraph import BusyCursor
 
 from lib.functions.general import isNumpyDatetime, isNumpyNumeric
 from lib.flowchart.nodes.generalNode import NodeWithCtrlWidget, NodeCtrlWidget
-from lib.functions.fourier import pandas_fourier_analysis
+from lib.functions.fourier import pandas_fourier_analysis, pandas_welch_spectrum
 
 
 class fourierFitNode(NodeWithCtrlWidget):
@@ -17,8 +18,12 @@ class fourierFitNode(NodeWithCtrlWidget):
             {'title': 'Signal', 'name': 'sig', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Name of the column with waterlevel data.'},
             {'title': 'Datetime', 'name': 'datetime', 'type': 'list', 'value': None, 'default': None, 'values': [None], 'tip': 'Name of the column with datetime (or __index__)'},
             
+            {'title': 'Method', 'name': 'method', 'type': 'list', 'value': 'Fourier fit', 'default': 'Fourier fit', 'values': ['Fourier fit', 'Welch spectrum'], 'tip': '"Fourier fit" - FFT of the whole signal, the most powerful waves are used to generate equation\n"Welch spectrum" - amplitude spectrum averaged over overlapping segments (memory-bounded),\nterminal `params` receives frequency/amplitude table, no equation is generated'},
             {'title': 'Number of Waves', 'name': 'N_MAX_POW', 'type': 'int', 'value': 1, 'limits': (1, 10e10), 'tip': 'Number of partial waves used to generate equation. Partial waves with most powerful frequencies are selected at first. See docs'},
 
+            {'title': 'Segment length', 'name': 'segment_days', 'type': 'float', 'value': 15., 'default': 15., 'limits': (1e-3, 1e5), 'suffix': ' days', 'tip': 'Only for method "Welch spectrum".\nLength of one segment. Defines the frequency resolution (1/length)'},
+            {'title': 'Overlap', 'name': 'overlap', 'type': 'float', 'value': 0.5, 'default': 0.5, 'limits': (0., 0.95), 'step': 0.05, 'tip': 'Only for method "Welch spectrum".\nOverlap of the neighbour segments (fraction of the segment length)'},
+
             {'title': 'Slice datetime', 'name': 'ranges', 'type': 'bool', 'value': False},
 
             {'title': 'Datetime Start', 'name': 't0', 'type': 'str', 'value': '2015-12-31 00:00:00', 'default': '2015-12-31 00:00:00', 'tip': 'start of the slice region'},
@@ -26,6 +31,7 @@ class fourierFitNode(NodeWithCtrlWidget):
             
             {'title': 'Generated Equation', 'name': 'eq', 'type': 'text', 'value': '', 'tip': 'This equation is generated after processing. You may copy it to buffer.\nIf you want to access parameters independently consider opening table that is stored in terminal `params`'},
 
+            {'title': 'Time', 'name': 'time', 'type': 'str', 'value': '-', 'readonly': True, 'tip': 'Processing time'},
             {'title': 'Display plot', 'name': 'plot', 'type': 'action'},
 
         ]
@@ -48,6 +54,7 @@ class fourierFitNode(NodeWithCtrlWidget):
             return
 
         self.CW().param('eq').setValue('')
+        self.CW().param('time').setValue('-')
 
         if self._df_id != id(df):
             #print 'df new'
@@ -81,10 +88,16 @@ class fourierFitNode(NodeWithCtrlWidget):
         kwargs = self.CW().prepareInputArguments()
         # ------------------------------------------------------
 
+        t_start = time.time()
         with BusyCursor():
-            df_out, eq_str, function, self.fig = pandas_fourier_analysis(df, kwargs['sig'], date_name=kwargs['datetime'], ranges=kwargs['ranges'], N_MAX_POW=kwargs['N_MAX_POW'], generate_plot=True)
+            if kwargs['method'] == 'Welch spectrum':
+                df_out, n_segments, self.fig = pandas_welch_spectrum(df, kwargs['sig'], date_name=kwargs['datetime'], ranges=kwargs['ranges'], segment_days=kwargs['segment_days'], overlap=kwargs['overlap'], generate_plot=True)
+                eq_str, function = '', None
+            else:
+                df_out, eq_str, function, self.fig = pandas_fourier_analysis(df, kwargs['sig'], date_name=kwargs['datetime'], ranges=kwargs['ranges'], N_MAX_POW=kwargs['N_MAX_POW'], generate_plot=True)
         
         self.CW().param('eq').setValue(eq_str)
+        self.CW().param('time').setValue('{0:.3f} s'.format(time.time() - t_start))
         self._PLOT_REQUESTED = False
 
         return {'params': df_out, 'f(t)': function}
@@ -100,6 +113,7 @@ class fourierFitNodeCtrlWidget(NodeCtrlWidget):
     def __init__(self, **kwargs):
         super(fourierFitNodeCtrlWidget, self).__init__(**kwargs)
         self.disconnect_valueChanged2upd(self.param('eq'))
+        self.disconnect_valueChanged2upd(self.param('time'))
         self.param('plot').sigActivated.connect(self._parent.on_plot_requested)
         self.param('ranges').sigValueChanged.connect(self.on_rangesChecked)
     
@@ -118,6 +132,9 @@ class fourierFitNodeCtrlWidget(NodeCtrlWidget):
         kwargs['sig'] = self.p['sig']
         kwargs['datetime'] = self.p['datetime']
         kwargs['N_MAX_POW'] = self.p['N_MAX_POW']
+        kwargs['method'] = self.p['method']
+        kwargs['segment_days'] = self.p['segment_days']
+        kwargs['overlap'] = self.p['overlap']
         kwargs['plot'] = False
         
         return kwargs
@@ -2,6 +2,11 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import pandas as pd
+import logging
+
+from TimeLag import NaT
+
+logger = logging.getLogger(__name__)
 
 
 def tidalEfficiency_method1(df, canal, well, log=False):
@@ -89,8 +94,28 @@ def tidalEfficiency_method2(tr_canal_cycle, tr_well_cycle):
 
 
 
+def _cycle_std(values, i1, i2):
+    ''' Standard deviation (ddof=1, NaN values ignored) of `values[i1:i2+1]`
+    for every pair of bounds in `i1`, `i2`. Computed from prefix sums of the
+    values and of their squares, i.e. O(N + n_cycles). Second return value is
+    the number of valid values in each slice'''
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    offset = values[valid].mean() if valid.any() else 0.  # improves the precision of the sums of squares
+    x = np.where(valid, values - offset, 0.)
+    c_n = np.concatenate(([0], np.cumsum(valid)))
+    c_1 = np.concatenate(([0.], np.cumsum(x)))
+    c_2 = np.concatenate(([0.], np.cumsum(x*x)))
+    n = c_n[i2+1] - c_n[i1]
+    s1 = c_1[i2+1] - c_1[i1]
+    s2 = c_2[i2+1] - c_2[i1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (s2 - s1*s1/n)/(n - 1.)
+    return np.sqrt(np.where(n > 1, np.maximum(var, 0.), np.nan)), n
+
+
 def tidalEfficiency_method3(df, river, gw, datetime_col, river_cycle_time_min, river_cycle_time_max,
-        gw_cycle_time_min, gw_cycle_time_max):
+        gw_cycle_time_min, gw_cycle_time_max, return_skipped=False):
     '''
     Calculate Tidal Efficiency as the mean of the ratios (calculated
     separately for each tidal-cycle) of the standard deviation of the
@@ -103,6 +128,12 @@ def tidalEfficiency_method3(df, river, gw, datetime_col, river_cycle_time_min, r
             H_gw_i      - hydrograph of the groundwater at cycle i
             n           - total number of cycles
 
+    The cycle boundaries of all cycles are found with one `searchsorted` call
+    per array, the standard deviations are computed from cumulative sums.
+    Cycles that cannot be evaluated (NaT peak times, less than two valid
+    values in a hydrograph, flat river hydrograph) are skipped: they get
+    `NaN` in `E_cyclic` and are reported with a warning.
+
     Args:
     -----
         df (pandas.DataFrame):
@@ -113,7 +144,7 @@ def tidalEfficiency_method3(df, river, gw, datetime_col, river_cycle_time_min, r
         gw (str):
             column name of the ground-water measurements
         datetime_col (str):
-            column name of the Datetime information
+            column name of the Datetime information (must be sorted)
         river_cycle_time_min (pandas.Series, 1-D array_like):
             datetime of the MIN peak (lowwater) of the river for every tidal cycle
             Note, DATA MUST BE CLEAN!
@@ -128,15 +159,18 @@ def tidalEfficiency_method3(df, river, gw, datetime_col, river_cycle_time_min, r
             datetime of the MAX peak (highwater) of the grondwater in well
             for every tidal cycle
             Note, DATA MUST BE CLEAN!
+        return_skipped (Optional[bool]):
+            if `True` - additionally return the positions of the skipped cycles
     Returns:
     --------
         E (float):
             tidal efficiency factor
         E_cyclic (1D-nd.array):
-            tidal efficiency caclulated for each tidal cycle
+            tidal efficiency caclulated for each tidal cycle (`NaN` for
+            skipped cycles)
+        skipped (1D-nd.array):
+            positions of the skipped cycles, only if `return_skipped=True`
     '''
-    log = False
-    
     # 1. check peaks
     #   1.1 they should have equal length
     l1 = len(river_cycle_time_min)
@@ -146,45 +180,43 @@ def tidalEfficiency_method3(df, river, gw, datetime_col, river_cycle_time_min, r
     if (3*l1 - l2 - l3 - l4) != 0:
         raise Exception('Length of *peak* arrays is not equal. Aborting')
 
-
+    def to_ns(t):
+        return np.asarray(t).astype('datetime64[ns]').view(np.int64)
+    w_tmin, w_tmax = to_ns(river_cycle_time_min), to_ns(river_cycle_time_max)
+    gw_tmin, gw_tmax = to_ns(gw_cycle_time_min), to_ns(gw_cycle_time_max)
+    date = to_ns(df[datetime_col].values)
 
     # 2. Determine period
-    T = (river_cycle_time_max-river_cycle_time_min).mean()*2
-
-    if log:
-        print('Period: T=', T)
-        print('River: ', river)
-        print('Well: ', gw)
-
-    # 3. Do the calculations
-    E_cyclic = list()
-
-    for w_tmin, w_tmax, gw_tmin, gw_tmax in zip(river_cycle_time_min, river_cycle_time_max, gw_cycle_time_min, gw_cycle_time_max):
-        # 3.2 find the index of the entry closest to specific datetime
-        try:
-            w_i1 = df[datetime_col].searchsorted(w_tmin-T/4)[0]  # note, here we assume that between peak1 and peak2 is T/2
-            w_i2 = df[datetime_col].searchsorted(w_tmax+T/4)[0]  # note, here we assume that between peak1 and peak2 is T/2
-            
-            gw_i1 = df[datetime_col].searchsorted(gw_tmin-T/4)[0]  # note, here we assume that between peak1 and peak2 is T/2
-            gw_i2 = df[datetime_col].searchsorted(gw_tmax+T/4)[0]  # note, here we assume that between peak1 and peak2 is T/2
-        except:
-            continue
-            
-        hydr_w  = df.ix[w_i1:w_i2, river]
-        hydr_gw  = df.ix[gw_i1:gw_i2, gw]
-
-        E_i = hydr_gw.std()/hydr_w.std()
-        E_cyclic.append(E_i)
-        if log:
-            print('-'*50)
-            print('River cycle: {0}:{1}\tSTD={2}'.format(w_i1, w_i2, hydr_w.std()))
-            print('Well  cycle: {0}:{1}\tSTD={2}'.format(gw_i1, gw_i2, hydr_gw.std()))
-            print('E={0:.3f}'.format(E_i))
-            print('-'*50)
-
-    E_cyclic = np.array(E_cyclic)
-    if log:
-        for i, e in enumerate(E_cyclic):
-            print('Cycle #{0}: E={1:.3f}'.format(i, e))
-    E = np.nanmean(E_cyclic)
+    T = pd.Series((w_tmax - w_tmin).view('timedelta64[ns]')).where((w_tmin != NaT) & (w_tmax != NaT)).mean()*2
+    logger.debug('Period: T={0}, river: {1}, well: {2}'.format(T, river, gw))
+    if pd.isnull(T):
+        raise ValueError('Period of the tidal cycles cannot be determined: no valid river peaks')
+    quarter = (T/4).value  # note, here we assume that between peak1 and peak2 is T/2
+
+    # 3. find the bounds of all cycles at once (rows i1...i2, both included)
+    invalid_time = (w_tmin == NaT) | (w_tmax == NaT) | (gw_tmin == NaT) | (gw_tmax == NaT)
+    last = max(date.size - 1, 0)
+    w_i1 = np.minimum(np.searchsorted(date, w_tmin - quarter), last)
+    w_i2 = np.minimum(np.searchsorted(date, w_tmax + quarter), last)
+    gw_i1 = np.minimum(np.searchsorted(date, gw_tmin - quarter), last)
+    gw_i2 = np.minimum(np.searchsorted(date, gw_tmax + quarter), last)
+
+    # 4. Do the calculations
+    std_w, n_w = _cycle_std(df[river].values, w_i1, w_i2)
+    std_gw, n_gw = _cycle_std(df[gw].values, gw_i1, gw_i2)
+    skipped = invalid_time | (n_w < 2) | (n_gw < 2) | (std_w == 0) | (date.size == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        E_cyclic = np.where(skipped, np.nan, std_gw/std_w)
+    skipped = np.flatnonzero(skipped)
+
+    if skipped.size > 0:
+        logger.warning('Tidal efficiency (method 3): {0} of {1} cycles skipped (NaT peak time, less than two valid values or flat river hydrograph): {2}'.format(
+            skipped.size, E_cyclic.size, skipped.tolist()))
+    if E_cyclic.size - skipped.size == 0:
+        logger.warning('Tidal efficiency (method 3): no cycle could be evaluated')
+        E = np.nan
+    else:
+        E = np.nanmean(E_cyclic)
+    if return_skipped:
+        return E, E_cyclic, skipped
     return E, E_cyclic
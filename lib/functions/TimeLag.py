@@ -1,16 +1,30 @@
 #!/usr/bin python
 # -*- coding: utf-8 -*-
 import numpy as np
+import pandas as pd
 import datetime
 import logging
 logger = logging.getLogger(__name__)
 
+NaT = np.iinfo(np.int64).min  # int64 representation of np.datetime64('NaT')
+
+
+def tlag_tuple_to_array(tlag_tuple):
+    ''' Timelags [minutes] to be tested: tuple (t1, t2) => [t1, t1+1, ..., t2],
+    tuple (t1, t2, step) => [t1, t1+step, ..., t2]'''
+    if len(tlag_tuple) == 3:
+        return np.arange(tlag_tuple[0], tlag_tuple[1]+1, tlag_tuple[2])
+    elif len(tlag_tuple) == 2:
+        return np.arange(tlag_tuple[0], tlag_tuple[1]+1)
+    else:
+        raise NotImplementedError('tlag_iterator should be a tuple of 2 or 3 elements')
+
 
 def timelag_erskine1991_method(df_gw, cn_gw_v, cn_gw_t,
                                df_w,  cn_w_v,  cn_w_t,
                                E,
                                tlag_tuple=(0, 60, 1),
-                               log=False):
+                               log=False, return_curve=False):
     '''
     Calculating Timelag after Erskine 1991 approach.
 
@@ -43,85 +57,538 @@ def timelag_erskine1991_method(df_gw, cn_gw_v, cn_gw_t,
                 (i.e 0 min, 1 min, 2 min, ..., 59 min)
         log (bool):
             flag to print output into console
+        return_curve (bool):
+            if `True`, additionally return the sum of squared errors
+            for all timelags
 
     Return:
     -------
-        timelag (np.datetime64):
+        timelag (datetime.timedelta):
             estimated timelag between two hydrographs
             `df_gw[cn_gw_v]` and `df_w[cn_w_v]`
+        curve (pd.DataFrame):
+            only if `return_curve` is `True`. Columns 'tlag' (minutes),
+            'SSE' (sum of squared errors, see `erskine1991_sse_curve()`)
+            and 'N' (number of matched values)
 
     '''
 
-    # ---------------------------------------
-    # END user inputs END
-    # ---------------------------------------
     if E in [None, np.nan, 0]:
         raise ValueError('Tidal Efficiency is not set')
     if df_gw is None or df_w is None:
         raise ValueError('Input datasets are not set')
-    # make copies... with datetime indexes
-    df_GW = df_gw.set_index(cn_gw_t)
-    df_GW[cn_gw_t] = df_GW.index
-    
-    df_W  = df_w.set_index(cn_w_t)
-    df_W[cn_w_t] = df_W.index
-
-
-    #print( 'shifting, amplifying well data...')
-    # h'(t) = <T> + (h(t)- <h>)/E
-    #   where <T> means "mean T"
-    h      = df_GW[cn_gw_v]
-    h_mean = df_GW[cn_gw_v].mean()
-    T_mean = df_W[cn_w_v].mean()
-    df_GW['shifted_amplified_'+cn_gw_v] = T_mean + (h - h_mean) * 1./float(E)
 
-
-    # loop over gw wells and USERDEFINED possible timelags
+    # loop over USERDEFINED possible timelags
     #   i.e. timetuple=(20, 30) means that the script will try to match all timelags in list [20, 21, 22, ..., 30]
     #   we use these timetuples to increase speed of calculation, cause this approach of Erskine is timeconsuming
     #   by default it is recommended to set all of the timetuples to (0, 60) or some other awaited region
     #   then user can play around with the values.
-    #print( 'Calculating timelag...')
+    tlags = tlag_tuple_to_array(tlag_tuple)
 
+    SSE, N = erskine1991_sse_curve(df_gw[cn_gw_t].values, df_gw[cn_gw_v].values,
+                                   df_w[cn_w_t].values, df_w[cn_w_v].values,
+                                   E, tlags.astype('timedelta64[m]'))
+    if np.isnan(SSE).all():
+        raise ValueError('No groundwater timestamp `t` has a river timestamp at `t - tlag` for the given timelags')
 
-    if len(tlag_tuple) == 3:
-        tlag_iterator = xrange(tlag_tuple[0], tlag_tuple[1]+1, tlag_tuple[2])
-    elif len(tlag_tuple) == 2:
-        tlag_iterator = xrange(tlag_tuple[0], tlag_tuple[1]+1)
-    else:
-        raise NotImplementedError('tlag_iterator should be a tuple of 2 or 3 elements')
+    i_min = np.nanargmin(SSE)
+    timelag = datetime.timedelta(minutes=int(tlags[i_min]))
 
-    SUMM_LIST = list()
-    TLAG_LIST = list()
-    for tlag in tlag_iterator:        # try all timelags specified in 'tlag_iterator'
-        ### now loop over all records in GROUNDWATERLEVEL data... and calculate sum according to Erskine 1991 equation
-
-        tlag_timedelta = datetime.timedelta(minutes=tlag)  # convert minutes to timedelta object
-        df_GW['current_t_minus_tlag'] = df_GW[cn_gw_t] - tlag_timedelta
-        df_GW['current_river_h'] = df_W.loc[df_GW['current_t_minus_tlag']][cn_w_v].values
-        df_GW['current_erskine_to_sum'] = (df_GW['shifted_amplified_'+cn_gw_v] - df_GW['current_river_h'])**2
-        
-        summ = df_GW['current_erskine_to_sum'].sum()
-        if log: print( 'timelag = {0} >>> summ = {1}'.format(tlag_timedelta, summ))
-        SUMM_LIST.append(summ)
-        TLAG_LIST.append(tlag_timedelta)
-
-    timelag = TLAG_LIST[SUMM_LIST.index(min(SUMM_LIST))]
-    
     if log:
         logger.debug('-'*100)
-        for s, t in zip (SUMM_LIST, TLAG_LIST):
-            logger.debug( '\t {0:.1f} >>> {1} min'.format(s, t.total_seconds()/60.))
+        for summ, tlag, n in zip(SSE, tlags, N):
+            logger.debug('\t {0:.1f} >>> {1} min ({2} values)'.format(summ, tlag, n))
+        logger.debug('-'*100)
+        logger.debug('\t minimal SUMM       : {0}'.format(SSE[i_min]))
+        logger.debug('\t corresponding TLAG : {0}'.format(timelag))
         logger.debug('-'*100)
-        logger.debug( '\t minimal SUMM       : {0}'.format(min(SUMM_LIST)))
-        logger.debug( '\t corresponding TLAG : {0}'.format(timelag))
-        logger.debug( '-'*100)
 
+    if return_curve:
+        curve = pd.DataFrame({'tlag': tlags, 'SSE': SSE, 'N': N}, columns=['tlag', 'SSE', 'N'])
+        return timelag, curve
+    return timelag
+
+
+def shift_amplify(gw_v, w_v, E):
+    ''' Shift and amplify the groundwater hydrograph `gw_v` to the river
+    hydrograph `w_v` with the tidal efficiency `E` (NaN values are ignored):
+
+        h'(t) = <T> + (h(t)- <h>)/E
+            where <T> means "mean T"
+    '''
+    return np.nanmean(w_v) + (np.asarray(gw_v, dtype=float) - np.nanmean(gw_v))/float(E)
+
+
+def _regular_grid(t, v, max_fill=4.):
+    ''' Place values `v` with sorted int64 timestamps `t` onto a regular grid
+    with the smallest time step of `t`. Return tuple (grid, origin, step) or
+    (None, None, None) if the timestamps are not multiples of that step or the
+    grid would be more than `max_fill` times longer than `t`'''
+    d = np.diff(t)
+    d = d[d > 0]
+    if d.size == 0:
+        return None, None, None
+    step = d.min()
+    offset = t - t[0]
+    if (offset % step).any():
+        return None, None, None
+    n = offset[-1]//step + 1
+    if n > max_fill*t.size:
+        return None, None, None
+    grid = np.empty(n)
+    grid.fill(np.nan)
+    grid[offset//step] = v
+    return grid, t[0], step
+
+
+def lagged_river_values(tg, tw, w_v, lags):
+    ''' Generator: for each timelag in `lags` yield the river values `w_v` at
+    `tg - tlag` (NaN if there is no river timestamp exactly at `tg - tlag`).
+    `tg`, `tw` are int64 timestamps [ns] (`tw` sorted), `lags` in [ns].
+    The river grid (see `_regular_grid()`) is built only once'''
+    grid, origin, step = _regular_grid(tw, w_v)
+    if grid is not None:
+        q_div, q_mod = np.divmod(tg - origin, step)
+    for lag in lags:
+        if grid is not None:
+            l_div, l_mod = divmod(int(lag), int(step))
+            pos = q_div - l_div
+            match = (q_mod == l_mod) & (pos >= 0) & (pos < grid.size)
+            yield np.where(match, grid[np.clip(pos, 0, grid.size-1)], np.nan)
+        else:
+            t = tg - lag
+            pos = np.clip(np.searchsorted(tw, t), 0, max(tw.size-1, 0))
+            yield np.where(tw[pos] == t, w_v[pos], np.nan) if tw.size > 0 else np.full(tg.size, np.nan)
+
+
+def erskine1991_sse_curve(gw_t, gw_v, w_t, w_v, E, tlags, max_block_size=2**23):
+    '''
+    Sum of squared errors of Erskine 1991 for all timelags at once:
+
+        SSE(tlag) = sum( (h'(t) - w(t - tlag))**2 ),  h'(t) = <w> + (h(t) - <h>)/E
+
+    where the sum goes over all groundwater timestamps `t` that have a river
+    timestamp exactly at `t - tlag` (NaN values are skipped).
+
+    If the river timestamps lie on a regular grid (gaps are allowed), the
+    groundwater timestamps are mapped to the grid positions once and every
+    timelag is an integer offset of these positions. If the groundwater is
+    sampled on that grid too (every n-th position), each timelag is a strided
+    slice of the grid; otherwise the timelags are evaluated as a 2-D broadcast
+    reduction in blocks of at most `max_block_size` values. If the river is
+    not on a regular grid, every timelag is matched with one `np.searchsorted()`.
+
+    Args:
+    -----
+        gw_t, gw_v (1D array_like):
+            datetime (np.datetime64) and values of the groundwater hydrograph
+        w_t, w_v (1D array_like):
+            datetime (np.datetime64) and values of the river hydrograph
+        E (float):
+            tidal efficiency
+        tlags (1D array_like of np.timedelta64):
+            timelags to be evaluated
+        max_block_size (int):
+            maximal number of elements of a temporary 2-D array
+
+    Return:
+    -------
+        SSE (1D np.ndarray):
+            sum of squared errors for each timelag, NaN if no timestamps matched
+        N (1D np.ndarray):
+            number of matched pairs of values for each timelag
+    '''
+    tg = np.asarray(gw_t).astype('datetime64[ns]').view(np.int64)
+    tw = np.asarray(w_t).astype('datetime64[ns]').view(np.int64)
+    gw_v = np.asarray(gw_v, dtype=float)
+    w_v = np.asarray(w_v, dtype=float)
+    lags = np.asarray(tlags).astype('timedelta64[ns]').view(np.int64)
+
+    h = shift_amplify(gw_v, w_v, E)
+    valid = tg != NaT
+    tg, h = tg[valid], h[valid]
+    valid = tw != NaT
+    tw, w_v = tw[valid], w_v[valid]
+    i = np.argsort(tw, kind='mergesort')
+    tw, w_v = tw[i], w_v[i]
+
+    SSE = np.zeros(lags.size)
+    N = np.zeros(lags.size, dtype=np.int64)
+    grid, origin, step = _regular_grid(tw, w_v)
+    if grid is not None and tg.size > 0:
+        # t - tlag = origin + (q_div - l_div)*step + (q_mod - l_mod), exact match if q_mod == l_mod
+        q_div, q_mod = np.divmod(tg - origin, step)
+        l_div, l_mod = np.divmod(lags, step)
+        stride = q_div[1] - q_div[0] if tg.size > 1 else 1
+        if stride > 0 and (np.diff(q_div) == stride).all() and (q_mod == q_mod[0]).all():
+            # groundwater timestamps are every `stride`-th river grid position: the river
+            # values for a timelag are a strided slice of the grid (padded with NaN)
+            pad_left = max(0, l_div.max() - q_div[0])
+            pad_right = max(0, q_div[-1] - l_div.min() - grid.size + 1)
+            grid = np.concatenate((np.full(pad_left, np.nan), grid, np.full(pad_right, np.nan)))
+            for j in np.flatnonzero(l_mod == q_mod[0]):
+                first = q_div[0] - l_div[j] + pad_left
+                d = h - grid[first:first + stride*(tg.size-1) + 1:stride]
+                nan = np.isnan(d)
+                d[nan] = 0.
+                SSE[j] = np.dot(d, d)
+                N[j] = tg.size - np.count_nonzero(nan)
+        else:
+            block = max(1, int(max_block_size // tg.size))
+            for j in xrange(0, lags.size, block):
+                pos = q_div[np.newaxis, :] - l_div[j:j+block, np.newaxis]
+                match = (q_mod[np.newaxis, :] == l_mod[j:j+block, np.newaxis]) & (pos >= 0) & (pos < grid.size)
+                d2 = (h[np.newaxis, :] - grid[np.clip(pos, 0, grid.size-1)])**2
+                match &= ~np.isnan(d2)
+                SSE[j:j+block] = np.where(match, d2, 0.).sum(axis=1)
+                N[j:j+block] = match.sum(axis=1)
+    elif tw.size > 0:
+        for j, lag in enumerate(lags):
+            t = tg - lag
+            pos = np.clip(np.searchsorted(tw, t), 0, tw.size-1)
+            d2 = (h - w_v[pos])**2
+            match = (tw[pos] == t) & ~np.isnan(d2)
+            SSE[j] = d2[match].sum()
+            N[j] = match.sum()
+    SSE[N == 0] = np.nan
+    return SSE, N
+
+
+def _detrend(v):
+    ''' Remove the least-squares line from `v` (NaN values are ignored and set to zero)'''
+    x = np.arange(v.size, dtype=float)
+    valid = ~np.isnan(v)
+    out = np.zeros(v.size)
+    if valid.sum() > 1:
+        slope, intercept = np.polyfit(x[valid], v[valid], 1)
+        out[valid] = v[valid] - (slope*x[valid] + intercept)
+    return out
+
+
+def prepare_crosscorrelation_river(w_t, w_v):
+    '''
+    River part of `crosscorrelation_curve()`, that does not depend on the
+    groundwater hydrograph: the regular time grid, the detrended river values
+    and their FFT. Computing it once allows to correlate many groundwater
+    hydrographs with the same river (see `multiwell.multiwell_tidal_efficiency_timelag()`).
+
+    Args:
+    -----
+        w_t, w_v (1D array_like):
+            datetime (np.datetime64) and values of the river hydrograph
+
+    Return:
+    -------
+        river (dict):
+            prepared river, to be passed to `crosscorrelation_curve()`
+    '''
+    tw = np.asarray(w_t).astype('datetime64[ns]').view(np.int64)
+    w_v = np.asarray(w_v, dtype=float)
+    valid = (tw != NaT) & ~np.isnan(w_v)
+    i = np.argsort(tw[valid], kind='mergesort')
+    tw, w_v = tw[valid][i], w_v[valid][i]
+    if tw.size < 2:
+        raise ValueError('Not enough valid values in the river hydrograph')
+
+    grid, origin, step = _regular_grid(tw, w_v)
+    if grid is None:
+        step = int(np.median(np.diff(tw)))
+        origin = tw[0]
+        grid = np.interp(np.arange(origin, tw[-1]+1, step).astype(float), tw.astype(float), w_v)
+    valid = ~np.isnan(grid)
+    values = _detrend(grid)
+    n = grid.size
+    n_fft = 2**int(np.ceil(np.log2(2*n - 1)))
+    return {'t_grid': origin + step*np.arange(n), 'step': step, 'n_fft': n_fft,
+            'power': np.dot(values, values)/valid.sum(),
+            'fft': np.conj(np.fft.rfft(values, n_fft)),
+            'fft_valid': np.conj(np.fft.rfft(valid.astype(float), n_fft))}
+
+
+def crosscorrelation_curve(gw_t, gw_v, w_t, w_v, E, river=None):
+    '''
+    Normalized cross-correlation of the river hydrograph and the shifted and
+    amplified (see `shift_amplify()`) groundwater hydrograph for all timelags,
+    computed with FFT in O(N log N).
+
+    The river values are placed on their regular time grid (or linearly
+    interpolated onto a grid with the median time step if the river is not
+    regular), the groundwater values are linearly interpolated onto the same
+    grid. Both signals are detrended, missing values are set to zero. The
+    correlation at each timelag is divided by the number of overlapping values.
+
+    Args:
+    -----
+        gw_t, gw_v (1D array_like):
+            datetime (np.datetime64) and values of the groundwater hydrograph
+        w_t, w_v (1D array_like):
+            datetime (np.datetime64) and values of the river hydrograph
+        E (float):
+            tidal efficiency
+        river (Optional[dict]):
+            river prepared with `prepare_crosscorrelation_river(w_t, w_v)`.
+            If `None` - is prepared here
+
+    Return:
+    -------
+        tlags (1D np.ndarray of np.timedelta64[ns]):
+            timelags, positive - groundwater lags behind the river
+        r (1D np.ndarray):
+            cross-correlation coefficient for each timelag
+    '''
+    if river is None:
+        river = prepare_crosscorrelation_river(w_t, w_v)
+    tg = np.asarray(gw_t).astype('datetime64[ns]').view(np.int64)
+    h = shift_amplify(gw_v, w_v, E)
+
+    valid = (tg != NaT) & ~np.isnan(h)
+    i = np.argsort(tg[valid], kind='mergesort')
+    tg, h = tg[valid][i], h[valid][i]
+    if tg.size < 2:
+        raise ValueError('Not enough valid values in the groundwater hydrograph')
 
+    gw = np.interp(river['t_grid'].astype(float), tg.astype(float), h, left=np.nan, right=np.nan)
+    valid_gw = ~np.isnan(gw)
+    gw = _detrend(gw)
 
-    del df_GW
-    del df_W
+    # c[k] = sum_i river[i]*gw[i+k]: maximal at k = tlag, if gw(t) ~ river(t - tlag)
+    n = gw.size
+    n_fft = river['n_fft']
 
-    del SUMM_LIST
-    del TLAG_LIST
+    def xcorr(fft_river, b):
+        c = np.fft.irfft(fft_river * np.fft.rfft(b, n_fft), n_fft)
+        return np.concatenate((c[n_fft-n+1:], c[:n]))  # lags -(n-1) ... (n-1)
+
+    # divide by the number of overlapping values, so that the finite length
+    # of the records does not bias the maximum towards zero timelag
+    count = np.round(xcorr(river['fft_valid'], valid_gw.astype(float)))
+    norm = np.sqrt(river['power'] * np.dot(gw, gw)/valid_gw.sum())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(count > 0, xcorr(river['fft'], gw)/count, np.nan)/norm
+    tlags = (np.arange(-(n-1), n) * river['step']).astype('timedelta64[ns]')
+    return tlags, r
+
+
+def crosscorrelation_maximum(tlags, r, tlag_range=(0, 60)):
+    ''' Timelag of the maximum of the cross-correlation `r` (see
+    `crosscorrelation_curve()`) within `tlag_range` (minutes), refined between
+    the time steps with a parabola through the three neighbouring values. A
+    maximum at the border of the range is not refined, so that the timelag
+    stays within the range.
+    Return tuple (timelag in minutes, index of the maximum, indices within the range)'''
+    minutes = tlags / np.timedelta64(1, 'm')
+    inside = np.flatnonzero((minutes >= tlag_range[0]) & (minutes <= tlag_range[1]))
+    if inside.size == 0:
+        raise ValueError('No timelag within the range {0} minutes. Time step of the data is {1} minutes'.format(tlag_range, minutes[1]-minutes[0]))
+    if np.isnan(r[inside]).all():
+        raise ValueError('The hydrographs do not overlap for the timelags within the range {0} minutes'.format(tlag_range))
+
+    i_max = inside[np.nanargmax(r[inside])]
+    shift = 0.
+    if inside[0] < i_max < inside[-1]:
+        r_l, r_0, r_r = r[i_max-1:i_max+2]
+        curv = r_l - 2.*r_0 + r_r
+        if curv < 0:
+            shift = np.clip(0.5*(r_l - r_r)/curv, -0.5, 0.5)
+    return minutes[i_max] + shift*(minutes[1]-minutes[0]), i_max, inside
+
+
+def timelag_crosscorrelation_method(df_gw, cn_gw_v, cn_gw_t,
+                                    df_w,  cn_w_v,  cn_w_t,
+                                    E,
+                                    tlag_range=(0, 60),
+                                    log=False, return_curve=False):
+    '''
+    Calculating Timelag as the position of the maximum of the cross-correlation
+    between the river and the groundwater hydrographs (see `crosscorrelation_curve()`).
+    The maximum is refined between the time steps with a parabola through the
+    three neighbouring values.
+
+    Args:
+    -----
+        df_gw, cn_gw_v, cn_gw_t, df_w, cn_w_v, cn_w_t, E:
+            same as for `timelag_erskine1991_method()`
+        tlag_range (tuple(float, float)):
+            the maximum is searched only within timelags [tlag_range[0]:tlag_range[1]]
+            Values have *minute* units.
+        log (bool):
+            flag to print output into console
+        return_curve (bool):
+            if `True`, additionally return the cross-correlation for the timelags
+            within `tlag_range`
+
+    Return:
+    -------
+        timelag (datetime.timedelta):
+            estimated timelag between two hydrographs
+            `df_gw[cn_gw_v]` and `df_w[cn_w_v]`
+        curve (pd.DataFrame):
+            only if `return_curve` is `True`. Columns 'tlag' (minutes) and
+            'r' (cross-correlation coefficient)
+    '''
+    if E in [None, np.nan, 0]:
+        raise ValueError('Tidal Efficiency is not set')
+    if df_gw is None or df_w is None:
+        raise ValueError('Input datasets are not set')
+
+    tlags, r = crosscorrelation_curve(df_gw[cn_gw_t].values, df_gw[cn_gw_v].values,
+                                      df_w[cn_w_t].values, df_w[cn_w_v].values, E)
+    tlag_minutes, i_max, inside = crosscorrelation_maximum(tlags, r, tlag_range)
+    minutes = tlags / np.timedelta64(1, 'm')
+    timelag = datetime.timedelta(minutes=float(tlag_minutes))
+
+    if log:
+        logger.debug('-'*100)
+        logger.debug('\t maximal cross-correlation : {0}'.format(r[i_max]))
+        logger.debug('\t corresponding TLAG        : {0}'.format(timelag))
+        logger.debug('-'*100)
+
+    if return_curve:
+        curve = pd.DataFrame({'tlag': minutes[inside], 'r': r[inside]}, columns=['tlag', 'r'])
+        return timelag, curve
     return timelag
+
+
+def erskine1991_mse(tg, h, tw, w_v, tlag):
+    ''' Mean squared error of Erskine 1991 for one (arbitrary) timelag:
+    mean( (h'(t) - w(t - tlag))**2 ), with the river values linearly
+    interpolated at `t - tlag`. `tg`, `tw` are sorted int64 timestamps [ns],
+    `h` the shifted and amplified groundwater values, `tlag` in [ns].
+    Return tuple (MSE, number of values)'''
+    river = np.interp((tg - tlag).astype(float), tw.astype(float), w_v, left=np.nan, right=np.nan)
+    d = h - river
+    d = d[~np.isnan(d)]
+    if d.size == 0:
+        return np.nan, 0
+    return np.dot(d, d)/d.size, d.size
+
+
+def timelag_erskine1991_adaptive(df_gw, cn_gw_v, cn_gw_t,
+                                 df_w,  cn_w_v,  cn_w_t,
+                                 E,
+                                 tlag_range=(0, 60),
+                                 n_coarse=16, resolution=1., confidence=0.95,
+                                 log=False):
+    '''
+    Calculating Timelag after Erskine 1991 approach with a coarse-to-fine
+    search instead of the brute-force iteration over all timelags:
+
+        1) the mean squared error (see `erskine1991_mse()`) is evaluated at
+           `n_coarse` equally spaced timelags within `tlag_range`
+        2) the minimum is bracketed by its coarse neighbours and refined with
+           golden-section search down to `resolution` seconds
+
+    Thus (t2-t1)/step evaluations are replaced by about n_coarse + log(range/resolution).
+
+    Note that the objective differs from `timelag_erskine1991_method()`: it is
+    the mean squared error against the river linearly interpolated at t - tlag
+    (so that any timelag, not only the ones hitting river timestamps, can be
+    evaluated), not the sum of squared errors over the exactly matching
+    timestamps (`erskine1991_sse_curve()`). On densely sampled rivers both have
+    the same minimum.
+
+    The confidence interval is estimated from the curvature `a` of a parabola
+    MSE(tlag) ~ MSE_min + a*(tlag-tlag_min)**2 fitted around the minimum, with
+    the error variance MSE_min/(N-1):
+
+        tlag_min +- sqrt(chi2(confidence, 1) * MSE_min/(N-1) / a)
+
+    Note that the residuals of hydrographs are autocorrelated, so the interval
+    is rather a lower bound of the real uncertainty.
+
+    Args:
+    -----
+        df_gw, cn_gw_v, cn_gw_t, df_w, cn_w_v, cn_w_t, E:
+            same as for `timelag_erskine1991_method()`
+        tlag_range (tuple(float, float)):
+            timelags to be searched, in *minutes*
+        n_coarse (int):
+            number of timelags of the coarse scan
+        resolution (float):
+            target resolution in *seconds*
+        confidence (float):
+            confidence level of the interval
+        log (bool):
+            flag to print output into console
+
+    Return:
+    -------
+        timelag (datetime.timedelta):
+            estimated timelag between two hydrographs
+            `df_gw[cn_gw_v]` and `df_w[cn_w_v]`
+        extra (dict):
+            'ci'            - tuple of two datetime.timedelta, confidence interval
+                              (`None` if the minimum is not curved)
+            'mse'           - minimal mean squared error
+            'n_evaluations' - number of MSE evaluations
+            'curve'         - pd.DataFrame with all evaluated timelags: columns
+                              'tlag' (minutes), 'MSE' and 'N' (number of values)
+    '''
+    from scipy.stats import chi2
+
+    if E in [None, np.nan, 0]:
+        raise ValueError('Tidal Efficiency is not set')
+    if df_gw is None or df_w is None:
+        raise ValueError('Input datasets are not set')
+
+    tg = df_gw[cn_gw_t].values.astype('datetime64[ns]').view(np.int64)
+    tw = df_w[cn_w_t].values.astype('datetime64[ns]').view(np.int64)
+    w_v = df_w[cn_w_v].values.astype(float)
+    h = shift_amplify(df_gw[cn_gw_v].values, w_v, E)
+    valid = tg != NaT
+    tg, h = tg[valid], h[valid]
+    valid = tw != NaT
+    i = np.argsort(tw[valid], kind='mergesort')
+    tw, w_v = tw[valid][i], w_v[valid][i]
+
+    CACHE = dict()
+
+    def mse(tlag_s):
+        if tlag_s not in CACHE:
+            CACHE[tlag_s] = erskine1991_mse(tg, h, tw, w_v, int(round(tlag_s*1e9)))
+        return CACHE[tlag_s][0]
+
+    # 1) coarse scan [seconds]
+    t1, t2 = tlag_range[0]*60., tlag_range[1]*60.
+    coarse = np.linspace(t1, t2, max(int(n_coarse), 3))
+    values = np.array([mse(t) for t in coarse])
+    if np.isnan(values).all():
+        raise ValueError('Hydrographs do not overlap for the timelags within {0} minutes'.format(tlag_range))
+    i_min = np.nanargmin(values)
+
+    # 2) golden-section search within the bracket of the coarse minimum
+    a, b = coarse[max(i_min-1, 0)], coarse[min(i_min+1, coarse.size-1)]
+    invphi = (np.sqrt(5.) - 1.)/2.
+    c, d = b - invphi*(b - a), a + invphi*(b - a)
+    while b - a > resolution:
+        if mse(c) <= mse(d) or np.isnan(mse(d)):
+            b, d = d, c
+            c = b - invphi*(b - a)
+        else:
+            a, c = c, d
+            d = a + invphi*(b - a)
+    candidates = [t for t in (a, b, (a + b)/2., coarse[i_min]) if not np.isnan(mse(t))]
+    tlag_s = min(candidates, key=mse)
+    mse_min, n = CACHE[tlag_s]
+
+    # 3) confidence interval from the curvature of the MSE around the minimum
+    ci = None
+    h_step = max(resolution, (coarse[1] - coarse[0])/10.)
+    mse_l, mse_r = mse(tlag_s - h_step), mse(tlag_s + h_step)
+    curvature = (mse_l - 2.*mse_min + mse_r)/(2.*h_step**2)
+    if curvature > 0 and n > 1:
+        half = np.sqrt(chi2.ppf(confidence, 1) * mse_min/(n - 1) / curvature)
+        ci = (datetime.timedelta(seconds=tlag_s - half), datetime.timedelta(seconds=tlag_s + half))
+
+    timelag = datetime.timedelta(seconds=tlag_s)
+    if log:
+        logger.debug('-'*100)
+        logger.debug('\t minimal MSE        : {0}'.format(mse_min))
+        logger.debug('\t corresponding TLAG : {0}'.format(timelag))
+        logger.debug('\t confidence interval: {0}'.format(ci))
+        logger.debug('\t MSE evaluations    : {0}'.format(len(CACHE)))
+        logger.debug('-'*100)
+    tlags = sorted(CACHE.keys())
+    curve = pd.DataFrame({'tlag': np.array(tlags)/60., 'MSE': [CACHE[t][0] for t in tlags], 'N': [CACHE[t][1] for t in tlags]},
+                         columns=['tlag', 'MSE', 'N'])
+    return timelag, {'ci': ci, 'mse': mse_min, 'n_evaluations': len(CACHE), 'curve': curve}
@@ -2,15 +2,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import numpy as np
-import gc
 import pandas as pd
+import logging
 from lib.functions.general import isNumpyDatetime, isNumpyNumeric
 
+logger = logging.getLogger(__name__)
 
-def get_number_of_measurements_per_day(data, datetime=None, log=False):
+
+def get_number_of_measurements_per_day(data, datetime=None, log=False, return_segments=False):
     """ Calculate number of measurements/entries per day (per 24h) in the passed
         dataframe.
 
+        The number is derived from the modal (most frequent) time step
+        between two neighbour entries: N = 24h / modal step (if several steps
+        are equally frequent - the smallest of them). All entries are
+        processed in one pass over the int64 timestamps. Segments, where the
+        time step differs from the modal one (gaps, irregular sampling), are
+        reported with a warning.
 
         Args:
             data (pd.DataFrame): input data, where indexes are Datetime objects,
@@ -25,29 +33,188 @@ def get_number_of_measurements_per_day(data, datetime=None, log=False):
 
             log (Optional[bool]): flag to show some prints in console
 
+            return_segments (Optional[bool]): if `True` - additionally return
+                the table of irregular segments
+
         Returns:
             N (int): number of entries per day
+
+            segments (pd.DataFrame): only if `return_segments=True`. One row
+                per segment of consecutive irregular time steps: 'start',
+                'end' (datetime of the entries enclosing the segment),
+                'n_steps' (number of irregular time steps), 'dt_min', 'dt_max'
+                (shortest and longest time step within the segment)
     """
 
     if datetime is None:
-        entriesPerDay = data.groupby(data.index.date).count()  # series for all the timespan
+        date = data.index
     else:
         if datetime in data.columns:
-            try:
-                dfts = data.set_index(datetime)  # we need to aply group method only to timeseries (index=datetime). Thus we will create a fake one
-                entriesPerDay = data.groupby(dfts.index.date).count()  # series for all the timespan
-                del dfts
-            except:
-                raise ValueError('Passed column <{0}> is not of type <datetime64>. Received type : {1}'.format(datetime, data[datetime].dtype))
+            date = data[datetime]
         else:
             raise KeyError('Passed column name <{0}> not found in dataframe. DataFrame has following columns: {1}'.format(datetime, list(data.columns)))
-    N = entriesPerDay.ix[1, 0]  # pick one value from series (from 1st row, 0-column; because 0-0 can give false N-entries per day)
+    if not isNumpyDatetime(date.dtype):
+        raise ValueError('Passed column <{0}> is not of type <datetime64>. Received type : {1}'.format(datetime, date.dtype))
+    t = np.asarray(date.values).astype('datetime64[ns]').view(np.int64)
+    if t.size < 2:
+        raise ValueError('At least two entries are needed to determine the number of measurements per day')
+
+    dt = np.diff(t)
+    counts = pd.Series(dt).value_counts()  # hash-based count in O(N)
+    step = counts.index[counts.values == counts.values.max()].min()  # modal time step [ns], ties - the smallest step
+    if step <= 0:
+        raise ValueError('Datetime is not sorted: the most frequent time step is {0}'.format(np.timedelta64(step, 'ns')))
+    day = np.timedelta64(1, 'D') / np.timedelta64(1, 'ns')
+    N = int(round(day/step))
+    if day % step != 0:
+        logger.warning('Time step {0} is not a divisor of 24 hours, number of measurements per day is rounded to {1}'.format(
+            pd.Timedelta(int(step)), N))
+
+    # segments of consecutive time steps that differ from the modal step
+    irregular = np.concatenate(([False], dt != step, [False]))
+    edges = np.flatnonzero(irregular[1:] != irregular[:-1])
+    first, last = edges[0::2], edges[1::2]  # time steps dt[first:last] are irregular
+    bounds = np.column_stack((first, last)).ravel()
+    bounds = bounds[bounds < dt.size]  # `reduceat` over dt[first:last]
+
+    def reduce_segments(ufunc):
+        if first.size == 0:
+            return np.array([], dtype='timedelta64[ns]')
+        return ufunc.reduceat(dt, bounds)[0::2].view('timedelta64[ns]')
+    segments = pd.DataFrame({'start': t[first].view('datetime64[ns]'),
+                             'end': t[last].view('datetime64[ns]'),
+                             'n_steps': last - first,
+                             'dt_min': reduce_segments(np.minimum),
+                             'dt_max': reduce_segments(np.maximum),
+                             }, columns=['start', 'end', 'n_steps', 'dt_min', 'dt_max'])
+    if len(segments) > 0:
+        logger.warning('{0} segments with irregular time steps ({1} of {2} time steps differ from {3})'.format(
+            len(segments), segments['n_steps'].sum(), dt.size, pd.Timedelta(int(step))))
     if log:
-        print (entriesPerDay)
+        print ('modal time step: ', pd.Timedelta(int(step)))
+        print ('irregular segments:\n', segments)
         print ('i will use following number of entries per day: ', N)
+    if return_segments:
+        return N, segments
     return N
 
 
+_BATCH_SIZE = 2**20  # number of values filtered at once by `filter_wl_71h_serfes1991()`
+
+
+def _moving_sum(values, window, start=0):
+    ''' Sums of `window` consecutive values along the last axis of the 2D
+    array `values` (one row per signal):
+    sums[:, j] = values[:, j:j+window].sum(axis=1) for j = 0 ... values.shape[1]-window.
+
+    Computed with cumulative sums that restart every `window` values, i.e. in
+    O(N) for any window length. The blocks are aligned to the absolute
+    position `start` of `values[:, 0]`, so that each sum is computed with the
+    very same floating point operations no matter which part of a longer
+    series is passed (see `iter_filter_wl_71h_serfes1991()`)'''
+    m, n = values.shape
+    if n < window:
+        return np.empty((m, 0))
+    pad = start % window
+    nb = -(-(pad + n) // window)  # number of blocks
+    C = np.zeros((m, nb*window + 1))  # C[:, i+1] - cumulative sum of the padded values within the block of `i`
+    C[:, 1+pad:1+pad+n] = values
+    blocks = C[:, 1:].reshape(m, nb, window)
+    np.cumsum(blocks, axis=2, out=blocks)
+    # window starting at the beginning of a block is the whole block, otherwise
+    # it is the rest of its block + the beginning of the next block
+    sums = np.empty((m, nb, window))
+    sums[:, :, 0] = blocks[:, :, -1]
+    np.subtract(blocks[:, :-1, -1:], blocks[:, :-1, :-1], out=sums[:, :-1, 1:])
+    sums[:, :-1, 1:] += blocks[:, 1:, :-1]
+    sums = sums.reshape(m, nb*window)[:, pad:pad+n-window+1]
+    return sums
+
+
+def _centered_moving_average(values, window, start=0):
+    ''' Same as `pd.Series(values[i]).rolling(window=window, min_periods=window, center=True).mean().values`
+    for every row `i` of the 2D float array `values` (a window with a NaN gives
+    NaN), computed with `_moving_sum()`'''
+    m, n = values.shape
+    output = np.full((m, n), np.nan)
+    if n < window:
+        return output
+    # leading and trailing NaNs (e.g. the edges of the previous moving
+    # average) are cut off, the NaNs in between are counted
+    isnan = np.isnan(values)
+    lo, hi = 0, n
+    if isnan.any():
+        valid = np.flatnonzero(~isnan.all(axis=0))
+        if valid.size == 0:
+            return output
+        lo, hi = valid[0], valid[-1] + 1
+        values, isnan = values[:, lo:hi], isnan[:, lo:hi]
+        if hi - lo < window:
+            return output
+    if isnan.any():
+        sums = _moving_sum(np.where(isnan, 0., values), window, start=start+lo)
+        n_nan = np.cumsum(isnan, axis=1, dtype=np.int32)
+        sums[(n_nan[:, window-1:] - np.pad(n_nan[:, :hi-lo-window], ((0, 0), (1, 0)), 'constant')) > 0] = np.nan
+    else:
+        sums = _moving_sum(values, window, start=start+lo)
+    sums /= float(window)
+    output[:, lo+window//2:lo+window//2+hi-lo-window+1] = sums
+    return output
+
+
+def serfes1991_windows(n):
+    ''' Window lengths (number of values) of the three moving averages of
+    the Serfes 1991 filter for `n` measurements per day'''
+    nX = int(n/24.*71 - (n-1))  # number of elements in sequence_1
+    nY = nX - (n-1)             # number of elements in sequence_2
+    return n, n, nY
+
+
+def serfes1991_sequences(values, n, start=0):
+    ''' Three moving averages of the Serfes 1991 filter applied to all
+    rows (signals) of the 2D array `values` at once. Return tuple of three
+    2D arrays (sequence1, sequence2, mean)'''
+    w1, w2, w3 = serfes1991_windows(n)
+    sequence1 = _centered_moving_average(values, w1, start=start)
+    sequence2 = _centered_moving_average(sequence1, w2, start=start)
+    return sequence1, sequence2, _centered_moving_average(sequence2, w3, start=start)
+
+
+def _serfes1991_output(data, numeric_columns, n, keep_origin=True, verbose=False, start=0, rows=None):
+    ''' Filter `numeric_columns` of `data` (see `serfes1991_sequences()`,
+    `start` - absolute position of the first row of `data` within the whole
+    series) and create the output of `filter_wl_71h_serfes1991()` for the
+    rows `data.iloc[rows[0]:rows[1]]` (`rows=None` - all rows)'''
+    r0, r1 = (0, len(data)) if rows is None else rows
+    # columns are filtered in batches (bounded size of the temporary arrays),
+    # the results are written into one preallocated array and appended to the
+    # output at once
+    suffixes = ['_sequence1', '_sequence2', '_mean'] if verbose else ['_mean']
+    names = [col_name+suffix for col_name in numeric_columns for suffix in suffixes]
+    results = np.empty((len(names), r1-r0))
+    batch = max(1, int(_BATCH_SIZE // max(len(data), 1)))
+    for i0 in range(0, len(numeric_columns), batch):
+        columns = numeric_columns[i0:i0+batch]
+        values = np.array(data[columns].values.T, dtype=float, order='C')  # one row per column
+        sequences = serfes1991_sequences(values, n, start=start)[-len(suffixes):]
+        for j, sequence in enumerate(sequences):
+            results[i0*len(suffixes)+j:(i0+len(columns))*len(suffixes):len(suffixes)] = sequence[:, r0:r1]
+    data = data.iloc[r0:r1] if rows is not None else data
+    results = pd.DataFrame(results.T, columns=names, index=data.index, copy=False)
+
+    if keep_origin:
+        output = data
+    else:
+        #copy datetime columns
+        datetime_columns = [col for col in data.columns if isNumpyDatetime(data[col].dtype)]
+        output = data[datetime_columns].copy()
+    existing = [col for col in names if col in output.columns]
+    output = pd.concat([output, results.drop(existing, axis=1)], axis=1)
+    for col in existing:  # results of a previous run are overwritten
+        output[col] = results[col]
+    return output
+
+
 #@profile
 def filter_wl_71h_serfes1991(data, datetime=None, N=None, usecols=None, keep_origin=True, verbose=False, log=False):
     ''' Calculate mean water-level according to Serfes1991.
@@ -115,31 +282,73 @@ def filter_wl_71h_serfes1991(data, datetime=None, N=None, usecols=None, keep_ori
         print ('Numeric colums:', numeric_columns)
         print ('i will use following number of entries per day: ', n)
 
-    if keep_origin:
-        output = data
-    else:
-        output = pd.DataFrame()
+    return _serfes1991_output(data, numeric_columns, int(n), keep_origin=keep_origin, verbose=verbose)
 
-        #copy datetime columns
-        datetime_columns = [col for col in data.columns if isNumpyDatetime(data[col].dtype)]
-        for col in datetime_columns:
-            output[col] = data[col]
 
-    nX = int(n/24.*71 - (n-1))  # number of elements in sequence_1
-    nY = nX - (n-1)             # number of elements in sequence_2
-    #print (n, nX, nY)
-    for col_name in numeric_columns:
-        if float('.'.join(pd.__version__ .split('.')[0:2])) < 0.18:  # if version is less then 0.18 (OLD API)
-            output[col_name+'_sequence1'] = pd.rolling_mean(data[col_name], window=n, min_periods=n, center=True).values
-            output[col_name+'_sequence2'] = pd.rolling_mean(output[col_name+'_sequence1'], window=n, min_periods=n, center=True).values
-            output[col_name+'_mean'] = pd.rolling_mean(output[col_name+'_sequence2'], window=nY, min_periods=nY, center=True).values
-        else:
-            # new API
-            output[col_name+'_sequence1'] = data[col_name].rolling(window=n, min_periods=n, center=True).mean().values
-            output[col_name+'_sequence2'] = output[col_name+'_sequence1'].rolling(window=n, min_periods=n, center=True).mean().values
-            output[col_name+'_mean']      = output[col_name+'_sequence2'].rolling(window=nY, min_periods=nY, center=True).mean().values
-        if not verbose: del output[col_name+'_sequence1']
-        if not verbose: del output[col_name+'_sequence2']
-
-    gc.collect()
-    return output
+def iter_filter_wl_71h_serfes1991(chunks, datetime=None, N=None, usecols=None, keep_origin=True, verbose=False, log=False):
+    ''' Streaming version of `filter_wl_71h_serfes1991()` for data that does not
+    fit into memory (e.g. `pd.read_csv(..., chunksize=100000)`).
+
+    The chunks are filtered one after another. Only the tail of the data that
+    is needed by the moving averages of the following rows (about 3 x 71 hours
+    of measurements) is carried over to the next chunk, the tail is filtered
+    again together with the next chunk. The result is identical (bit by bit)
+    to `filter_wl_71h_serfes1991()` applied to the concatenated chunks, since
+    the moving sums are computed in blocks aligned to the absolute row
+    position (see `_moving_sum()`).
+
+    Args:
+        chunks (iterable of pd.DataFrame): consecutive parts of the data,
+            all with the same columns
+
+        datetime, usecols, keep_origin, verbose, log: same as for
+            `filter_wl_71h_serfes1991()`
+
+        N (Optional[int]): explicit number of measurements in 24 hours. If
+            `None` - is determined from the first chunk
+
+    Yields:
+        data (pd.DataFrame): filtered rows, with the same columns as the
+            output of `filter_wl_71h_serfes1991()`. The rows are yielded as
+            soon as their filtered values are final, i.e. the yielded frames
+            do not coincide with the passed chunks
+    '''
+    n = N
+    numeric_columns = None
+    tail = None       # data that is carried over to the next chunk
+    tail_start = 0    # absolute position of the first row of `tail`
+    next_row = 0      # absolute position of the next row to be yielded
+    for chunk in chunks:
+        if numeric_columns is None:
+            if usecols is None:
+                numeric_columns = [col for col in chunk.columns if isNumpyNumeric(chunk[col].dtype)]
+            else:
+                numeric_columns = [col for col in chunk.columns if (isNumpyNumeric(chunk[col].dtype) and col in usecols)]
+            if n is None:
+                n = get_number_of_measurements_per_day(chunk, datetime=datetime, log=log)
+                logger.warning('Number of measurements per day is determined from the first chunk: N={0}'.format(n))
+            n = int(n)
+            # reach of the filter: a filtered value depends on the values [i-left:i+right],
+            # `left` includes the beginning of the block of each moving sum (see `_moving_sum()`)
+            windows = serfes1991_windows(n)
+            left = sum(w//2 + w - 1 for w in windows)
+            right = sum(w - 1 - w//2 for w in windows)
+            if log:
+                print ('Numeric colums:', numeric_columns)
+                print ('i will use following number of entries per day: ', n)
+                print ('rows carried over to the next chunk: ', left + right)
+
+        data = chunk if tail is None else pd.concat([tail, chunk])
+        end = tail_start + len(data)
+        ready = end - right  # rows before `ready` are not affected by the following chunks
+        if ready > next_row:
+            yield _serfes1991_output(data, numeric_columns, n, keep_origin=keep_origin, verbose=verbose,
+                                     start=tail_start, rows=(next_row-tail_start, ready-tail_start))
+            next_row = ready
+        keep = max(tail_start, next_row - left)
+        tail = data.iloc[keep-tail_start:]
+        tail_start = keep
+
+    if tail is not None and tail_start + len(tail) > next_row:
+        yield _serfes1991_output(tail, numeric_columns, n, keep_origin=keep_origin, verbose=verbose,
+                                 start=tail_start, rows=(next_row-tail_start, len(tail)))
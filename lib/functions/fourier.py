@@ -4,7 +4,68 @@ import pandas as pd
 import matplotlib.pylab as plt
 from numpy import cos, pi, arccos, abs
 from scipy import fftpack
+import logging
 
+logger = logging.getLogger(__name__)
+
+
+
+class FourierModel(object):
+    ''' Sum of sinusoids, fitted with `fourier_analysis()`:
+
+        y(t) = H0 + A[0]*cos(omega[0]*t+phi[0]) + ... + A[n-1]*cos(omega[n-1]*t+phi[n-1])
+
+    The model stores only the arrays of the parameters, it can be evaluated
+    for any time vector `t` [s] (`model(t)`), pickled, or converted to a
+    dictionary of lists (`to_dict()`, `FourierModel.from_dict()`).
+
+    Args:
+    -----
+        H0 (float):
+            constant (freq=0)
+        A, omega, phi (1D array_like):
+            amplitudes, angular velocities [rad/s] and phase shifts [rad]
+    '''
+    def __init__(self, H0=0., A=(), omega=(), phi=()):
+        self.H0 = float(H0)
+        self.A = np.asarray(A, dtype=float).ravel()
+        self.omega = np.asarray(omega, dtype=float).ravel()
+        self.phi = np.asarray(phi, dtype=float).ravel()
+        if not (self.A.size == self.omega.size == self.phi.size):
+            raise ValueError('Arrays `A`, `omega` and `phi` must have equal length: {0}, {1}, {2}'.format(self.A.size, self.omega.size, self.phi.size))
+
+    def __call__(self, t, max_block_size=2**18):
+        ''' Evaluate the model for time `t` [s] (float or array_like).
+        The matrix cos(outer(omega, t) + phi) is computed in blocks of `t`
+        with at most `max_block_size` elements'''
+        t = np.asarray(t, dtype=float)
+        t_flat = t.ravel()
+        y = np.empty(t_flat.size)
+        block = max(1, int(max_block_size // max(self.A.size, 1)))
+        for i0 in range(0, t_flat.size, block):
+            t_block = t_flat[i0:i0+block]
+            y[i0:i0+block] = self.H0 + self.A.dot(cos(np.outer(self.omega, t_block) + self.phi[:, None]))
+        return y.reshape(t.shape) if t.ndim > 0 else float(y[0])
+
+    def __len__(self):
+        return self.A.size
+
+    def __repr__(self):
+        return 'FourierModel(H0={0}, {1} waves)'.format(self.H0, len(self))
+
+    def to_string(self):
+        ''' String with python source of the model, function can be generated with `exec()`'''
+        STR = u"def generated_function(t): return ({0}".format(self.H0)
+        for a, omega, phi in zip(self.A, self.omega, self.phi):
+            STR += u" + {0}*np.cos({1}*t+{2})".format(a, omega, phi)
+        return STR + u")"
+
+    def to_dict(self):
+        return {'H0': self.H0, 'A': self.A.tolist(), 'omega': self.omega.tolist(), 'phi': self.phi.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(H0=d['H0'], A=d['A'], omega=d['omega'], phi=d['phi'])
 
 
 def fourier_analysis(sig, timestep, N_MAX_POW=1, generate_plot=False, display_plot=False, **kwargs):
@@ -54,10 +115,10 @@ def fourier_analysis(sig, timestep, N_MAX_POW=1, generate_plot=False, display_pl
                 EQUATION['2']['phi'] >>> phi2
                 etc...
         f_str (str):
-            string of the generated function
-        f (function):
-            estimated function `f(t)` that defines water-level (is generated
-            from `exec(f_str) in globals(), locals()`)
+            string of the generated function (see `FourierModel.to_string()`)
+        f (FourierModel):
+            estimated function `f(t)` that defines water-level, can be
+            evaluated for any time vector `t` [s]
 
     '''
     if N_MAX_POW < 1:
@@ -85,46 +146,28 @@ def fourier_analysis(sig, timestep, N_MAX_POW=1, generate_plot=False, display_pl
     weak_power_idxs = np.where(abs(sig_fft) < thres_power)
     sig_fft[weak_power_idxs] = 0
 
-    # now loop over FFT solution (already with ingored "weak frequencies") and get the curve equation params
-    EQUATION = {}
-    for i, complex_val in enumerate(sig_fft):
-        a = abs(complex_val)/len(sig_fft)  # amplitude
-        omega = sample_freq[i]*2*pi  # angular velocity in [rad/s]
-        
-        if complex_val == 0 or omega <= 0:  # we ignore "weak frequencies" (==0) and negative symmetrical frequencies (omega <0)
-            continue
-
-        phi = arccos(complex_val.real/abs(complex_val))
-        phi *= 1 if complex_val.imag >= 0 else -1
-        
-        EQUATION['{0}'.format(i+1)] = {}
-        EQUATION['{0}'.format(i+1)]['A']     = a*2.  #amplitude in `sig` units (multiplied by 2 due to ignorance of negative symmetrical frequencies)
-        EQUATION['{0}'.format(i+1)]['omega'] = omega  # angular velocity in [rad/sec]
-        EQUATION['{0}'.format(i+1)]['phi']   = phi  # phase shift in [rad]
+    # now get the curve equation params from FFT solution (already with ingored "weak frequencies")
+    # we ignore "weak frequencies" (==0) and negative symmetrical frequencies (omega <0)
+    idxs = np.flatnonzero((sig_fft != 0) & (sample_freq > 0))
+    complex_val = sig_fft[idxs]
+    phi = arccos(complex_val.real/abs(complex_val))
+    phi *= np.where(complex_val.imag >= 0, 1, -1)
+    model = FourierModel(H0=abs(sig_fft[sample_freq == 0]).sum()/len(sig),
+                         A=abs(complex_val)/len(sig_fft)*2.,  #amplitude in `sig` units (multiplied by 2 due to ignorance of negative symmetrical frequencies)
+                         omega=sample_freq[idxs]*2*pi,  # angular velocity in [rad/s]
+                         phi=phi)  # phase shift in [rad]
 
+    EQUATION = {}
+    for i, a, omega, phi in zip(idxs, model.A, model.omega, model.phi):
+        EQUATION['{0}'.format(i+1)] = {'A': a, 'omega': omega, 'phi': phi}
     # finally treat freq=0 special case
     EQUATION['0'] = {}
     EQUATION['0']['A'] = abs(sig_fft[np.where(sample_freq == 0)])/len(sig)
-    
-
-    # now generate computation function
-    def generate_sig_simplified_function(EQUATION):
-        ''' EQUATION dictionary is created above
-        y = H0 + A1*cos(omega1*t+phi1) + A2*cos(omega2*t+phi2) + ... + A_i*cos(omega_i*t+phi_i)
-        '''
-        STR = u"def generated_function(t): return (np.zeros({0}) + {1}".format(len(t), EQUATION['0']['A'])
-        for k, v in EQUATION.iteritems():
-            if k == '0':
-                continue
-            STR += u" + {0}*np.cos({1}*t+{2})".format(v['A'], v['omega'], v['phi'])
-        STR += ')'
-        exec(STR) in globals(), locals()
-        return (STR, generated_function)
 
     # simulate time_vector [seconds]
     t = np.arange(0, len(sig)*timestep, timestep)
     # calculate y-values with simplified equation
-    f_str, f = generate_sig_simplified_function(EQUATION)
+    f_str, f = model.to_string(), model
     y = f(t)
 
     fig = None
@@ -202,7 +245,7 @@ def pandas_fourier_analysis(df, sig_name, date_name=None, ranges=(), **kwargs):
         f_str (str):
             string representation of the computed function. Function can be generated with:
                 exec(f_str)
-        f (function):
+        f (FourierModel):
             function y=f(t) which accepts t as array of time values in seconds
         fig (matplotlib figure|None):
             instance of the generated figure or None. Is usefull for displaying later
@@ -224,31 +267,21 @@ def pandas_fourier_analysis(df, sig_name, date_name=None, ranges=(), **kwargs):
         raise ValueError('Set proper column name to param `date_name` or None if datetime index')
 
     if ranges:
-        time_vector = df.ix[ranges[0]:ranges[1]].index.values
+        time_vector = df.loc[ranges[0]:ranges[1]].index.values
         sig = df[sig_name][ranges[0]:ranges[1]].values
     else:
         time_vector = time_vector.values
-        sig = df[sig_name]
+        sig = df[sig_name].values
 
     EQ, f_str, f, fig = fourier_analysis(sig, timestep, datetime_plot=time_vector, **kwargs)
     
 
     # now create Pandas Dataframe out of equation so we can quickly parse it to excel
-    A = []
-    omega = []
-    phi = []
-    for k in sorted(EQ.keys()):
-        if k == '0':
-            A.append(EQ[k]['A'][0])  # no idea why we need to set index [0]
-            omega.append(float('NaN'))
-            phi.append(float('NaN'))
-        else:
-            A.append(EQ[k]['A'])
-            omega.append(EQ[k]['omega'])
-            phi.append(EQ[k]['phi'])
-    A = np.array(A)
-    omega = np.array(omega)
-    phi = np.array(phi)
+    # (rows are ordered by the string keys of `EQ`, as in the tables written before)
+    keys = sorted(k for k in EQ.keys() if k != '0')
+    A = np.array([f.H0] + [EQ[k]['A'] for k in keys])
+    omega = np.array([np.nan] + [EQ[k]['omega'] for k in keys])
+    phi = np.array([np.nan] + [EQ[k]['phi'] for k in keys])
 
     if NEW_DF_CREATED:
         del df
@@ -256,6 +289,225 @@ def pandas_fourier_analysis(df, sig_name, date_name=None, ranges=(), **kwargs):
 
 
 
+def batch_fourier_analysis(df, columns, windows=None, date_name=None, N_MAX_POW=1):
+    ''' Same as "pandas_fourier_analysis()" for many columns and many time
+    windows at once (e.g. every well for every month). The data is not copied:
+    windows are sliced with `np.searchsorted` (datetime must be sorted) and
+    all columns of one window are transformed with one 2-D real FFT along the
+    time axis. Time t=0 of every equation is the first timestep of its window.
+
+    Args:
+    -----
+        df (pd.DataFrame):
+            data with uniform timestep
+        columns (list[str]):
+            names of the columns in `df` with investigated signal values
+        windows (list[tuple(np.datetime64, np.datetime64)]|None):
+            time windows (start, stop), both inclusive. If `None` - the whole
+            timespan. Example (monthly):
+                starts = pd.date_range('2015-01-01', '2016-01-01', freq='MS')
+                windows = [(s, e - pd.Timedelta('1ns')) for s, e in zip(starts[:-1], starts[1:])]
+        date_name (str|None):
+            name of the column in `df` with datetime information. If `None`
+            will use datetime indexes
+        N_MAX_POW (int):
+            number of frequencies with maximum power, see "fourier_analysis()"
+
+    Return:
+    -------
+        pd.DataFrame:
+            stacked table with columns 'Column', 'Window start', 'Window stop',
+            'Amplitude [m]', 'Angular Velocity [rad/s]', 'Phase shift [rad]'.
+            Rows of every column and window are the same as the table of
+            "pandas_fourier_analysis()" (first row - constant), but the waves
+            are sorted by frequency. Column-windows
+            with NaN values or less than 2 values are skipped
+    '''
+    columns = list(columns)
+    date = df.index.values if date_name is None else df[date_name].values
+    values = df[columns].values.astype(float)  # one 2D array, windows are views of it
+    timestep = (date[1] - date[0])/np.timedelta64(1, 's')  # we assume that dt is uniform al over the df
+    if windows is None:
+        windows = [(date[0], date[-1])]
+
+    TABLES = list()
+    for start, stop in windows:
+        i0 = np.searchsorted(date, np.datetime64(start, 'ns').astype(date.dtype), side='left')
+        i1 = np.searchsorted(date, np.datetime64(stop, 'ns').astype(date.dtype), side='right')
+        sig = values[i0:i1]
+        valid = ~np.isnan(sig).any(axis=0) if sig.shape[0] > 1 else np.zeros(len(columns), dtype=bool)
+        if not valid.all():
+            logger.warning('Window {0} - {1}: columns {2} are skipped (NaN values or too short)'.format(
+                start, stop, [c for c, v in zip(columns, valid) if not v]))
+        if not valid.any():
+            continue
+        n = sig.shape[0]
+        sig_fft = np.fft.rfft(sig[:, valid], axis=0)  # shape (n//2+1, n_valid_columns)
+
+        # same selection as in "fourier_analysis()": only positive frequencies
+        # below Nyquist are waves, the constant is kept if its power is high enough
+        n_pos = (n - 1)//2
+        power = abs(sig_fft)
+        N = min(N_MAX_POW, n_pos)
+        thres_power = np.sort(power[1:n_pos+1], axis=0)[-N] if N > 0 else np.full(power.shape[1], np.inf)
+        keep = power[:n_pos+1] >= thres_power
+        H0 = np.where(keep[0], power[0], 0.)/n
+
+        # rows: first the constant of every column, then its waves in frequency order
+        j, k = np.nonzero(keep[1:].T)
+        k += 1
+        complex_val = sig_fft[k, j]
+        phi = arccos(complex_val.real/abs(complex_val))
+        phi *= np.where(complex_val.imag >= 0, 1, -1)
+        omega = k/(n*timestep)*2*pi
+
+        col = np.r_[np.arange(H0.size), j]
+        order = np.argsort(col, kind='mergesort')
+        table = pd.DataFrame()
+        table['Column'] = np.array(columns, dtype=object)[valid][col[order]]
+        table['Window start'] = date[i0]
+        table['Window stop'] = date[i1-1]
+        table['Amplitude [m]'] = np.r_[H0, abs(complex_val)/n*2.][order]
+        table['Angular Velocity [rad/s]'] = np.r_[np.full(H0.size, np.nan), omega][order]
+        table['Phase shift [rad]'] = np.r_[np.full(H0.size, np.nan), phi][order]
+        TABLES.append(table)
+    if not TABLES:
+        return pd.DataFrame(columns=['Column', 'Window start', 'Window stop', 'Amplitude [m]', 'Angular Velocity [rad/s]', 'Phase shift [rad]'])
+    return pd.concat(TABLES, ignore_index=True)
+
+
+
+def welch_spectrum(sig, timestep, segment_length, overlap=0.5, max_block_size=2**20):
+    ''' Amplitude spectrum averaged over overlapping segments (Welch 1967).
+    Every segment is detrended (mean removed), multiplied with a Hann window
+    and transformed with a real FFT. The segments are views of `sig` and are
+    processed in blocks of at most `max_block_size` values, so the memory
+    does not depend on the length of the signal. Segments with NaN values
+    are skipped.
+
+    Args:
+    -----
+        sig (1D array):
+            signal with uniform timestep
+        timestep (float):
+            timestep in seconds
+        segment_length (int):
+            number of values in one segment (defines the frequency resolution
+            1/(segment_length*timestep))
+        overlap (float):
+            overlap of two neighbour segments as fraction of `segment_length` [0, 1)
+        max_block_size (int):
+            maximal number of values transformed at once
+
+    Return:
+    -------
+        pd.DataFrame:
+            table with columns 'Frequency [Hz]', 'Frequency [cycles/day]',
+            'Period [hours]', 'Amplitude [m]' (amplitude of a sinusoid at this
+            frequency) and 'PSD [m**2/Hz]' (one-sided power spectral density)
+        n_segments (int):
+            number of averaged segments
+    '''
+    sig = np.ascontiguousarray(sig, dtype=float)
+    segment_length = int(segment_length)
+    if not 1 < segment_length <= sig.size:
+        raise ValueError('Segment length must be within [2, {0}], received {1}'.format(sig.size, segment_length))
+    if not 0 <= overlap < 1:
+        raise ValueError('Overlap must be within [0, 1), received {0}'.format(overlap))
+    step = max(1, int(round(segment_length*(1.-overlap))))
+    starts = np.arange(0, sig.size-segment_length+1, step)
+
+    window = np.hanning(segment_length+1)[:-1]  # periodic Hann window
+    power = np.zeros(segment_length//2+1)
+    n_segments = 0
+    block = max(1, max_block_size//segment_length)
+    for i0 in range(0, starts.size, block):
+        # segments [i0:i0+block] as a strided view (no copy) of `sig`
+        first = starts[i0]
+        n = min(block, starts.size-i0)
+        segments = np.lib.stride_tricks.as_strided(sig[first:], shape=(n, segment_length),
+                                                   strides=(step*sig.strides[0], sig.strides[0]))
+        segments = segments[~np.isnan(segments).any(axis=1)]
+        if segments.shape[0] == 0:
+            continue
+        spec = np.fft.rfft((segments - segments.mean(axis=1)[:, None])*window, axis=1)
+        power += (spec.real**2 + spec.imag**2).sum(axis=0)
+        n_segments += segments.shape[0]
+    if n_segments == 0:
+        raise ValueError('All segments contain NaN values')
+    power /= n_segments
+
+    freqs = np.fft.rfftfreq(segment_length, d=timestep)
+    onesided = np.full(power.size, 2.)
+    onesided[0] = 1.
+    if segment_length % 2 == 0:
+        onesided[-1] = 1.
+    spectrum = pd.DataFrame()
+    spectrum['Frequency [Hz]'] = freqs
+    spectrum['Frequency [cycles/day]'] = freqs*60*60*24
+    with np.errstate(divide='ignore'):
+        spectrum['Period [hours]'] = 1./freqs/3600.
+    spectrum['Amplitude [m]'] = np.sqrt(power)*onesided/window.sum()
+    spectrum['PSD [m**2/Hz]'] = power*onesided*timestep/(window**2).sum()
+    return spectrum, n_segments
+
+
+def pandas_welch_spectrum(df, sig_name, date_name=None, ranges=(), segment_days=15., generate_plot=False, **kwargs):
+    ''' wrapper to function "welch_spectrum()".
+    Automatically processes pandas DataFrame (see "pandas_fourier_analysis()")
+
+    Args:
+    -----
+        df (pd.DataFrame):
+            data
+        sig_name (str):
+            name of the column in `df` with investigated signal values
+        date_name (str|None):
+            name of the column in `df` with datetime information. If `None`
+            will use datetime indexes
+        ranges (tuple(np.datetime64, np.datetime64)):
+            tuple of two datetime objects representing slice region.
+            If emty (ranges=()) then all timespan will be used
+        segment_days (float):
+            length of one segment in days (is reduced to the length of the data)
+        generate_plot (bool):
+            flag to generate matplotlib figure with the spectrum
+        **kwargs:
+            are passed to "welch_spectrum()"
+
+    Return:
+    -------
+        spectrum (pd.DataFrame):
+            see "welch_spectrum()"
+        n_segments (int):
+            number of averaged segments
+        fig (matplotlib figure|None):
+            instance of the generated figure or None
+    '''
+    date = df.index.values if date_name is None else df[date_name].values
+    sig = df[sig_name].values
+    if ranges:
+        # data is sorted by datetime, slice without copying
+        i0, i1 = np.searchsorted(date, np.array(ranges, dtype=date.dtype), side='left')
+        date, sig = date[i0:i1], sig[i0:i1]
+    timestep = (date[1] - date[0])/np.timedelta64(1, 's')  # we assume that dt is uniform al over the df
+    segment_length = min(len(sig), int(round(segment_days*86400./timestep)))
+
+    spectrum, n_segments = welch_spectrum(sig, timestep, segment_length, **kwargs)
+
+    fig = None
+    if generate_plot:
+        fig, ax = plt.subplots(1)
+        ax.plot(spectrum['Frequency [cycles/day]'].values[1:], spectrum['Amplitude [m]'].values[1:])
+        ax.set_xlabel('Frequency [cycles/day]')
+        ax.set_ylabel('Amplitude [m]')
+        ax.set_yscale('log')
+        ax.set_title('Amplitude Spectrum ({0} segments of {1:.2f} days)'.format(n_segments, segment_length*timestep/86400.))
+        fig.tight_layout()
+    return spectrum, n_segments, fig
+
+
+
 
 if __name__ == '__main__':
     t = np.arange(0, 100, 0.01)
@@ -1,3 +1,5 @@
+import time
+import multiprocessing
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
@@ -51,55 +53,42 @@ def createInterpolationRanges(df, columnName, interpolateMargin=100, log=False):
             NaN occurences
     """
     N = len(df.index)
-    validN = df[columnName].count()
-    nanN = (N-validN)
+    isnan = df[columnName].isnull().values
+    nanN = int(isnan.sum())
     if log: print( 'createInterpolationRanges(): Column <{0}>: entries - {1}, NaNs - {2}'.format(columnName, N, nanN))
-    
+
     if nanN > 0:
         # indeces of NaN values
-        nanIndeces = np.where(df[columnName].isnull())[0]
-        #print( nanIndeces)
-
-        # create regions...
-        regions = list()
-        region = list()
-
-        for i, v in enumerate(nanIndeces):
-            if i == 0:  # treat first element
-                region.append(v)
-                continue
-            elif i == len(nanIndeces)-1 and len(region) == 1:  # treat last element
-                region.append(nanIndeces[i])
-                regions.append(region)
-                continue
-            if v - nanIndeces[i-1] > interpolateMargin:  # distance is too big, save previous region, start new region
-                region.append(nanIndeces[i-1])
-                regions.append(region)
-                region = list()
-                region.append(v)
-
-        # now add and substract interpolation margins:
-        iMin = 0
-        iMax = N-1
+        nanIndeces = np.flatnonzero(isnan)
 
-        for r in regions:
-            #print( r)
-            r[0] = max(iMin, r[0]-interpolateMargin)
-            r[1] = min(iMax, r[1]+interpolateMargin)
+        # NaN values closer than *interpolateMargin* to each other belong to one region
+        breaks = np.flatnonzero(np.diff(nanIndeces) > interpolateMargin)
+        first = nanIndeces[np.r_[0, breaks+1]]
+        last  = nanIndeces[np.r_[breaks, nanIndeces.size-1]]
 
-        #for r in regions:
-        #    print( r)
+        # now add and substract interpolation margins:
+        first = np.maximum(0, first-interpolateMargin)
+        last  = np.minimum(N-1, last+interpolateMargin)
+        regions = [[int(r0), int(r1)] for r0, r1 in zip(first, last)]
         return regions
     else:  # no NaN values detected. Interpolation is not needed. Return None
         if log: print( 'createInterpolationRanges(): Column *{0}* has no missing data. Nothing to interpolate. Aborting... '.format(columnName))
         return None
 
 
+# methods of `pandas.Series.interpolate()`, which use only the closest valid
+# values around a NaN. Interpolation within the regions is then equal to the
+# interpolation of the whole column
+LOCAL_METHODS = ['linear', 'time', 'index', 'values', 'pad', 'ffill', 'backfill', 'bfill', 'nearest', 'zero', 'slinear']
+
+
 def applyInterpolationBasedOnRanges(df, columnName, ranges, suffix='_interpolated', **kwargs):
     u""" Function interpolates data within given *ranges* (*ranges* should be
          generated with *createInterpolationRanges()*)
 
-         Interpolation is done with native `pandas.DataFrame.interpolate()` method
+         Interpolation is done with native `pandas.DataFrame.interpolate()` method.
+         Methods from *LOCAL_METHODS* are applied to all regions in one call,
+         other methods (e.g. 'polynomial', 'spline') region by region
 
 
         INPUT:
@@ -122,11 +111,76 @@ def applyInterpolationBasedOnRanges(df, columnName, ranges, suffix='_interpolate
     if ranges is None:  # nothing to interpolate
         return
     columnNameNew = columnName+suffix
-    df[columnNameNew] = df[columnName]
+    values = df[columnName].values.astype(float)
+    result = values.copy()
+    todo = np.isnan(values)  # NaNs that are not yet interpolated
+
+    if kwargs.get('method', 'linear') in LOCAL_METHODS:
+        # one call for all regions (every NaN lies within a region)
+        interpolated = df[columnName].astype(float).interpolate(**kwargs).values
+        result[todo] = interpolated[todo]
+    else:
+        # each region separately. Neighbour regions may overlap (within the
+        # margins), each NaN is interpolated only within its own (first) region
+        for r in ranges:
+            region = slice(r[0], r[1]+1)
+            interpolated = pd.Series(values[region], index=df.index[region]).interpolate(**kwargs).values
+            result[region] = np.where(todo[region], interpolated, result[region])
+            todo[region] = False
+    df[columnNameNew] = result
+
+
+def _interpolate_column_worker(args):
+    columnName, values, index, interpolateMargin, kwargs = args
+    t0 = time.time()
+    df = pd.DataFrame({columnName: values}, index=index)
+    ranges = createInterpolationRanges(df, columnName, interpolateMargin=interpolateMargin)
+    applyInterpolationBasedOnRanges(df, columnName, ranges, suffix='_interpolated', **kwargs)
+    interpolated = df[columnName+'_interpolated'].values if ranges is not None else values
+    return columnName, interpolated, time.time()-t0
+
+
+def interpolateColumns(df, columns, processes=1):
+    u""" Interpolate several columns of *df* (see *createInterpolationRanges()*
+         and *applyInterpolationBasedOnRanges()*) at once. Columns are
+         independent, they may be interpolated in parallel in a pool of processes.
 
-    for r in ranges:
-        df.loc[r[0]:r[1], columnNameNew] = df[columnName][r[0]:r[1]+1].interpolate(**kwargs)
 
+        INPUT:
+        ------------------------------------------------------------------------------
+         *df*                - pandas.DataFrame, our data (is not modified)
+         *columns*           - dict, {column name: (interpolateMargin, kwargs)},
+                               where *kwargs* are passed to *DataFrame.interpolate()*
+         *processes*         - int, number of worker processes. If None - number
+                               of CPUs. If 1 (default) or if only one column is
+                               interpolated - columns are interpolated one by one
+                               in the current process (no pool is started)
+
+        OUTPUT:
+        ------------------------------------------------------------------------------
+         *interpolated*      - dict, {column name: 1D np.ndarray with interpolated values}
+         *timing*            - dict, {column name: time of the interpolation in seconds}
+        ------------------------------------------------------------------------------
+
+    """
+    TASKS = [(columnName, df[columnName].values, df.index, margin, kwargs) for columnName, (margin, kwargs) in columns.items()]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(TASKS))
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            RESULTS = pool.map(_interpolate_column_worker, TASKS, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        RESULTS = [_interpolate_column_worker(task) for task in TASKS]
+
+    interpolated = dict((columnName, values) for columnName, values, _ in RESULTS)
+    timing = dict((columnName, seconds) for columnName, _, seconds in RESULTS)
+    return interpolated, timing
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+#!/usr/bin python
+# -*- coding: utf-8 -*-
+import multiprocessing
+import numpy as np
+import pandas as pd
+import logging
+
+from detectpeaks import detectPeaks_ts, match_peaks, prepare_order
+from TidalEfficiency import tidalEfficiency_method2, tidalEfficiency_method3
+from TimeLag import timelag_erskine1991_method, prepare_crosscorrelation_river, crosscorrelation_curve, crosscorrelation_maximum
+from ferris1951 import diffusivity_from_tidal_efficiency, diffusivity_from_time_lag
+
+logger = logging.getLogger(__name__)
+
+
+_MULTIWELL_RIVER = None  # river data shared with the workers of `multiwell_tidal_efficiency_timelag()`
+
+
+def _init_multiwell_worker(river):
+    global _MULTIWELL_RIVER
+    _MULTIWELL_RIVER = river
+
+
+def _multiwell_worker(args):
+    well, values, kwargs = args
+    river = _MULTIWELL_RIVER
+    date = river['date']
+    result = {'well': well, 'E1': np.nan, 'E2': np.nan, 'E3': np.nan, 'tlag': np.nan,
+              'n_cycles': 0, 'n_skipped_cycles': 0}
+
+    # 1) STD (Erskine 1991), the river STD is computed only once
+    result['E1'] = pd.Series(values).std()/river['std']
+
+    # 2) Cyclic amplitude (Smith 1994) and 3) Cyclic STD, river peaks are detected only once
+    if river['peaks'] is not None:
+        dt = river['datetime']
+        data = pd.DataFrame({dt: date, river['name']: river['values'], well: values})
+        try:
+            peaks_gw = detectPeaks_ts(data, well, datetime=dt, **kwargs['peaks'])
+            md_peaks = match_peaks(river['peaks'], peaks_gw, 'time_min', **kwargs['match'])
+        except (ValueError, IndexError) as err:
+            logger.warning('Well <{0}>: tidal cycles cannot be matched, E2 and E3 are not calculated ({1})'.format(well, err))
+        else:
+            md_peaks = md_peaks.loc[~md_peaks['md_N'].isin([np.nan, None])]  # select only valid cycles
+            result['n_cycles'] = len(md_peaks)
+            if len(md_peaks) > 0:
+                result['E2'] = tidalEfficiency_method2(md_peaks['tidal_range'], md_peaks['md_tidal_range'])[0]
+                E3, _, skipped = tidalEfficiency_method3(data, river['name'], well, dt,
+                                    md_peaks['time_min'], md_peaks['time_max'],
+                                    md_peaks['md_time_min'], md_peaks['md_time_max'], return_skipped=True)
+                result['E3'] = E3
+                result['n_skipped_cycles'] = skipped.size
+
+    # time lag, in seconds
+    try:
+        if kwargs['tlag_method'] == 'crosscorrelation':
+            # the river FFT is computed only once
+            tlags, r = crosscorrelation_curve(date, values, date, river['values'], result['E1'], river=river['xcorr'])
+            result['tlag'] = crosscorrelation_maximum(tlags, r, kwargs['tlag_range'][0:2])[0]*60.
+        else:
+            df = pd.DataFrame({'Datetime': date, 'river': river['values'], 'gw': values})
+            tlag = timelag_erskine1991_method(df, 'gw', 'Datetime', df, 'river', 'Datetime', result['E1'], tlag_tuple=kwargs['tlag_range'])
+            result['tlag'] = tlag.total_seconds()
+    except ValueError as err:
+        logger.warning('Well <{0}>: timelag is not calculated ({1})'.format(well, err))
+    return result
+
+
+def multiwell_tidal_efficiency_timelag(data, river, wells, datetime, T=12.42, hMargin=1.5, order=None,
+                                       tlag_method='crosscorrelation', tlag_range=(0, 60, 1),
+                                       x0=None, match_kwargs=None, processes=None):
+    '''
+    Calculate tidal efficiency (all three methods of `TidalEfficiency`) and
+    timelag of many observation wells (e.g. a transect of piezometers) with
+    respect to one river at once.
+
+    Work that depends only on the river is done only once: its standard
+    deviation, its peaks (tidal cycles) and its FFT (cross-correlation). The
+    wells are processed in parallel in a pool of processes.
+
+    Args:
+    -----
+        data (pd.DataFrame):
+            dataframe with the river and the groundwater hydrographs
+        river (str):
+            column name of the river hydrograph
+        wells (list[str]):
+            column names of the groundwater hydrographs
+        datetime (str):
+            column name of the datetime data (must be sorted)
+        T (Optional[float]):
+            period of the tide in hours. Is used for the peak detection and
+            as `t0` for the diffusivity. If `None` - methods 2) and 3) are skipped
+        hMargin (float):
+            safety margin in hours for the peak detection, see `detectpeaks.detectPeaks_ts()`
+        order (Optional[int]):
+            order of the peak detection, see `detectpeaks.detectPeaks()`
+        tlag_method (str):
+            'crosscorrelation' - see `TimeLag.timelag_crosscorrelation_method()`
+            'erskine1991'      - see `TimeLag.timelag_erskine1991_method()` (with `E1`)
+        tlag_range (tuple(int, int, int)):
+            timelags to be tested in *minutes* (for 'crosscorrelation' only
+            the first two values - the range - are used)
+        x0 (Optional[dict]):
+            distance of each well to the river {column name: distance in meters}.
+            If passed, the diffusivity after Ferris 1951 is added to the table
+        match_kwargs (Optional[dict]):
+            passed to `detectpeaks.match_peaks()`
+        processes (Optional[int]):
+            number of worker processes. If `None` - number of CPUs. If `1` - the
+            wells are processed one-by-one in the current process
+
+    Returns:
+    --------
+        results (pd.DataFrame):
+            one row per well with columns
+                'well'             - column name of the well
+                'E1', 'E2', 'E3'   - tidal efficiency with methods
+                                     1) STD, 2) Cyclic amplitude, 3) Cyclic STD
+                'tlag'             - timelag in seconds
+                'n_cycles'         - number of matched tidal cycles
+                'n_skipped_cycles' - number of cycles skipped by method 3)
+                't0'               - period of the tide in seconds
+            and, if `x0` is passed, 'x0' and the diffusivities 'D_E1', 'D_E2',
+            'D_E3', 'D_tlag' [m**2/s] (see `ferris1951.diffusivity_from_tidal_efficiency()`
+            and `ferris1951.diffusivity_from_time_lag()`)
+    '''
+    wells = list(wells)
+    if tlag_method not in ('crosscorrelation', 'erskine1991'):
+        raise NotImplementedError('Timelag method <{0}> is not implemented'.format(tlag_method))
+    date = data[datetime].values
+    river_values = data[river].values.astype(float)
+
+    logger.debug('Prepare river <{0}>'.format(river))
+    shared = {'name': river, 'datetime': datetime, 'date': date, 'values': river_values,
+              'std': pd.Series(river_values).std(), 'peaks': None, 'xcorr': None}
+    kwargs = {'tlag_method': tlag_method, 'tlag_range': tlag_range,
+              'match': match_kwargs if match_kwargs is not None else dict(),
+              'peaks': {'T': T, 'hMargin': hMargin, 'order': order}}
+    if T is not None:
+        if order is None:
+            kwargs['peaks']['order'] = prepare_order(T, hMargin, date)
+        shared['peaks'] = detectPeaks_ts(data, river, datetime=datetime, **kwargs['peaks'])
+    if tlag_method == 'crosscorrelation':
+        shared['xcorr'] = prepare_crosscorrelation_river(date, river_values)
+
+    TASKS = [(well, data[well].values.astype(float), kwargs) for well in wells]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(TASKS))
+
+    logger.debug('Processing {0} wells with {1} process(es)'.format(len(TASKS), processes))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=_init_multiwell_worker, initargs=(shared, ))
+        try:
+            RESULTS = pool.map(_multiwell_worker, TASKS, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_multiwell_worker(shared)
+        RESULTS = [_multiwell_worker(task) for task in TASKS]
+
+    results = pd.DataFrame(RESULTS, columns=['well', 'E1', 'E2', 'E3', 'tlag', 'n_cycles', 'n_skipped_cycles'])
+    results['t0'] = T*3600. if T is not None else np.nan
+    if x0 is not None:
+        results['x0'] = [x0.get(well, np.nan) for well in wells]
+
+        def diffusivity(func, col):
+            D = list()
+            for value, x, t0 in zip(results[col], results['x0'], results['t0']):
+                valid = not (np.isnan(value) or np.isnan(x) or np.isnan(t0)) and value != 0
+                if func is diffusivity_from_tidal_efficiency:
+                    valid = valid and 0 < value < 1
+                D.append(func(value, x, t0) if valid else np.nan)
+            return D
+        for col in ('E1', 'E2', 'E3'):
+            results['D_'+col] = diffusivity(diffusivity_from_tidal_efficiency, col)
+        results['D_tlag'] = diffusivity(diffusivity_from_time_lag, 'tlag')
+    return results
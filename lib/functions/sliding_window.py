@@ -0,0 +1,194 @@
+#!/usr/bin python
+# -*- coding: utf-8 -*-
+import multiprocessing
+import numpy as np
+import pandas as pd
+import logging
+
+from TimeLag import NaT, lagged_river_values, tlag_tuple_to_array
+
+logger = logging.getLogger(__name__)
+
+
+def _window_sums(t, x, starts, window):
+    ''' Number of valid values, their sum and sum of squares of `x` (with
+    sorted int64 timestamps `t`) within windows [start:start+window).
+    Computed with prefix sums, i.e. O(N + n_windows)'''
+    i0 = np.searchsorted(t, starts, side='left')
+    i1 = np.searchsorted(t, starts + window, side='left')
+    valid = ~np.isnan(x)
+    x = np.where(valid, x, 0.)
+
+    def window_sum(a):
+        c = np.concatenate(([0.], np.cumsum(a)))
+        return c[i1] - c[i0]
+    return window_sum(valid.astype(float)), window_sum(x), window_sum(x*x)
+
+
+def window_mean_std(t, x, starts, window):
+    ''' Mean and standard deviation (ddof=1) of `x` within windows
+    [start:start+window). NaN values are ignored. See `_window_sums()`'''
+    x = np.asarray(x, dtype=float)
+    offset = np.nanmean(x) if (~np.isnan(x)).any() else 0.  # improves the precision of the sums of squares
+    n, s1, s2 = _window_sums(t, x - offset, starts, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s1/n
+        var = (s2 - n*mean**2)/(n - 1.)
+    std = np.sqrt(np.where(n > 1, np.maximum(var, 0.), np.nan))
+    return np.where(n > 0, mean + offset, np.nan), std
+
+
+def _windowed_worker(args):
+    tg, h, tw, w_v, starts, window, lags, cycles = args
+
+    # tidal efficiency (Erskine 1991, method 1) of every window
+    mh, std_h = window_mean_std(tg, h, starts, window)
+    mw, std_w = window_mean_std(tw, w_v, starts, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        E = std_h/std_w
+    a = 1./E
+
+    # mean squared error of Erskine 1991 for every window and timelag:
+    #   sum over pairs of ( (h - <h>)/E - (w - <w>) )**2, expanded into sums that
+    #   are evaluated for all windows at once with prefix sums
+    MSE = np.empty((starts.size, lags.size))
+    for j, river in enumerate(lagged_river_values(tg, tw, w_v, lags)):
+        pair = ~np.isnan(h) & ~np.isnan(river)
+        hp = np.where(pair, h, np.nan)
+        rp = np.where(pair, river, np.nan)
+        n, sh, shh = _window_sums(tg, hp, starts, window)
+        _, sr, srr = _window_sums(tg, rp, starts, window)
+        _, shr, _ = _window_sums(tg, hp*rp, starts, window)
+        shh_c = shh - 2.*mh*sh + n*mh**2
+        srr_c = srr - 2.*mw*sr + n*mw**2
+        shr_c = shr - mw*sh - mh*sr + n*mh*mw
+        with np.errstate(divide='ignore', invalid='ignore'):
+            MSE[:, j] = np.where(n > 0, (a**2*shh_c + srr_c - 2.*a*shr_c)/n, np.nan)
+
+    result = {'E': E, 'MSE': MSE}
+    if cycles is not None:
+        # tidal efficiency (method 3) - mean of the cyclic values within the window
+        t_cycle, E_cycle = cycles
+        n, s1, _ = _window_sums(t_cycle, E_cycle, starts, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['E_cyclic_mean'] = np.where(n > 0, s1/n, np.nan)
+    return result
+
+
+def sliding_window_timelag_efficiency(df_gw, cn_gw_v, cn_gw_t,
+                                      df_w,  cn_w_v,  cn_w_t,
+                                      window, stride,
+                                      tlag_tuple=(0, 60, 1),
+                                      cycle_times=None, E_cyclic=None,
+                                      processes=1):
+    '''
+    Track tidal efficiency and timelag over a long record with a sliding window.
+    For every window [start:start+window) (starts every `stride`):
+
+        'E'    - tidal efficiency after Erskine 1991 (method 1, ratio of the
+                 standard deviations within the window)
+        'tlag' - timelag after Erskine 1991 with the window's mean values and
+                 `E`: the timelag from `tlag_tuple` with minimal mean squared error
+
+    Window statistics are not recomputed from scratch for each window: they
+    are differences of prefix sums (running sums, sums of squares and
+    cross-products for every timelag), so the cost does not depend on the
+    window length. Windows are split into chunks that are processed in a pool
+    of `processes` processes.
+
+    Args:
+    -----
+        df_gw, cn_gw_v, cn_gw_t, df_w, cn_w_v, cn_w_t:
+            same as for `TimeLag.timelag_erskine1991_method()`
+        window (np.timedelta64, datetime.timedelta, str):
+            window length (e.g. '14D')
+        stride (np.timedelta64, datetime.timedelta, str):
+            distance between the starts of two neighbour windows (e.g. '1D')
+        tlag_tuple (tuple(int, int, int)):
+            timelags to be tested, in *minutes*. See
+            `TimeLag.timelag_erskine1991_method()`
+        cycle_times (Optional[1D array_like of np.datetime64]):
+            datetime of the tidal cycles (e.g. 'time_min' of the matched peaks)
+        E_cyclic (Optional[1D array_like]):
+            tidal efficiency of each cycle in `cycle_times` (see
+            `TidalEfficiency.tidalEfficiency_method3()`). If passed, their mean
+            within each window is added as column 'E_cyclic'
+        processes (Optional[int]):
+            number of worker processes. If `None` - number of CPUs
+
+    Returns:
+    --------
+        windows (pd.DataFrame):
+            one row per window, columns 'Datetime' (center of the window),
+            'start', 'end', 'E', 'tlag' (minutes), 'MSE' (minimal mean squared
+            error), optionally 'E_cyclic'
+    '''
+    window = pd.Timedelta(window).value
+    stride = pd.Timedelta(stride).value
+    if window <= 0 or stride <= 0:
+        raise ValueError('Window length and stride must be positive')
+    tlags = tlag_tuple_to_array(tlag_tuple)
+    lags = tlags.astype('timedelta64[m]').astype('timedelta64[ns]').view(np.int64)
+
+    def sorted_series(t, v):
+        t = np.asarray(t).astype('datetime64[ns]').view(np.int64)
+        v = np.asarray(v, dtype=float)
+        valid = t != NaT
+        i = np.argsort(t[valid], kind='mergesort')
+        return t[valid][i], v[valid][i]
+
+    tg, h = sorted_series(df_gw[cn_gw_t].values, df_gw[cn_gw_v].values)
+    tw, w_v = sorted_series(df_w[cn_w_t].values, df_w[cn_w_v].values)
+    if tg.size == 0 or tw.size == 0:
+        raise ValueError('Input datasets are empty')
+    cycles = None
+    if E_cyclic is not None:
+        cycles = sorted_series(cycle_times, E_cyclic)
+
+    t_first = max(tg[0], tw[0])
+    t_last = min(tg[-1], tw[-1])
+    if t_last - t_first < window:
+        raise ValueError('Overlap of the hydrographs is shorter than the window')
+    starts = np.arange(t_first, t_last - window + 2, stride, dtype=np.int64)
+
+    # split the windows into chunks, each chunk receives only its slice of the data
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    n_chunks = max(1, min(processes*4, starts.size)) if processes > 1 else 1
+    TASKS = list()
+    for chunk in np.array_split(starts, n_chunks):
+        lo, hi = chunk[0], chunk[-1] + window
+        g = slice(np.searchsorted(tg, lo), np.searchsorted(tg, hi))
+        # the river is needed both unshifted (window statistics) and shifted by every timelag
+        w = slice(np.searchsorted(tw, min(lo, lo - lags.max())), np.searchsorted(tw, max(hi, hi - lags.min())))
+        c = None
+        if cycles is not None:
+            c = slice(np.searchsorted(cycles[0], lo), np.searchsorted(cycles[0], hi))
+            c = (cycles[0][c], cycles[1][c])
+        TASKS.append((tg[g], h[g], tw[w], w_v[w], chunk, window, lags, c))
+
+    logger.debug('Processing {0} windows in {1} chunks with {2} process(es)'.format(starts.size, len(TASKS), processes))
+    if processes > 1 and len(TASKS) > 1:
+        pool = multiprocessing.Pool(min(processes, len(TASKS)))
+        try:
+            RESULTS = pool.map(_windowed_worker, TASKS, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        RESULTS = [_windowed_worker(task) for task in TASKS]
+
+    MSE = np.concatenate([r['MSE'] for r in RESULTS])
+    all_nan = np.isnan(MSE).all(axis=1)
+    i_min = np.argmin(np.where(np.isnan(MSE), np.inf, MSE), axis=1)
+
+    windows = pd.DataFrame()
+    windows['Datetime'] = (starts + window//2).view('datetime64[ns]')
+    windows['start'] = starts.view('datetime64[ns]')
+    windows['end'] = (starts + window).view('datetime64[ns]')
+    windows['E'] = np.concatenate([r['E'] for r in RESULTS])
+    windows['tlag'] = np.where(all_nan, np.nan, tlags[i_min])
+    windows['MSE'] = np.where(all_nan, np.nan, MSE[np.arange(MSE.shape[0]), i_min])
+    if cycles is not None:
+        windows['E_cyclic'] = np.concatenate([r['E_cyclic_mean'] for r in RESULTS])
+    return windows
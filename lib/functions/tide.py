@@ -11,7 +11,31 @@ def canalCurve(t=[], A=0., omega=0., phi=0.):
     return A*np.cos(omega*t + phi)
 
 
-def generate_tide(t0, dt, tend, components={}, label='GenCurve', equation='tide', W=0., F=1., **kwargs):
+def constituent_table_to_components(table, A='Amplitude [m]', omega='Angular Velocity [rad/s]', phi='Phase shift [rad]'):
+    '''Convert a table of tidal constituents (e.g. the rows of one column returned by
+    `harmonic.harmonic_analysis()`) to the `components` dictionary of `generate_tide()`.
+    Rows with NaN angular velocity are the constant.
+
+    Return:
+    -------
+        components (dict(dict)):
+            see `generate_tide()`, keys are the values of column 'Constituent'
+            (if present) or the row numbers
+        H0 (float):
+            sum of the constants
+    '''
+    if 'Column' in table.columns and table['Column'].nunique() > 1:
+        raise ValueError('Table of constituents has rows of {0} columns, pass the rows of one column'.format(table['Column'].nunique()))
+    names = table['Constituent'].astype(str).values if 'Constituent' in table.columns else [str(i) for i in range(len(table))]
+    is_constant = np.isnan(table[omega].values.astype(float))
+    components = dict()
+    for name, a, w, p in zip(names, table[A].values, table[omega].values, table[phi].values):
+        if not np.isnan(w):
+            components[name] = {'A': a, 'omega': w, 'phi': p}
+    return components, float(table[A].values[is_constant].sum())
+
+
+def generate_tide(t0, dt, tend, components={}, label='GenCurve', equation='tide', W=0., F=1., constituents=None, **kwargs):
     '''Generate tide amplitude signal based on multiple tidal components, for a given
     equation type hardcode below
 
@@ -52,6 +76,13 @@ def generate_tide(t0, dt, tend, components={}, label='GenCurve', equation='tide'
         F (float):
             a factor by which all generated values will be multiplied (before adding `W`)
             (e.g. output = `W` + `F`*generated_signal). Default: 1.
+
+        constituents (pd.DataFrame|None):
+            table of tidal constituents, is used instead of `components`
+            (see `constituent_table_to_components()`), e.g. the rows of one column
+            returned by `harmonic.harmonic_analysis()`. Its constant is added to `W`.
+            Note that the phases refer to the time reference `t0` of the analysis,
+            pass the same `t0` here to continue the analysed signal
         
         **kwargs:
             Additional arguments that are passed to *curve equation*
@@ -65,6 +96,9 @@ def generate_tide(t0, dt, tend, components={}, label='GenCurve', equation='tide'
 
 
     '''
+    if constituents is not None:
+        components, H0 = constituent_table_to_components(constituents)
+        W = W + H0
     if not components:
         return
     # >>> create datetime array
@@ -76,7 +110,7 @@ def generate_tide(t0, dt, tend, components={}, label='GenCurve', equation='tide'
     gen_sig = np.zeros(len(T_sec))
     
     # >>> do curve calculations for each tide component and sum them
-    for name, opts in components.iteritems():
+    for name, opts in components.items():
         if equation == 'tide':
             gen_sig += canalCurve(T_sec, opts['A'], opts['omega'], opts['phi'])
         
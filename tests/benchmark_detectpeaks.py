@@ -0,0 +1,142 @@
+from __future__ import print_function
+import os
+import timeit
+import numpy as np
+import pandas as pd
+
+from lib.functions.detectpeaks import remove_region, detectPeaks, prepare_order, determine_n_values_in_t
+
+"""
+to run this benchmark
+
+    $ cd pygwa
+    $ python -m tests.benchmark_detectpeaks
+
+"""
+
+
+def remove_region_loop(peak_value_array, peak_index_array, order=1):
+    ''' Reference (pure-python loop) implementation of
+    `detectpeaks.remove_region()`. Is kept here only to check the
+    vectorized version against it and to measure the speed-up.
+    '''
+    diffs_v = np.diff(peak_value_array)
+    diffs_i = np.diff(peak_index_array)
+    if 0 not in diffs_v:
+        return peak_value_array, peak_index_array
+
+    indices_to_be_deleted = list()
+    regionIndices = list()
+
+    def close_region(ind2bDel, region):
+        region.pop(int(len(region)/2))
+        ind2bDel += region
+
+    for j, (diff_i, diff_v) in enumerate(zip(diffs_i, diffs_v)):
+        if diff_v == 0 and diff_i <= order:
+            if len(regionIndices) == 0 or regionIndices[-1] != j:
+                regionIndices.append(j)
+            regionIndices.append(j+1)
+        else:
+            if len(regionIndices) > 1:
+                close_region(indices_to_be_deleted, regionIndices)
+                regionIndices = list()
+        if (j == len(diffs_i)-1) and len(regionIndices) > 1:
+            close_region(indices_to_be_deleted, regionIndices)
+    return np.delete(peak_value_array, indices_to_be_deleted), np.delete(peak_index_array, indices_to_be_deleted)
+
+
+def flat_topped_tide(n, dt_minutes=1., resolution=0.01):
+    ''' Semi-diurnal tide (T=12.42h) sampled every `dt_minutes`, quantised
+    to the sensor `resolution` [m] so that every peak becomes a plateau'''
+    t = np.arange(n) * dt_minutes * 60.
+    sig = 1.5*np.cos(2*np.pi/(12.42*3600.)*t) + 0.3*np.cos(2*np.pi/(12.*3600.)*t + 0.5)
+    return np.round(sig/resolution)*resolution
+
+
+def benchmark_remove_region(lengths=(10**4, 10**5, 10**6, 5*10**6), order=5, repeat=3):
+    ''' Compare the vectorized `remove_region()` with the loop version on
+    the candidate peaks of quantised tides of different length'''
+    print('{0:>10s} {1:>10s} {2:>12s} {3:>12s} {4:>9s}'.format('N', 'n_peaks', 'loop [s]', 'numpy [s]', 'speed-up'))
+    for n in lengths:
+        sig = flat_topped_tide(n)
+        # candidate peaks as they come from `scipy.signal.argrelextrema(..., np.greater_equal)`
+        ind = np.flatnonzero(np.r_[True, sig[1:] >= sig[:-1]] & np.r_[sig[:-1] >= sig[1:], True])
+        val = sig[ind]
+
+        expected = remove_region_loop(val, ind, order=order)
+        result = remove_region(val, ind, order=order)
+        if not (np.array_equal(expected[0], result[0]) and np.array_equal(expected[1], result[1])):
+            raise AssertionError('Vectorized `remove_region()` differs from the loop version at N={0}'.format(n))
+
+        t_loop = min(timeit.repeat(lambda: remove_region_loop(val, ind, order=order), number=1, repeat=repeat))
+        t_np = min(timeit.repeat(lambda: remove_region(val, ind, order=order), number=1, repeat=repeat))
+        print('{0:>10d} {1:>10d} {2:>12.5f} {3:>12.5f} {4:>8.1f}x'.format(n, ind.size, t_loop, t_np, t_loop/t_np))
+
+
+BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# (file, sheet, datetime column, signal columns)
+EXAMPLE_DATASETS = [
+    ('examples/data/test_data.xlsx', 'data', 'Datetime', ['GW_1', 'GW_2', 'GW_3', 'GW_4', 'River']),
+    ('examples/data/test_data_river1min.xlsx', 'Sheet1', 'Datetime', ['River']),
+    ('tests/validation/fft/validation_fft.xlsx', 0, 'Datetime', ['River']),
+    ('tests/validation/serfes1991/validation_serfes.xlsx', 'data', 'Datetime', ['Krueckau']),
+]
+
+
+def add_spikes(values, n_per_period, order, amplitude=0.5, seed=0):
+    ''' Copy of `values` with single-value sensor spikes of +-`amplitude`
+    times the signal range at random positions'''
+    rng = np.random.RandomState(seed)
+    spiked = values.copy()
+    n = max(1, int(values.size / (2.*order) * n_per_period))
+    pos = rng.randint(0, values.size, n)
+    spiked[pos] += rng.choice([-1., 1.], n) * amplitude * (np.nanmax(values) - np.nanmin(values))
+    return spiked
+
+
+def count_false_peaks(detected, reference, tolerance):
+    ''' Number of `detected` peaks with no `reference` peak within +-`tolerance`
+    entries, and number of `reference` peaks that have not been detected'''
+    def unmatched(a, b):
+        if b.size == 0:
+            return a.size
+        i = np.clip(np.searchsorted(b, a), 1, b.size-1) if b.size > 1 else np.zeros(a.size, dtype=int)
+        dist = np.minimum(np.abs(a - b[i-1 if b.size > 1 else i]), np.abs(a - b[i]))
+        return int(np.count_nonzero(dist > tolerance))
+    return unmatched(detected, reference), unmatched(reference, detected)
+
+
+def benchmark_engines(T=12.42, hMargin=1.5, width_hours=1., spikes_per_period=0.5, repeat=3):
+    ''' Compare the peak detection engines `argrelextrema` and `find_peaks` of
+    `detectPeaks()` on the example datasets. The peaks of the original signal
+    (engine `argrelextrema`) are the reference, the false-peak rate is measured
+    after adding single-value spikes to the signal'''
+    print('{0:>14s} {1:>8s} {2:>7s} {3:>14s} {4:>10s} {5:>12s} {6:>8s}'.format('signal', 'N', 'n_ref', 'engine', 'time [s]', 'false/missed', 'clean'))
+    print('(false/missed - with respect to the reference peaks; `clean` - on the original signal)')
+    for fname, sheet, datetime, cols in EXAMPLE_DATASETS:
+        data = pd.read_excel(os.path.join(BASEDIR, fname), sheet_name=sheet)
+        date = data[datetime].values
+        order = prepare_order(T, hMargin, date)
+        width = determine_n_values_in_t(date, np.timedelta64(int(width_hours*3600), 's'))[1]
+        tolerance = int(np.ceil(determine_n_values_in_t(date, np.timedelta64(int(hMargin*3600), 's'))[1]))
+        for col in cols:
+            values = data[col].values.astype(float)
+            reference = detectPeaks(values, order=order, split=True)[1]
+            spiked = add_spikes(values, spikes_per_period, order)
+            for engine, kwargs in (('argrelextrema', {}), ('find_peaks', {'width': width})):
+                clean = detectPeaks(values, order=order, split=True, engine=engine, **kwargs)[1]
+                result = detectPeaks(spiked, order=order, split=True, engine=engine, **kwargs)[1]
+                false = [count_false_peaks(result[i], reference[i], tolerance) for i in (0, 1)]
+                diff = [count_false_peaks(clean[i], reference[i], tolerance) for i in (0, 1)]
+                t = min(timeit.repeat(lambda: detectPeaks(values, order=order, split=True, engine=engine, **kwargs), number=1, repeat=repeat))
+                print('{0:>14s} {1:>8d} {2:>7d} {3:>14s} {4:>10.5f} {5:>12s} {6:>8s}'.format(
+                    col, values.size, reference[0].size+reference[1].size, engine, t,
+                    '{0}/{1}'.format(false[0][0]+false[1][0], false[0][1]+false[1][1]),
+                    '{0}/{1}'.format(diff[0][0]+diff[1][0], diff[0][1]+diff[1][1])))
+
+
+if __name__ == '__main__':
+    benchmark_remove_region()
+    benchmark_engines()
@@ -0,0 +1,70 @@
+from __future__ import print_function
+import timeit
+import numpy as np
+import pandas as pd
+
+from lib.functions.harmonic import harmonic_analysis, constituent_omega
+
+"""
+to run this benchmark
+
+    $ cd pygwa
+    $ python -m tests.benchmark_harmonic
+
+"""
+
+CONSTITUENTS = ['M2', 'S2', 'K1', 'O1']
+AMPLITUDES = [1.2, 0.4, 0.2, 0.15]
+
+
+def irregular_tides(n, n_columns, days=60., nan_fraction=0.001, seed=0):
+    ''' `n_columns` tides with known constituents at `n` random timestamps
+    within `days`, some columns with NaN values'''
+    rng = np.random.RandomState(seed)
+    t = np.sort(rng.uniform(0, days*86400., n))
+    omega = constituent_omega(CONSTITUENTS)
+    data = pd.DataFrame({'Datetime': np.datetime64('2015-01-01', 'ns') + (t*1e9).astype('timedelta64[ns]')})
+    for j in range(n_columns):
+        y = 0.5 + sum(A*np.cos(w*t + 0.1*j) for A, w in zip(AMPLITUDES, omega)) + 0.05*rng.randn(n)
+        if j % 3 == 0:
+            y[rng.randint(0, n, int(n*nan_fraction))] = np.nan
+        data['w{0}'.format(j)] = y
+    return data
+
+
+def interp_fft_analysis(data, columns, dt=60.):
+    ''' Baseline: interpolate every column onto a regular grid, FFT, and take
+    the amplitude of the bin closest to every constituent'''
+    t = (data['Datetime'].values - data['Datetime'].values[0])/np.timedelta64(1, 's')
+    grid = np.arange(0., t[-1], dt)
+    freqs = np.fft.rfftfreq(grid.size, d=dt)
+    bins = np.searchsorted(freqs, constituent_omega(CONSTITUENTS)/(2*np.pi))
+    amplitudes = dict()
+    for col in columns:
+        v = data[col].values
+        valid = ~np.isnan(v)
+        spectrum = np.fft.rfft(np.interp(grid, t[valid], v[valid]))
+        amplitudes[col] = np.abs(spectrum[bins])/grid.size*2.
+    return amplitudes
+
+
+def benchmark_harmonic_analysis(lengths=(10**4, 10**5, 10**6), n_columns=20, repeat=3):
+    ''' Least-squares harmonic analysis vs. interpolation + FFT on irregular
+    samples. `error` - maximal error of the constituent amplitudes'''
+    print('{0:>10s} {1:>8s} {2:>12s} {3:>12s} {4:>12s} {5:>12s}'.format('N', 'columns', 'lsq [s]', 'interp+fft', 'lsq error', 'fft error'))
+    for n in lengths:
+        data = irregular_tides(n, n_columns)
+        columns = [c for c in data.columns if c != 'Datetime']
+        table = harmonic_analysis(data, columns, date_name='Datetime', constituents=CONSTITUENTS)
+        amp = table.loc[table['Constituent'] != 'Z0', 'Amplitude [m]'].values.reshape(len(columns), -1)
+        err_lsq = np.abs(amp - AMPLITUDES).max()
+        fft = interp_fft_analysis(data, columns)
+        err_fft = max(np.abs(fft[col] - AMPLITUDES).max() for col in columns)
+
+        t_lsq = min(timeit.repeat(lambda: harmonic_analysis(data, columns, date_name='Datetime', constituents=CONSTITUENTS), number=1, repeat=repeat))
+        t_fft = min(timeit.repeat(lambda: interp_fft_analysis(data, columns), number=1, repeat=repeat))
+        print('{0:>10d} {1:>8d} {2:>12.5f} {3:>12.5f} {4:>12.5f} {5:>12.5f}'.format(n, len(columns), t_lsq, t_fft, err_lsq, err_fft))
+
+
+if __name__ == '__main__':
+    benchmark_harmonic_analysis()
@@ -0,0 +1,390 @@
+from __future__ import print_function
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions import detectpeaks
+from lib.functions.detectpeaks import (detectPeaks, detectPeaks_ts, detectPeaks_chunked, full_peak_detection_routine,
+    multicolumn_peak_detection_routine, clear_raw_peak_table_cache, find_index_of_closest_time, find_indices_of_closest_times, match_peaks,
+    create_raw_peak_table, convert_peaksraw_to_peaks, find_peak_warning_pairs, detect_peak_warnings, PEAK_WARNING_DTYPE)
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_detectpeaks -v
+
+"""
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation')
+
+# (directory, file, sheet, datetime column, signal columns, detectPeaks_ts() kwargs)
+# `baseline_detectPeaks_ts.csv` in the directory holds the output of `detectPeaks_ts()`
+# for all signal columns, written before the min/max pairing and the period check were vectorized
+DATASETS = [
+    ('time_lag_+_tidal_efficiency', 'val_tlag.xlsx', 0, 'Datetime',
+        ['Origin', 'Shifted 10 min', 'Shifted 25 min (*0.5)'], {'T': 1.164, 'hMargin': 0.2, 'order': 10}),
+    ('fft', 'validation_fft.xlsx', 0, 'Datetime',
+        ['River'], {'T': 12.42, 'hMargin': 1.5, 'order': 20}),
+    ('serfes1991', 'validation_serfes.xlsx', 'data', 'Datetime',
+        ['Krueckau'], {'T': 12.42, 'hMargin': 1.5, 'order': 30}),
+]
+
+
+def read_baseline_peaks(directory):
+    peaks = pd.read_csv(os.path.join(VALIDATION_DIR, directory, 'baseline_detectPeaks_ts.csv'), index_col=0, float_precision='round_trip')
+    peaks.index.name = None
+    for c in ('time_min', 'time_max'):
+        peaks[c] = pd.to_datetime(peaks[c]).values.astype('datetime64[ns]')
+    peaks['time_diff'] = pd.to_timedelta(peaks['time_diff']).values.astype('timedelta64[ns]')
+    return peaks
+
+
+class DetectPeaksTsTest(unittest.TestCase):
+    '''Compare `detectPeaks_ts()` with the stored baseline output on the validation data'''
+
+    def test_01_validation_datasets(self):
+        for directory, fname, sheet, datetime, cols, kwargs in DATASETS:
+            data = pd.read_excel(os.path.join(VALIDATION_DIR, directory, fname), sheet_name=sheet)
+            baseline = read_baseline_peaks(directory)
+            for col in cols:
+                expected = baseline[baseline['name'] == col]
+                result = detectPeaks_ts(data, col, datetime=datetime, **kwargs)
+                self.assertGreater(len(result), 0, msg='{0}: no peaks in <{1}>'.format(fname, col))
+                self.assertEqual(list(result.columns), list(expected.columns))
+                self.assertEqual(list(result.index), list(expected.index))
+                for c in expected.columns:
+                    msg = '{0}: column <{1}> differs for signal <{2}>'.format(fname, c, col)
+                    if c in ('time_min', 'time_max', 'time_diff', 'name', 'check'):
+                        self.assertTrue((result[c].values == expected[c].values).all(), msg=msg)
+                    else:
+                        np.testing.assert_array_equal(result[c].values.astype(float), expected[c].values.astype(float), err_msg=msg)
+
+    def test_02_dummy_rows(self):
+        ''' Dummy peaks are kept with index -999, NaT time and NaN value'''
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'time_lag_+_tidal_efficiency/val_tlag.xlsx'))
+        kwargs = {'T': 1.164, 'datetime': 'Datetime', 'hMargin': 0.2, 'order': 10}
+        kept = detectPeaks_ts(data, 'Origin', drop_dummy_rows=False, **kwargs)
+        dropped = detectPeaks_ts(data, 'Origin', **kwargs)
+        is_dummy = (kept['ind_min'] == -999) | (kept['ind_max'] == -999)
+        self.assertGreater(is_dummy.sum(), 0)
+        self.assertEqual(len(kept) - len(dropped), is_dummy.sum())
+        self.assertFalse(kept.loc[is_dummy, 'check'].any())
+        self.assertTrue(pd.isnull(kept.loc[is_dummy, 'time_diff']).all())
+
+
+class RawPeakTableCacheTest(unittest.TestCase):
+    '''Cached raw peak tables must not be affected by changes of the returned tables'''
+
+    def test_01_cache_hit_after_caller_modified_output(self):
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'fft/validation_fft.xlsx'))
+        kwargs = {'col': 'River', 'date_col': 'Datetime', 'T': 12.42, 'hMargin': 1.5, 'order': 20, 'split': True}
+        clear_raw_peak_table_cache()
+        cold = full_peak_detection_routine(data, **kwargs)
+        expected = cold[1].copy()
+
+        # the caller modifies the returned raw table in place
+        cold[1]['extra'] = 1
+        cold[1].loc[cold[1].index[0], 'value'] = -999.
+        cold[1].sort_values('value', inplace=True)
+
+        for _ in range(2):
+            hit = full_peak_detection_routine(data, **kwargs)
+            pd.testing.assert_frame_equal(hit[1], expected)
+            pd.testing.assert_frame_equal(hit[2], cold[2])
+            hit[1].loc[hit[1].index[0], 'value'] = -999.
+        clear_raw_peak_table_cache()
+
+
+def odd_blocks(values, order):
+    ''' Split `values` into blocks of odd sizes, some of them shorter than `2*order`'''
+    sizes = [1, 2*order-1, 7, 2*order+3, 97, order, 331]
+    BLOCKS, i, k = list(), 0, 0
+    while i < len(values):
+        BLOCKS.append(values[i:i+sizes[k % len(sizes)]])
+        i += sizes[k % len(sizes)]
+        k += 1
+    return BLOCKS
+
+
+class ChunkedDetectPeaksTest(unittest.TestCase):
+    '''Chunked detection must equal `detectPeaks(..., split=True)`: no duplicates or misses at block boundaries'''
+
+    def assertEqualPeaks(self, result, expected, msg):
+        for i in (0, 1):  # values, indices
+            for j in (0, 1):  # MIN, MAX
+                np.testing.assert_array_equal(result[i][j], expected[i][j], err_msg=msg)
+
+    def test_01_odd_sized_blocks(self):
+        for directory, fname, sheet, datetime, cols, kwargs in DATASETS[1:]:
+            data = pd.read_excel(os.path.join(VALIDATION_DIR, directory, fname), sheet_name=sheet)
+            values = data[cols[0]].values
+            for order in (3, kwargs['order']):
+                for removeRegions in (True, False):
+                    msg = '{0}: order={1}, removeRegions={2}'.format(fname, order, removeRegions)
+                    expected = detectPeaks(values, order=order, split=True, removeRegions=removeRegions)
+                    result = detectPeaks_chunked(iter(odd_blocks(values, order)), order=order, removeRegions=removeRegions)
+                    self.assertGreater(expected[1][0].size, 0, msg=msg)
+                    self.assertEqualPeaks(result, expected, msg)
+
+    def test_02_dataframe_chunks(self):
+        ''' blocks as produced by `pd.read_csv(..., chunksize=...)`'''
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'serfes1991/validation_serfes.xlsx'), sheet_name='data')
+        expected = detectPeaks(data['Krueckau'].values, order=30, split=True)
+        for chunksize in (45, 1000, 10000):
+            chunks = (data.iloc[i:i+chunksize] for i in range(0, len(data), chunksize))
+            result = detectPeaks_chunked(chunks, order=30, col='Krueckau')
+            self.assertEqualPeaks(result, expected, 'chunksize={0}'.format(chunksize))
+
+    def test_03_wrap_mode_raises(self):
+        values = np.sin(np.arange(1000)/10.)
+        with self.assertRaises(NotImplementedError):
+            detectPeaks_chunked(iter(odd_blocks(values, 5)), order=5, mode='wrap')
+
+
+SIDES = ['both', 'left (<t)', 'left (<=t)', 'right (>t)', 'right (>=t)']
+
+
+def find_indices_one_by_one(t, ts, **kwargs):
+    ''' Match every timestamp with `find_index_of_closest_time()`. Returns
+    rows, mask of the matches and mask of the timestamps past the last entry
+    of `ts`, where `find_index_of_closest_time()` raises IndexError'''
+    df = pd.DataFrame({'time': ts})
+    rows, valid, failed = np.zeros(len(t), dtype=np.int64), np.zeros(len(t), dtype=bool), np.zeros(len(t), dtype=bool)
+    for k, tk in enumerate(t):
+        try:
+            i = find_index_of_closest_time(tk, df, 'time', **kwargs)[0]
+        except IndexError:
+            failed[k] = True
+            continue
+        if i is not None:
+            rows[k], valid[k] = i, True
+    return rows, valid, failed
+
+
+class MatchPeaksTest(unittest.TestCase):
+    '''`find_indices_of_closest_times()` and `match_peaks()` against the matching one by one'''
+
+    def setUp(self):
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'serfes1991/validation_serfes.xlsx'), sheet_name='data')
+        self.peaks = detectPeaks_ts(data, 'Krueckau', datetime='Datetime', T=12.42, hMargin=1.5, order=30)
+        # groundwater: every 3rd cycle is missing, shifted by 37 minutes
+        self.peaks_gw = self.peaks.iloc[::3].copy()
+        for c in ('time_min', 'time_max'):
+            self.peaks_gw[c] += pd.Timedelta(minutes=37)
+        self.peaks_gw['name'] = 'GW'
+        self.peaks_gw.index = np.arange(len(self.peaks_gw))
+
+    def test_01_sides_and_window(self):
+        ts = self.peaks_gw['time_min'].values
+        # exact hits, close to the entries, before the first and after the last entry, in between
+        hour = np.timedelta64(1, 'h')
+        t = np.sort(np.concatenate((ts[::2], ts[1::2] - hour, ts[1::2] + hour, self.peaks['time_min'].values,
+                                    ts[:1] - 24*hour, ts[-1:] + 24*hour)))
+        for side in SIDES:
+            for window in (None, 6.):
+                msg = 'side={0}, window={1}'.format(side, window)
+                kwargs = {'side': side, 'window': window, 'use_window': window is not None}
+                rows, valid = find_indices_of_closest_times(t, ts, **kwargs)
+                rows_ref, valid_ref, failed = find_indices_one_by_one(t, ts, **kwargs)
+                np.testing.assert_array_equal(valid[~failed], valid_ref[~failed], err_msg=msg)
+                np.testing.assert_array_equal(rows[valid & ~failed], rows_ref[valid_ref & ~failed], err_msg=msg)
+                # past the last entry: no match on the right side, the last entry on the left side
+                self.assertEqual(failed[-1], side != 'both', msg=msg)
+                if side.startswith('right'):
+                    self.assertFalse(valid[failed].any(), msg=msg)
+                elif window is None:
+                    self.assertTrue((rows[failed] == len(ts)-1).all() and valid[failed].all(), msg=msg)
+                self.assertTrue(valid.any(), msg=msg)
+                if window is not None:
+                    self.assertFalse(valid.all(), msg=msg)
+
+    def test_02_md_columns(self):
+        matched = match_peaks(self.peaks, self.peaks_gw, match_colName='time_min', side='right (>=t)', window=1., use_window=True)
+        rows, valid, _ = find_indices_one_by_one(self.peaks['time_min'].values, self.peaks_gw['time_min'].values, side='right (>=t)', window=1., use_window=True)
+        self.assertEqual(valid.sum(), len(self.peaks_gw))
+        self.assertEqual(list(matched.index), list(self.peaks.index))
+        md = matched[valid]
+        gw = self.peaks_gw.iloc[rows[valid]]
+        for c in ('N', 'ind_min', 'ind_max', 'val_min', 'val_max'):
+            np.testing.assert_array_equal(md['md_'+c].values, gw[c].values.astype(float), err_msg=c)
+        for c in ('time_min', 'time_max'):
+            np.testing.assert_array_equal(md['md_'+c].values, gw[c].values, err_msg=c)
+        # `md_ind_max` is the index of the MAX peak (it was filled from `ind_min`)
+        self.assertTrue((md['md_ind_max'] > md['md_ind_min']).all())
+        np.testing.assert_allclose(md['md_tidal_range'].values, np.abs(gw['val_max'].values - gw['val_min'].values))
+        self.assertTrue((matched['md_name'] == 'GW').all())
+        for c in ('md_N', 'md_ind_min', 'md_ind_max', 'md_val_min', 'md_val_max'):
+            self.assertTrue(matched.loc[~valid, c].isnull().all(), msg=c)
+        self.assertTrue(pd.isnull(matched.loc[~valid, 'md_time_min']).all())
+
+
+class MulticolumnPeakDetectionTest(unittest.TestCase):
+    '''`multicolumn_peak_detection_routine()` against `full_peak_detection_routine()` column by column'''
+    COLS = ['Origin', 'Shifted 10 min', 'Shifted 25 min (*0.5)']
+    KWARGS = {'T': 1.164, 'hMargin': 0.2, 'order': 10, 'split': True}
+
+    def setUp(self):
+        self.data = pd.read_excel(os.path.join(VALIDATION_DIR, 'time_lag_+_tidal_efficiency/val_tlag.xlsx'))
+        self.IDs2mask = {'Shifted 10 min': [2, 5]}
+        clear_raw_peak_table_cache()
+
+    def tearDown(self):
+        clear_raw_peak_table_cache()
+
+    def run_multicolumn(self, processes):
+        return multicolumn_peak_detection_routine(self.data, cols=self.COLS, date_col='Datetime', IDs2mask=self.IDs2mask,
+                                                  processes=processes, **self.KWARGS)
+
+    def assertEqualResults(self, result, expected):
+        self.assertEqual(sorted(result[0].keys()), sorted(expected[0].keys()))
+        for col in expected[0]:
+            self.assertEqual(result[0][col]['raw_nmin'], expected[0][col]['raw_nmin'])
+            self.assertEqual(result[0][col]['raw_nmax'], expected[0][col]['raw_nmax'])
+            self.assertEqual(result[0][col]['warnings'], expected[0][col]['warnings'])
+        pd.testing.assert_frame_equal(result[1], expected[1])
+        pd.testing.assert_frame_equal(result[2], expected[2])
+
+    def test_01_serial_and_parallel(self):
+        serial = self.run_multicolumn(processes=1)
+        clear_raw_peak_table_cache()
+        parallel = self.run_multicolumn(processes=2)
+        self.assertEqualResults(parallel, serial)
+        self.assertEqual(list(serial[1]['name'].unique()), self.COLS)
+        self.assertEqual(list(serial[2]['name'].unique()), self.COLS)
+
+    def test_02_equals_full_peak_detection_routine(self):
+        EXTRA, peaks_raw, peaks = self.run_multicolumn(processes=1)
+        for col in self.COLS:
+            clear_raw_peak_table_cache()
+            extra, raw_col, peaks_col = full_peak_detection_routine(self.data, col=col, date_col='Datetime',
+                                                                    IDs2mask=self.IDs2mask.get(col, []), **self.KWARGS)
+            self.assertEqual(EXTRA[col]['warnings'], extra['warnings'], msg=col)
+            self.assertEqual((EXTRA[col]['raw_nmin'], EXTRA[col]['raw_nmax']), (extra['raw_nmin'], extra['raw_nmax']), msg=col)
+            rows = peaks_raw[peaks_raw['name'] == col].drop('name', axis=1).reset_index(drop=True)
+            pd.testing.assert_frame_equal(rows, raw_col.reset_index(drop=True), obj=col)
+            rows = peaks[peaks['name'] == col].reset_index(drop=True)
+            pd.testing.assert_frame_equal(rows, peaks_col.reset_index(drop=True), obj=col)
+        # the masked peaks are missing in the cycles of the masked column only
+        self.assertLess(len(peaks[peaks['name'] == 'Shifted 10 min']), len(peaks[peaks['name'] == 'Origin']))
+
+    def test_03_second_call_from_cache(self):
+        cold = self.run_multicolumn(processes=1)
+        detect = detectpeaks.detectPeaks
+
+        def fail(*args, **kwargs):
+            raise AssertionError('peaks detected again instead of taken from the cache')
+        detectpeaks.detectPeaks = fail
+        try:
+            hit = self.run_multicolumn(processes=1)
+            # the cache is shared with `full_peak_detection_routine()`
+            full_peak_detection_routine(self.data, col='Origin', date_col='Datetime', **self.KWARGS)
+        finally:
+            detectpeaks.detectPeaks = detect
+        self.assertEqualResults(hit, cold)
+
+
+def warning_cases():
+    ''' (case, datetime, values, order, valid_range) of the signals in `baseline_peak_warnings.csv`,
+    which holds the pairs returned by the per-pair loop of `detect_peak_warnings()` before the vectorization'''
+    data = pd.read_excel(os.path.join(VALIDATION_DIR, 'serfes1991/validation_serfes.xlsx'), sheet_name='data')
+    noisy = data['Krueckau'].values + np.random.RandomState(0).normal(0, 0.1, len(data))
+    fft = pd.read_excel(os.path.join(VALIDATION_DIR, 'fft/validation_fft.xlsx'))
+    h = 3600
+    valid_range = {'MIN': [np.timedelta64(11*h, 's'), np.timedelta64(14*h, 's')],
+                   'MAX': [np.timedelta64(11*h, 's'), np.timedelta64(14*h, 's')],
+                   'ALL': [np.timedelta64(int(5.5*h), 's'), np.timedelta64(7*h, 's')]}
+    return [('krueckau_noisy_order5', data['Datetime'].values, noisy, 5, None),
+            ('krueckau_noisy_order15', data['Datetime'].values, noisy, 15, valid_range),
+            ('fft_order20', fft['Datetime'].values, fft['River'].values, 20, valid_range)]
+
+
+class PeakWarningsTest(unittest.TestCase):
+    '''Structured and legacy warning pairs against the stored baseline pairs'''
+
+    def test_01_validation_pairs(self):
+        baseline = pd.read_csv(os.path.join(VALIDATION_DIR, 'baseline_peak_warnings.csv'))
+        for case, date, values, order, valid_range in warning_cases():
+            i_min, i_max = detectPeaks(values, order=order, split=True)[1]
+            peaks_raw = create_raw_peak_table(i_min, i_max, date, values)
+            pairs = find_peak_warning_pairs(peaks_raw, valid_range=valid_range)
+            legacy = detect_peak_warnings(peaks_raw, valid_range=valid_range)
+            self.assertEqual(sorted(pairs.keys()), ['ALL', 'MAX', 'MIN'])
+            self.assertEqual(sorted(legacy.keys()), ['ALL', 'MAX', 'MIN'])
+            for which in ('ALL', 'MIN', 'MAX'):
+                msg = '{0}: {1}'.format(case, which)
+                expected = baseline[(baseline['case'] == case) & (baseline['which'] == which)][['start_idx', 'end_idx']].values.tolist()
+                self.assertEqual(pairs[which].dtype, PEAK_WARNING_DTYPE, msg=msg)
+                self.assertEqual(np.column_stack((pairs[which]['start_idx'], pairs[which]['end_idx'])).tolist(), expected, msg=msg)
+                self.assertEqual(legacy[which], expected, msg=msg)
+                self.assertTrue(all(type(i) is int for pair in legacy[which] for i in pair), msg=msg)
+                dt = date[pairs[which]['end_idx']] - date[pairs[which]['start_idx']]
+                np.testing.assert_array_equal(pairs[which]['dt'], dt.astype('timedelta64[ns]'), err_msg=msg)
+        self.assertEqual(set(baseline['case']), set(case[0] for case in warning_cases()))
+
+
+class RefinePeaksTest(unittest.TestCase):
+    '''Sub-sample refinement on a sampled sinusoid with known peaks'''
+    T = 12.42*3600.  # [s]
+    dt = 900.        # [s] 15-minute timestep
+
+    def setUp(self):
+        # the signal starts 0.95 after its maximum: the first peak lies at the edge of the array
+        self.theta0 = np.arccos(0.95)
+        t = np.arange(0, 30*86400, self.dt)
+        self.y = np.cos(2*np.pi*t/self.T + self.theta0)
+        self.date = np.datetime64('2015-01-01', 'ns') + (t*1e9).astype('timedelta64[ns]')
+        self.i_min, self.i_max = detectPeaks(self.y, order=20, split=True)[1]
+
+    def seconds(self, date):
+        return (np.asarray(date) - self.date[0])/np.timedelta64(1, 's')
+
+    def true_peak_time(self, seconds):
+        ''' time [s] of the true peak closest to `seconds`'''
+        omega = 2*np.pi/self.T
+        k = np.round((omega*seconds + self.theta0)/np.pi)
+        return (k*np.pi - self.theta0)/omega
+
+    def test_01_refined_time_and_value(self):
+        for method in ('parabolic', 'cubic'):
+            raw = create_raw_peak_table(self.i_min, self.i_max, self.date, self.y, refine=method)
+            inner = ((raw['Index in data-array'] > 1) & (raw['Index in data-array'] < self.y.size-2)).values
+            self.assertGreater(inner.sum(), 50)
+            t_raw = self.seconds(raw['Datetime'].values)
+            t_ref = self.seconds(raw['Datetime refined'].values)
+            err_raw = np.abs(t_raw - self.true_peak_time(t_raw))[inner]
+            err_ref = np.abs(t_ref - self.true_peak_time(t_ref))[inner]
+            self.assertGreater(err_raw.max(), self.dt/4, msg=method)
+            self.assertLess(err_ref.max(), self.dt/20, msg=method)
+            np.testing.assert_allclose(np.abs(raw['value refined'].values[inner]), 1., atol=1e-4, err_msg=method)
+            self.assertGreater(np.abs(np.abs(raw['value'].values[inner]) - 1.).max(), 1e-3, msg=method)
+            np.testing.assert_allclose(raw['Index refined'].values, raw['Index in data-array'].values + (t_ref - t_raw)/self.dt, atol=1e-6)
+
+    def test_02_edge_peaks_stay_on_the_grid(self):
+        for method in ('parabolic', 'cubic'):
+            raw = create_raw_peak_table(self.i_min, self.i_max, self.date, self.y, refine=method)
+            edge = raw['Index in data-array'].isin([0, self.y.size-1]).values
+            self.assertEqual(raw['Index in data-array'].values[0], 0)
+            self.assertTrue(edge[-1])
+            self.assertAlmostEqual(raw['value refined'].values[0], 0.95, places=12)  # the true maximum is 1
+            np.testing.assert_array_equal(raw['value refined'].values[edge], raw['value'].values[edge])
+            np.testing.assert_array_equal(raw['Datetime refined'].values[edge], raw['Datetime'].values[edge])
+
+    def test_03_refined_columns_of_peaks_and_matched_peaks(self):
+        raw = create_raw_peak_table(self.i_min, self.i_max, self.date, self.y, refine='parabolic')
+        peaks = convert_peaksraw_to_peaks(raw, col='river')
+        by_index = raw.set_index('Index in data-array')
+        for which in ('min', 'max'):
+            np.testing.assert_array_equal(peaks['time_{0}_refined'.format(which)].values, by_index.loc[peaks['ind_'+which], 'Datetime refined'].values)
+            np.testing.assert_array_equal(peaks['val_{0}_refined'.format(which)].values, by_index.loc[peaks['ind_'+which], 'value refined'].values)
+        peaks_gw = peaks.copy()
+        peaks_gw['name'] = 'GW'
+        matched = match_peaks(peaks, peaks_gw, side='both')
+        for c in ('time_min_refined', 'time_max_refined', 'val_min_refined', 'val_max_refined'):
+            np.testing.assert_array_equal(matched['md_'+c].values, peaks[c].values, err_msg=c)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+from __future__ import print_function
+import os
+import json
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+
+from lib.functions.fourier import welch_spectrum, batch_fourier_analysis, fourier_analysis, pandas_fourier_analysis, FourierModel
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_fourier -v
+
+"""
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation')
+# tables of `pandas_fourier_analysis()` and values of its fitted function, written before
+# the exec-generated function was replaced by `FourierModel`
+BASELINE_TABLE = os.path.join(VALIDATION_DIR, 'fft', 'baseline_pandas_fourier_analysis.csv')
+BASELINE_FITTED = os.path.join(VALIDATION_DIR, 'fft', 'baseline_fourier_fitted.csv')
+RANGES = {'all': (), 'range': (np.datetime64('2015-01-03'), np.datetime64('2015-01-12T12:00'))}
+
+
+def tide(n, dt=600., seed=0):
+    ''' M2 and S2 tide with noise, sampled every `dt` seconds'''
+    t = np.arange(n)*dt
+    rng = np.random.RandomState(seed)
+    return (0.3 + 1.2*np.cos(2*np.pi/(12.42*3600)*t + 0.3) +
+            0.4*np.cos(2*np.pi/(12*3600)*t) + 0.05*rng.randn(n))
+
+
+class WelchSpectrumTest(unittest.TestCase):
+
+    def test_01_psd_equals_scipy(self):
+        from scipy import signal
+        dt = 600.
+        sig = tide(144*200, dt=dt)
+        for segment_length, overlap in ((144*15, 0.5), (1001, 0.25), (144*30, 0.)):
+            spectrum, n_segments = welch_spectrum(sig, dt, segment_length, overlap=overlap, max_block_size=10**5)
+            noverlap = segment_length - int(round(segment_length*(1.-overlap)))
+            f, P = signal.welch(sig, fs=1./dt, window='hann', nperseg=segment_length, noverlap=noverlap, scaling='density')
+            msg = 'segment_length={0}, overlap={1}'.format(segment_length, overlap)
+            np.testing.assert_allclose(spectrum['Frequency [Hz]'].values, f, err_msg=msg)
+            np.testing.assert_allclose(spectrum['PSD [m**2/Hz]'].values[1:], P[1:], rtol=1e-9, err_msg=msg)
+
+    def test_02_nan_segments_are_skipped(self):
+        sig = tide(144*60)
+        n_all = welch_spectrum(sig, 600., 144*15)[1]
+        sig[100] = np.nan
+        self.assertEqual(welch_spectrum(sig, 600., 144*15)[1], n_all - 1)
+
+
+class BatchFourierAnalysisTest(unittest.TestCase):
+    '''Compare `batch_fourier_analysis()` with `fourier_analysis()` of every column and window'''
+
+    def test_01_equals_fourier_analysis(self):
+        dt = 600.
+        n = 144*90
+        date = np.datetime64('2015-01-01') + (np.arange(n)*dt).astype('timedelta64[s]').astype('timedelta64[ns]')
+        df = pd.DataFrame(dict(('w{0}'.format(i), tide(n, dt=dt, seed=i)*(1 + 0.1*i) - i) for i in range(5)))
+        df['Datetime'] = date
+        df.loc[500, 'w3'] = np.nan
+        columns = ['w{0}'.format(i) for i in range(5)]
+        starts = pd.date_range('2015-01-01', '2015-04-01', freq='MS')
+        windows = [(s.to_datetime64(), (e - pd.Timedelta('1ns')).to_datetime64()) for s, e in zip(starts[:-1], starts[1:])]
+
+        for N in (1, 3):
+            table = batch_fourier_analysis(df, columns, windows, date_name='Datetime', N_MAX_POW=N)
+            n_compared = 0
+            for start, stop in windows:
+                in_window = (date >= start) & (date <= stop)
+                for col in columns:
+                    sig = df[col].values[in_window]
+                    rows = table[(table['Column'] == col) & (table['Window start'] == date[in_window][0])]
+                    if np.isnan(sig).any():
+                        self.assertEqual(len(rows), 0)
+                        continue
+                    f = fourier_analysis(sig, dt, N_MAX_POW=N)[2]
+                    msg = 'N={0}, column <{1}>, window {2}'.format(N, col, start)
+                    np.testing.assert_allclose(rows['Amplitude [m]'].values, np.r_[f.H0, f.A], rtol=1e-9, atol=1e-12, err_msg=msg)
+                    np.testing.assert_allclose(rows['Angular Velocity [rad/s]'].values[1:], f.omega, rtol=1e-12, err_msg=msg)
+                    np.testing.assert_allclose(rows['Phase shift [rad]'].values[1:], f.phi, rtol=1e-9, atol=1e-12, err_msg=msg)
+                    n_compared += 1
+            self.assertEqual(n_compared, len(windows)*len(columns) - 1)
+
+
+class FourierModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dt = 600.
+        self.sig = tide(144*20, dt=self.dt)
+        self.model = fourier_analysis(self.sig, self.dt, N_MAX_POW=4)[2]
+
+    def waves(self, model, t):
+        ''' sum of the waves, one by one'''
+        y = np.full(np.shape(t), model.H0)
+        for a, omega, phi in zip(model.A, model.omega, model.phi):
+            y += a*np.cos(omega*t + phi)
+        return y
+
+    def assertEqualModels(self, result, expected):
+        self.assertIsInstance(result, FourierModel)
+        self.assertEqual(result.H0, expected.H0)
+        for name in ('A', 'omega', 'phi'):
+            np.testing.assert_array_equal(getattr(result, name), getattr(expected, name), err_msg=name)
+
+    def test_01_dict(self):
+        self.assertEqual(len(self.model), 4)
+        d = json.loads(json.dumps(self.model.to_dict()))  # plain python types
+        self.assertEqual(sorted(d.keys()), ['A', 'H0', 'omega', 'phi'])
+        self.assertEqualModels(FourierModel.from_dict(d), self.model)
+        with self.assertRaises(ValueError):
+            FourierModel(H0=1., A=[1., 2.], omega=[1.], phi=[0.])
+
+    def test_02_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(self.model, protocol))
+            self.assertEqualModels(restored, self.model)
+            t = np.arange(1000)*self.dt
+            np.testing.assert_array_equal(restored(t), self.model(t))
+
+    def test_03_evaluate_any_length(self):
+        n = self.sig.size
+        for t in (np.arange(n)*self.dt, np.arange(7)*self.dt, np.arange(3*n)*self.dt - 1e5, np.linspace(0, 1e6, 12345)):
+            expected = self.waves(self.model, t)
+            np.testing.assert_allclose(self.model(t), expected, rtol=0, atol=1e-12)
+            # blocks of 1, 2 and 33 timesteps (`max_block_size` is divided by the number of waves)
+            for max_block_size in (1, 8, 133):
+                np.testing.assert_allclose(self.model(t, max_block_size=max_block_size), expected, rtol=0, atol=1e-12)
+        self.assertAlmostEqual(self.model(1234.), self.waves(self.model, np.array([1234.]))[0], places=12)
+        t = np.arange(24).reshape(4, 6)*self.dt
+        np.testing.assert_allclose(self.model(t), self.waves(self.model, t), rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(FourierModel(H0=2.)(np.arange(5.)), np.full(5, 2.))
+
+    def test_04_pandas_fourier_analysis_baseline(self):
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'fft/validation_fft.xlsx'))
+        baseline = pd.read_csv(BASELINE_TABLE, index_col=0, float_precision='round_trip')
+        fitted = pd.read_csv(BASELINE_FITTED, float_precision='round_trip')
+        for (N, case), expected in baseline.groupby(['N_MAX_POW', 'case'], sort=False):
+            msg = 'N_MAX_POW={0}, {1}'.format(N, case)
+            table, f_str, f, fig = pandas_fourier_analysis(data, 'River', date_name='Datetime', ranges=RANGES[case], N_MAX_POW=N)
+            expected = expected.drop(['N_MAX_POW', 'case'], axis=1)
+            expected.index.name = None
+            pd.testing.assert_frame_equal(table[expected.columns], expected, check_exact=False, rtol=1e-12, obj=msg)
+            # the old function string wrote the constant with numpy's 8-digit array repr
+            y = fitted[(fitted['N_MAX_POW'] == N) & (fitted['case'] == case)]['fitted'].values
+            t = np.arange(y.size)*600.
+            np.testing.assert_allclose(f(t), y, rtol=0, atol=1e-7, err_msg=msg)
+            # the string still defines the same function
+            namespace = {'np': np}
+            exec(f_str, namespace)
+            np.testing.assert_allclose(namespace['generated_function'](t), f(t), rtol=0, atol=1e-12, err_msg=msg)
+        self.assertEqual(len(baseline.groupby(['N_MAX_POW', 'case'])), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
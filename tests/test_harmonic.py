@@ -0,0 +1,73 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.harmonic import harmonic_analysis, constituent_omega
+from lib.functions.tide import generate_tide
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_harmonic -v
+
+"""
+
+# constituent: (amplitude [m], phase shift [rad])
+TRUE = {'M2': (1.2, 0.3), 'S2': (0.4, -1.0), 'K1': (0.2, 2.0)}
+
+
+class HarmonicAnalysisTest(unittest.TestCase):
+
+    def test_01_irregular_samples(self):
+        ''' M2, S2, K1 are recovered from irregular samples with gaps'''
+        rng = np.random.RandomState(1)
+        n = 20000
+        t = np.sort(rng.uniform(0, 40*86400., n))
+        omega = constituent_omega(list(TRUE.keys()))
+        data = pd.DataFrame({'Datetime': np.datetime64('2015-01-01', 'ns') + (t*1e9).astype('timedelta64[ns]')})
+        for j, noise in enumerate((0., 0.02, 0.02)):
+            y = 0.5 + j + sum(A*np.cos(w*t + phi) for (A, phi), w in zip(TRUE.values(), omega)) + noise*rng.randn(n)
+            if j == 1:
+                y[rng.randint(0, n, 200)] = np.nan   # few missing values
+            if j == 2:
+                y[(t > 10*86400.) & (t < 15*86400.)] = np.nan  # long gap
+            data['w{0}'.format(j)] = y
+
+        table = harmonic_analysis(data, ['w0', 'w1', 'w2'], date_name='Datetime', constituents=list(TRUE.keys()),
+                                  t0=np.datetime64('2015-01-01'))
+        self.assertEqual(len(table), 3*(1 + len(TRUE)))
+        for j, tol in enumerate((1e-9, 2e-3, 2e-3)):
+            rows = table[table['Column'] == 'w{0}'.format(j)].set_index('Constituent')
+            self.assertAlmostEqual(rows.loc['Z0', 'Amplitude [m]'], 0.5 + j, delta=tol)
+            for name, (A, phi) in TRUE.items():
+                msg = 'column w{0}, constituent {1}'.format(j, name)
+                self.assertAlmostEqual(rows.loc[name, 'Amplitude [m]'], A, delta=tol, msg=msg)
+                self.assertAlmostEqual(rows.loc[name, 'Phase shift [rad]'], phi, delta=tol/A*2, msg=msg)
+
+    def test_02_generate_tide_from_table(self):
+        ''' the table of one column continues the analysed signal in `generate_tide()`'''
+        t0 = np.datetime64('2015-01-01', 'ns')
+        t = np.arange(0, 30*86400., 1800.)
+        omega = constituent_omega(list(TRUE.keys()))
+
+        def signal(t):
+            return 0.5 + sum(A*np.cos(w*t + phi) for (A, phi), w in zip(TRUE.values(), omega))
+        data = pd.DataFrame({'Datetime': t0 + (t*1e9).astype('timedelta64[ns]'), 'w0': signal(t), 'w1': 2*signal(t)})
+        table = harmonic_analysis(data, ['w0', 'w1'], date_name='Datetime', constituents=list(TRUE.keys()), t0=t0)
+
+        dt = np.timedelta64(600, 's')
+        tend = t0 + np.timedelta64(60, 'D')  # twice as long as the record
+        generated = generate_tide(t0, dt, tend, constituents=table[table['Column'] == 'w0'], label='w0', W=0.1)
+        t_gen = (generated['Datetime'].values - t0)/np.timedelta64(1, 's')
+        self.assertEqual(t_gen[-1], 60*86400.)
+        np.testing.assert_allclose(generated['w0'].values, signal(t_gen) + 0.1, rtol=0, atol=1e-8)
+
+        with self.assertRaises(ValueError):
+            generate_tide(t0, dt, tend, constituents=table)
+
+
+if __name__ == '__main__':
+    unittest.main()
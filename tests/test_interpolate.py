@@ -0,0 +1,87 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.interpolate import createInterpolationRanges, applyInterpolationBasedOnRanges, interpolateColumns
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_interpolate -v
+
+"""
+
+
+def gappy_sine():
+    y = np.sin(np.arange(0, 100, 0.1))
+    for region in (0, 38, slice(40, 60), slice(70, 75), slice(400, 450), 453, 457, 459, 466, slice(800, 825), slice(990, 992)):
+        y[region] = np.nan
+    return y
+
+
+class CreateInterpolationRangesTest(unittest.TestCase):
+
+    def test_01_docstring_examples(self):
+        EXAMPLES = [
+            ([1, 2, 3, np.nan, 5, 4, 3, 2, 1], 2, [[1, 5]]),
+            ([1, 2, 3, np.nan, 5, 4, 3, np.nan, 1], 2, [[1, 5], [5, 8]]),
+            ([np.nan, 5, 6, 7, 8, 7, 6, 5, 4, 3, np.nan, 1, np.nan, -1, np.nan, -1, 0, 1, 2], 3, [[0, 3], [7, 17]]),
+        ]
+        for s, margin, expected in EXAMPLES:
+            df = pd.DataFrame(data=s, columns=['col1'])
+            self.assertEqual(createInterpolationRanges(df, 'col1', interpolateMargin=margin), expected)
+
+    def test_02_edges(self):
+        EXAMPLES = [
+            ([1, 2, 3, np.nan], 2, [[1, 3]]),           # NaN at the end
+            ([np.nan, 1, 2, 3, 4, 5, 6, 7], 2, [[0, 2]]),  # single NaN at the beginning
+            ([1, np.nan, 3, 4, 5, 6, 7, 8, np.nan, 2], 2, [[0, 3], [6, 9]]),
+            ([1, 2, 3], 2, None),
+        ]
+        for s, margin, expected in EXAMPLES:
+            df = pd.DataFrame(data=s, columns=['col1'])
+            self.assertEqual(createInterpolationRanges(df, 'col1', interpolateMargin=margin), expected)
+
+
+class ApplyInterpolationTest(unittest.TestCase):
+
+    def test_01_local_method_equals_whole_column(self):
+        y = gappy_sine()
+        df = pd.DataFrame({'one': y})
+        applyInterpolationBasedOnRanges(df, 'one', createInterpolationRanges(df, 'one', interpolateMargin=100), method='linear')
+        expected = pd.Series(y).interpolate(method='linear').values
+        np.testing.assert_array_equal(df['one_interpolated'].values, expected)
+        np.testing.assert_array_equal(df['one'].values, y)  # input column is not modified
+
+    def test_02_region_wise_method(self):
+        ''' Every NaN is interpolated only with the values of its (first) region'''
+        y = gappy_sine()
+        df = pd.DataFrame({'one': y})
+        ranges = createInterpolationRanges(df, 'one', interpolateMargin=20)
+        kwargs = {'method': 'polynomial', 'order': 3}
+        applyInterpolationBasedOnRanges(df, 'one', ranges, **kwargs)
+        result = df['one_interpolated'].values
+
+        done = ~np.isnan(y)
+        np.testing.assert_array_equal(result[done], y[done])
+        for r0, r1 in ranges:
+            expected = pd.Series(y[r0:r1+1], index=df.index[r0:r1+1]).interpolate(**kwargs).values
+            todo = ~done[r0:r1+1]
+            np.testing.assert_allclose(result[r0:r1+1][todo], expected[todo], rtol=1e-12)
+            done[r0:r1+1] = True
+
+    def test_03_columns_serial_equals_parallel(self):
+        df = pd.DataFrame({'a': gappy_sine(), 'b': gappy_sine()[::-1].copy()})
+        columns = {'a': (100, {'method': 'linear'}), 'b': (20, {'method': 'polynomial', 'order': 3})}
+        serial = interpolateColumns(df, columns)[0]
+        parallel = interpolateColumns(df, columns, processes=2)[0]
+        self.assertEqual(sorted(serial.keys()), ['a', 'b'])
+        for col in columns:
+            np.testing.assert_array_equal(parallel[col], serial[col])
+
+
+if __name__ == '__main__':
+    unittest.main()
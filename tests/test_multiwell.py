@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.multiwell import multiwell_tidal_efficiency_timelag
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_multiwell -v
+
+"""
+
+
+def synthetic_transect(n_wells=4, days=30, D=0.05, T=12.42*3600, seed=0):
+    ''' River tide and wells at distances x0 with the response of Ferris 1951:
+    efficiency E = exp(-a) and timelag a/omega, a = x0*sqrt(pi/(T*D))'''
+    n = days*144
+    x = np.arange(n)*600.
+    rng = np.random.RandomState(seed)
+    data = pd.DataFrame({'Datetime': pd.date_range('2015-01-01', periods=n, freq='10min'),
+                         'River': np.sin(2*np.pi*x/T)})
+    x0, E, tlag = dict(), dict(), dict()
+    for k in range(n_wells):
+        well = 'GW_{0}'.format(k)
+        x0[well] = 5. + 10*k
+        a = x0[well]*np.sqrt(np.pi/T/D)
+        E[well], tlag[well] = np.exp(-a), a/(2*np.pi/T)
+        data[well] = 3 + E[well]*np.sin(2*np.pi*x/T - a) + rng.normal(0, 0.001, n)
+    return data, x0, E, tlag
+
+
+class MultiwellTest(unittest.TestCase):
+
+    def test_01_known_efficiency_and_timelag(self):
+        D = 0.05
+        data, x0, E, tlag = synthetic_transect(D=D)
+        wells = sorted(x0.keys())
+        result = multiwell_tidal_efficiency_timelag(data, 'River', wells, 'Datetime', x0=x0,
+                                                    tlag_range=(0, 600, 10), processes=1)
+        self.assertEqual(list(result['well']), wells)
+        for _, row in result.iterrows():
+            msg = 'well <{0}>'.format(row['well'])
+            for col in ('E1', 'E2', 'E3'):
+                self.assertAlmostEqual(row[col], E[row['well']], delta=0.03*E[row['well']], msg=msg+', '+col)
+            self.assertAlmostEqual(row['tlag'], tlag[row['well']], delta=60., msg=msg)
+            self.assertGreater(row['n_cycles'], 50, msg=msg)
+            self.assertAlmostEqual(row['D_E1'], D, delta=0.1*D, msg=msg)
+            self.assertAlmostEqual(row['D_tlag'], D, delta=0.1*D, msg=msg)
+
+    def test_02_serial_equals_parallel(self):
+        data, x0, E, tlag = synthetic_transect()
+        wells = sorted(x0.keys())
+        for method in ('crosscorrelation', 'erskine1991'):
+            kwargs = {'tlag_method': method, 'tlag_range': (0, 600, 10)}
+            serial = multiwell_tidal_efficiency_timelag(data, 'River', wells, 'Datetime', processes=1, **kwargs)
+            parallel = multiwell_tidal_efficiency_timelag(data, 'River', wells, 'Datetime', processes=2, **kwargs)
+            pd.testing.assert_frame_equal(parallel, serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+from __future__ import print_function
+import os
+import logging
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions import filterSerfes1991
+from lib.functions.filterSerfes1991 import filter_wl_71h_serfes1991, iter_filter_wl_71h_serfes1991, get_number_of_measurements_per_day
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_serfes1991 -v
+
+"""
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation')
+# `*_mean` columns written by `filter_wl_71h_serfes1991()` before the cumulative-sum moving averages
+BASELINE_VALIDATION = os.path.join(VALIDATION_DIR, 'serfes1991', 'baseline_serfes_validation.csv')
+BASELINE_SYNTHETIC = os.path.join(VALIDATION_DIR, 'serfes1991', 'baseline_serfes_synthetic.csv')
+
+
+def synthetic_data(n=144*40, seed=0):
+    ''' Random walks and a tide with NaN gaps, 10-minute timestep'''
+    rng = np.random.RandomState(seed)
+    data = pd.DataFrame({
+        'Datetime': pd.date_range('2010-01-01', periods=n, freq='10min'),
+        'A': rng.normal(0, 1, n).cumsum()*0.01 + 5,
+        'B': np.sin(np.arange(n)/10.)*3 + 100,
+        'C': rng.randint(0, 100, n)})
+    data.loc[3000:3010, 'A'] = np.nan
+    data.loc[5000, 'B'] = np.nan
+    return data
+
+
+class FilterSerfes1991Test(unittest.TestCase):
+    '''Compare `filter_wl_71h_serfes1991()` with the stored output of the chained rolling means'''
+
+    def assertEqualToBaseline(self, data, n, cols, baseline):
+        expected = pd.read_csv(baseline, float_precision='round_trip')
+        result = filter_wl_71h_serfes1991(data.copy(), N=n)
+        for col in cols:
+            a, b = result[col+'_mean'].values, expected[col+'_mean'].values
+            msg = 'column <{0}>'.format(col)
+            np.testing.assert_array_equal(np.isnan(a), np.isnan(b), err_msg=msg)
+            np.testing.assert_allclose(a[~np.isnan(a)], b[~np.isnan(b)], rtol=0, atol=1e-9, err_msg=msg)
+
+    def test_01_validation_dataset(self):
+        data = pd.read_excel(os.path.join(VALIDATION_DIR, 'serfes1991/validation_serfes.xlsx'), sheet_name='data')
+        data.loc[2000:2003, 'Krueckau'] = np.nan
+        self.assertEqualToBaseline(data, 144, ['Krueckau'], BASELINE_VALIDATION)
+
+    def test_02_many_columns_with_gaps(self):
+        self.assertEqualToBaseline(synthetic_data(144*15), 144, ['A', 'B', 'C'], BASELINE_SYNTHETIC)
+
+
+class IterFilterSerfes1991Test(unittest.TestCase):
+    '''Streaming filter must equal the in-memory filter bit by bit'''
+
+    def test_01_chunks_equal_in_memory(self):
+        data = synthetic_data()
+        for kwargs in ({}, {'verbose': True}, {'keep_origin': False}, {'usecols': ['B']}):
+            full = filter_wl_71h_serfes1991(data.copy(), N=144, **kwargs)
+            for chunksize in (1000, 1777, 5000, 10000):
+                chunks = (data.iloc[i:i+chunksize] for i in range(0, len(data), chunksize))
+                result = pd.concat(list(iter_filter_wl_71h_serfes1991(chunks, N=144, **kwargs)))
+                pd.testing.assert_frame_equal(result, full, check_exact=True)
+
+
+def record(steps, start='2010-01-01 03:17'):
+    ''' DataFrame with timestamps separated by `steps` (list of minutes)'''
+    minutes = np.r_[0, np.cumsum(steps)]
+    return pd.DataFrame({'Datetime': np.datetime64(start, 'ns') + (minutes*60*10**9).astype('timedelta64[ns]'),
+                         'value': np.arange(minutes.size, dtype=float)})
+
+
+class CollectWarnings(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class MeasurementsPerDayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = CollectWarnings()
+        filterSerfes1991.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        filterSerfes1991.logger.removeHandler(self.handler)
+
+    def measurements_per_day(self, data, **kwargs):
+        del self.handler.messages[:]
+        return get_number_of_measurements_per_day(data, return_segments=True, **kwargs)
+
+    def assertSegments(self, segments, data, rows):
+        ''' rows - list of (index of the start entry, index of the end entry, dt_min, dt_max [minutes])'''
+        t = data['Datetime'].values
+        self.assertEqual(list(segments.columns), ['start', 'end', 'n_steps', 'dt_min', 'dt_max'])
+        self.assertEqual(len(segments), len(rows))
+        for (i, row), (i0, i1, dt_min, dt_max) in zip(segments.iterrows(), rows):
+            self.assertEqual(row['start'], t[i0])
+            self.assertEqual(row['end'], t[i1])
+            self.assertEqual(row['n_steps'], i1 - i0)
+            self.assertEqual(row['dt_min'], pd.Timedelta(minutes=dt_min))
+            self.assertEqual(row['dt_max'], pd.Timedelta(minutes=dt_max))
+
+    def assertWarnings(self, n_segments, not_divisor):
+        messages = self.handler.messages
+        self.assertEqual(any('not a divisor of 24 hours' in m for m in messages), not_divisor, msg=messages)
+        self.assertEqual(any('{0} segments with irregular time steps'.format(n_segments) in m for m in messages), n_segments > 0, msg=messages)
+
+    def test_01_gappy_first_day(self):
+        # 10-minute steps for 5 days, the first day has a 3-hour gap and a missing entry
+        data = record([10]*(144*5)).drop(list(range(6, 24)) + [40]).reset_index(drop=True)
+        for kwargs in ({'datetime': 'Datetime'}, {}):
+            df = data if kwargs else data.set_index('Datetime')
+            N, segments = self.measurements_per_day(df, **kwargs)
+            self.assertEqual(N, 144)
+            self.assertSegments(segments, data, [(5, 6, 190, 190), (21, 22, 20, 20)])
+            self.assertWarnings(n_segments=2, not_divisor=False)
+        # regular record: no segments, no warnings
+        N, segments = self.measurements_per_day(record([10]*300), datetime='Datetime')
+        self.assertEqual((N, len(segments)), (144, 0))
+        self.assertEqual(self.handler.messages, [])
+        self.assertEqual(get_number_of_measurements_per_day(record([10]*300), datetime='Datetime'), 144)
+
+    def test_02_mixed_steps(self):
+        # mostly 7-minute steps (not a divisor of 24 hours), then 10-minute steps
+        data = record([7]*400 + [10]*300)
+        N, segments = self.measurements_per_day(data, datetime='Datetime')
+        self.assertEqual(N, int(round(1440/7.)))
+        self.assertSegments(segments, data, [(400, 700, 10, 10)])
+        self.assertWarnings(n_segments=1, not_divisor=True)
+
+        # mostly 10-minute steps, with a 7-minute part and a 7/12-minute part
+        data = record([7]*200 + [10]*300 + [7, 12]*20 + [10]*300)
+        N, segments = self.measurements_per_day(data, datetime='Datetime')
+        self.assertEqual(N, 144)
+        self.assertSegments(segments, data, [(0, 200, 7, 7), (500, 540, 7, 12)])
+        self.assertWarnings(n_segments=2, not_divisor=False)
+
+    def test_03_ties_are_broken_by_the_smallest_step(self):
+        for steps in ([15]*100 + [10]*100, [10]*100 + [15]*100, [30, 15, 10]*50, [10, 30, 15]*50):
+            N, segments = self.measurements_per_day(record(steps), datetime='Datetime')
+            self.assertEqual(N, 144, msg=steps[:3])
+            self.assertTrue((segments['dt_min'] > pd.Timedelta(minutes=10)).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
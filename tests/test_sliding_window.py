@@ -0,0 +1,51 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.sliding_window import sliding_window_timelag_efficiency
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_sliding_window -v
+
+"""
+
+
+def synthetic_hydrographs(days=40, dt_minutes=15, E=0.3, tlag_minutes=30, seed=0):
+    ''' River tide and a damped, delayed groundwater response with noise'''
+    rng = np.random.RandomState(seed)
+    t = np.arange(0, days*1440, dt_minutes)*60.
+    date = np.datetime64('2015-01-01') + t.astype('timedelta64[s]')
+    w = 1.5*np.cos(2*np.pi/(12.42*3600.)*t) + 0.3*np.cos(2*np.pi/(12.*3600.)*t + 0.5)
+    h = 2. + E*(1.5*np.cos(2*np.pi/(12.42*3600.)*(t - tlag_minutes*60.)) +
+                0.3*np.cos(2*np.pi/(12.*3600.)*(t - tlag_minutes*60.) + 0.5)) + 0.01*rng.randn(t.size)
+    return pd.DataFrame({'Datetime': date, 'gw': h}), pd.DataFrame({'Datetime': date, 'river': w})
+
+
+class SlidingWindowTest(unittest.TestCase):
+    '''Windows processed in parallel chunks must equal the serial result'''
+
+    def test_01_serial_equals_parallel(self):
+        df_gw, df_w = synthetic_hydrographs()
+        for tlag_tuple in ((0, 60, 5), (-60, -15, 15), (-30, 30, 10)):
+            kwargs = {'window': '7D', 'stride': '1D', 'tlag_tuple': tlag_tuple}
+            serial = sliding_window_timelag_efficiency(df_gw, 'gw', 'Datetime', df_w, 'river', 'Datetime', processes=1, **kwargs)
+            parallel = sliding_window_timelag_efficiency(df_gw, 'gw', 'Datetime', df_w, 'river', 'Datetime', processes=4, **kwargs)
+            msg = 'tlag_tuple={0}'.format(tlag_tuple)
+            self.assertEqual(len(serial), len(parallel), msg=msg)
+            for c in ('E', 'tlag', 'MSE'):
+                np.testing.assert_allclose(parallel[c].values, serial[c].values, rtol=1e-9, atol=1e-12, err_msg=msg)
+
+    def test_02_known_efficiency_and_timelag(self):
+        df_gw, df_w = synthetic_hydrographs(E=0.3, tlag_minutes=30)
+        windows = sliding_window_timelag_efficiency(df_gw, 'gw', 'Datetime', df_w, 'river', 'Datetime', '7D', '1D', tlag_tuple=(0, 60, 5))
+        np.testing.assert_allclose(windows['E'].values, 0.3, rtol=0.02)
+        self.assertTrue((windows['tlag'] == 30).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from __future__ import print_function
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.TidalEfficiency import tidalEfficiency_method3
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_tidalefficiency -v
+
+"""
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation')
+# E of every cycle of `synthetic_cycles()`, written by the loop of `tidalEfficiency_method3()` before the vectorization
+BASELINE_E = os.path.join(VALIDATION_DIR, 'time_lag_+_tidal_efficiency', 'baseline_tidal_efficiency_method3.csv')
+
+
+def synthetic_cycles(n_cycles=200, E=0.3, tlag_minutes=30, seed=1):
+    ''' River and groundwater tides (10-minute timestep) with a NaN gap in the
+    groundwater, and the times of the MIN/MAX peaks of every cycle'''
+    T = 12.42*3600
+    n = int((n_cycles + 2)*T/600)
+    x = np.arange(n)*600.
+    date = pd.date_range('2000-01-01', periods=n, freq='10min')
+    df = pd.DataFrame({'Datetime': date,
+                       'river': 1000 + np.cos(2*np.pi*x/T),
+                       'gw': 3 + E*np.cos(2*np.pi*(x - tlag_minutes*60)/T) + np.random.RandomState(seed).normal(0, .01, n)})
+    df.loc[500:600, 'gw'] = np.nan
+    k = np.arange(1, n_cycles)
+    tmin = date[0] + pd.to_timedelta(k*T + T/2, 's')
+    tmax = tmin + pd.to_timedelta(T/2, 's')
+    tmin = pd.Series(tmin.round('10min'))
+    tmax = pd.Series(tmax.round('10min'))
+    lag = pd.Timedelta(minutes=tlag_minutes)
+    return df, tmin, tmax, tmin + lag, tmax + lag
+
+
+class TidalEfficiencyMethod3Test(unittest.TestCase):
+
+    def test_01_equals_baseline(self):
+        df, tmin, tmax, gmin, gmax = synthetic_cycles()
+        E, E_cyclic = tidalEfficiency_method3(df, 'river', 'gw', 'Datetime', tmin, tmax, gmin, gmax)
+        E_cyclic_ref = pd.read_csv(BASELINE_E, float_precision='round_trip')['E_cyclic'].values
+        np.testing.assert_allclose(E_cyclic, E_cyclic_ref, rtol=1e-9)
+        self.assertAlmostEqual(E, np.nanmean(E_cyclic_ref), places=12)
+        self.assertAlmostEqual(E, 0.3, places=2)
+
+    def test_02_skipped_cycles_are_nan(self):
+        df, tmin, tmax, gmin, gmax = synthetic_cycles()
+        gmin[3] = pd.NaT
+        E, E_cyclic, skipped = tidalEfficiency_method3(df, 'river', 'gw', 'Datetime', tmin, tmax, gmin, gmax, return_skipped=True)
+        self.assertEqual(E_cyclic.size, len(tmin))
+        self.assertIn(3, skipped)
+        self.assertTrue(np.isnan(E_cyclic[skipped]).all())
+        self.assertFalse(np.isnan(np.delete(E_cyclic, skipped)).any())
+        self.assertAlmostEqual(E, np.nanmean(E_cyclic), places=12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+from __future__ import print_function
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.functions.TimeLag import (erskine1991_sse_curve, timelag_erskine1991_adaptive, timelag_erskine1991_method,
+    timelag_crosscorrelation_method, crosscorrelation_curve, crosscorrelation_maximum)
+
+"""
+to run this test
+
+    $ cd pygwa
+    $ python -m tests.test_timelag -v
+
+"""
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation')
+# SSE of every timelag, written by the loop of `timelag_erskine1991_method()` before the vectorization
+BASELINE_SSE = os.path.join(VALIDATION_DIR, 'time_lag_+_tidal_efficiency', 'baseline_erskine1991_sse.csv')
+
+
+def hydrograph(start, n, freq_minutes, shift_minutes=0., E=1., seed=0, nan_fraction=0.05):
+    rng = np.random.RandomState(seed)
+    t = np.datetime64(start, 'ns') + (np.arange(n)*freq_minutes*60).astype('timedelta64[s]')
+    minutes = np.arange(n)*freq_minutes - shift_minutes
+    v = E*np.sin(2*np.pi*minutes/745.) + 0.01*rng.randn(n)
+    v[rng.rand(n) < nan_fraction] = np.nan
+    return t, v
+
+
+class ErskineSSECurveTest(unittest.TestCase):
+    '''Compare `erskine1991_sse_curve()` with the stored output of the loop over timelags'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = pd.read_csv(BASELINE_SSE, float_precision='round_trip')
+
+    def assertEqualToBaseline(self, case, gw_t, gw_v, w_t, w_v, E):
+        expected = self.baseline[self.baseline['case'] == case]
+        self.assertGreater(len(expected), 0)
+        tlags = expected['tlag [min]'].values.astype('timedelta64[m]')
+        SSE, N = erskine1991_sse_curve(gw_t, gw_v, w_t, w_v, E, tlags)
+        matched = N > 0
+        np.testing.assert_allclose(SSE[matched], expected['SSE'].values[matched], rtol=1e-9)
+        # lags without any matching timestamp are NaN now, the loop summed them up to zero
+        self.assertTrue(np.isnan(SSE[~matched]).all())
+        self.assertTrue((expected['SSE'].values[~matched] == 0).all())
+
+    def test_01_same_grid(self):
+        w_t, w_v = hydrograph('2015-01-01', 3000, 10, seed=1)
+        gw_t, gw_v = hydrograph('2015-01-01', 3000, 10, shift_minutes=30, E=0.5, seed=2)
+        self.assertEqualToBaseline('same_grid', gw_t, gw_v, w_t, w_v, 0.5)
+
+    def test_02_strided_grid(self):
+        # groundwater every 20 minutes on the 10-minute river grid
+        w_t, w_v = hydrograph('2015-01-01', 3000, 10, seed=1)
+        gw_t, gw_v = hydrograph('2015-01-02', 1000, 20, shift_minutes=60, E=0.5, seed=2)
+        self.assertEqualToBaseline('strided_grid', gw_t, gw_v, w_t, w_v, 0.5)
+
+    def test_03_off_grid(self):
+        # groundwater every 5 minutes, shifted by 5 minutes from the 10-minute river grid
+        w_t, w_v = hydrograph('2015-01-01', 3000, 10, seed=1)
+        gw_t, gw_v = hydrograph('2015-01-01 00:05', 5000, 5, shift_minutes=15, E=0.3, seed=2)
+        self.assertEqualToBaseline('off_grid', gw_t, gw_v, w_t, w_v, 0.3)
+
+    def test_04_irregular_river(self):
+        w_t, w_v = hydrograph('2015-01-01', 3000, 10, seed=1)
+        w_t = np.delete(w_t, np.arange(0, 3000, 7))
+        w_v = np.delete(w_v, np.arange(0, 3000, 7))
+        w_t[3] += np.timedelta64(1, 'm')
+        gw_t, gw_v = hydrograph('2015-01-01', 2000, 10, shift_minutes=20, seed=2)
+        self.assertEqualToBaseline('irregular_river', gw_t, gw_v, w_t, w_v, 1.)
+
+
+def tide_pair(lag_seconds, E=0.4, period=3600., hours=6, seed=0):
+    ''' River every second and groundwater every minute, the groundwater
+    is the river damped by `E` and delayed by `lag_seconds` plus noise'''
+    def tide(x):
+        return np.sin(2*np.pi*x/period) + 0.3*np.sin(4*np.pi*x/period + 1.)
+    t0 = np.datetime64('2015-01-01T00:00:00', 'ns')
+    tw = np.arange(0, hours*3600 + 1200, 1.)
+    tg = np.arange(1200, hours*3600, 60.)
+    river = pd.DataFrame({'t': t0 + (tw*1e9).astype('timedelta64[ns]'), 'v': tide(tw)})
+    gw = pd.DataFrame({'t': t0 + (tg*1e9).astype('timedelta64[ns]'),
+                       'v': 2. + E*tide(tg - lag_seconds) + np.random.RandomState(seed).normal(0, 0.02, tg.size)})
+    return gw, river
+
+
+class ErskineAdaptiveTest(unittest.TestCase):
+    '''Coarse-to-fine search against a brute-force scan of `erskine1991_sse_curve()`'''
+
+    def test_01_known_lag(self):
+        E, lag = 0.4, 437.
+        gw, river = tide_pair(lag, E=E)
+        lags = np.arange(0, 1201)  # every second within 0..20 minutes
+        SSE, N = erskine1991_sse_curve(gw['t'].values, gw['v'].values, river['t'].values, river['v'].values, E, lags.astype('timedelta64[s]'))
+        brute = lags[np.nanargmin(SSE)]
+        for resolution in (1., 10.):
+            for n_coarse in (8, 16):
+                msg = 'resolution={0}, n_coarse={1}'.format(resolution, n_coarse)
+                tlag, extra = timelag_erskine1991_adaptive(gw, 'v', 't', river, 'v', 't', E, tlag_range=(0, 20),
+                                                           n_coarse=n_coarse, resolution=resolution)
+                self.assertAlmostEqual(tlag.total_seconds(), brute, delta=resolution, msg=msg)
+                # coarse scan + golden-section steps within the bracket of two coarse steps + a few extra evaluations
+                bracket = 2*1200./(n_coarse - 1)
+                n_golden = int(np.ceil(np.log(bracket/resolution)/np.log((1. + np.sqrt(5.))/2.)))
+                self.assertLessEqual(extra['n_evaluations'], n_coarse + n_golden + 6, msg=msg)
+                self.assertLess(extra['n_evaluations'], 1200./resolution/4, msg=msg)
+                self.assertEqual(len(extra['curve']), extra['n_evaluations'], msg=msg)
+                ci = [t.total_seconds() for t in extra['ci']]
+                self.assertTrue(ci[0] < lag < ci[1], msg='{0}: {1} not within {2}'.format(msg, lag, ci))
+                self.assertTrue(ci[0] < tlag.total_seconds() < ci[1], msg=msg)
+
+    def test_02_no_overlap_raises(self):
+        gw, river = tide_pair(100.)
+        with self.assertRaises(ValueError):
+            timelag_erskine1991_adaptive(gw, 'v', 't', river, 'v', 't', 0.4, tlag_range=(-600, -500))
+
+
+class CrossCorrelationTest(unittest.TestCase):
+    '''Timelag from the maximum of the cross-correlation, river and groundwater every minute'''
+    E = 0.4
+
+    def pair(self, lag_seconds):
+        gw, river = tide_pair(lag_seconds, E=self.E, hours=12)
+        return gw, river.iloc[::60].reset_index(drop=True)
+
+    def test_01_off_grid_lag(self):
+        gw, river = self.pair(437.)
+        tlag, curve = timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=(0, 20), return_curve=True)
+        # the curve is known every minute only (420 s or 480 s), the parabola refines the maximum
+        self.assertAlmostEqual(tlag.total_seconds(), 437., delta=10.)
+        np.testing.assert_array_equal(curve['tlag'].values, np.arange(0, 21))
+        self.assertEqual(curve['tlag'].values[np.nanargmax(curve['r'].values)], 7)
+
+        tlags, r = crosscorrelation_curve(gw['t'].values, gw['v'].values, river['t'].values, river['v'].values, self.E)
+        minutes, i_max, inside = crosscorrelation_maximum(tlags, r, tlag_range=(0, 20))
+        self.assertAlmostEqual(minutes*60., tlag.total_seconds(), places=5)
+        self.assertEqual(tlags[i_max], np.timedelta64(7, 'm'))
+        np.testing.assert_array_equal(r[inside], curve['r'].values)
+
+    def test_02_negative_range(self):
+        gw, river = self.pair(-300.)
+        tlag = timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=(-20, 0))
+        self.assertAlmostEqual(tlag.total_seconds(), -300., delta=10.)
+        # the maximum is searched only within the range, a maximum at its border is not refined out of it
+        tlag = timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=(1, 20))
+        self.assertEqual(tlag.total_seconds(), 60.)
+
+    def test_03_gaps_in_well(self):
+        gw, river = self.pair(437.)
+        gw.loc[100:180, 'v'] = np.nan
+        gw.loc[300:320, 'v'] = np.nan
+        tlag = timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=(0, 20))
+        self.assertAlmostEqual(tlag.total_seconds(), 437., delta=10.)
+
+        gw['v'] = np.nan
+        with self.assertRaises(ValueError):
+            timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=(0, 20))
+
+    def test_04_agrees_with_erskine(self):
+        for lag, tlag_range in ((437., (0, 20)), (90., (0, 20)), (-300., (-20, 0))):
+            gw, river = self.pair(lag)
+            xcorr = timelag_crosscorrelation_method(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=tlag_range).total_seconds()
+            erskine = timelag_erskine1991_method(gw, 'v', 't', river, 'v', 't', self.E,
+                                                 tlag_tuple=(tlag_range[0], tlag_range[1]+1, 1)).total_seconds()
+            adaptive = timelag_erskine1991_adaptive(gw, 'v', 't', river, 'v', 't', self.E, tlag_range=tlag_range)[0].total_seconds()
+            self.assertLessEqual(abs(xcorr - erskine), 60., msg=lag)  # erskine is restricted to the 1-minute steps
+            self.assertAlmostEqual(xcorr, adaptive, delta=10., msg=lag)
+
+
+if __name__ == '__main__':
+    unittest.main()